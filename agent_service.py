@@ -0,0 +1,293 @@
+# agent_service.py
+#
+# Server-side agent service shared by every Streamlit session. Questions go
+# into a bounded queue served by a fixed pool of worker threads, so load from
+# many users turns into queueing instead of a pile of threads. On top of that:
+#   - per-session conversation memory (recent turns plus a summary of older
+#     ones, within a token budget; see prompt_context);
+#   - a cap on concurrent LLM runs, with a shared cooldown and retries with
+#     backoff when the provider rate-limits;
+#   - request coalescing: identical questions already in flight share one
+#     execution, and late joiners replay the events they missed;
+#   - queue depth, wait time, coalescing and per-query token metrics (tracing
+#     gauges and spans).
+
+import os
+import re
+import time
+import queue
+import random
+import threading
+import contextlib
+from collections import OrderedDict, deque
+
+from ai_agent import stream_gemini_query, is_rate_limit_error, QUERY_TIMEOUT_SECONDS
+from prompt_context import ConversationHistory, with_history
+from tracing import TRACER, count
+
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "8"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+AGENT_QUEUE_SIZE = int(os.getenv("AGENT_QUEUE_SIZE", "64"))
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF_SECONDS = 2.0
+RATE_LIMIT_BACKOFF_MAX_SECONDS = 60.0
+SESSION_TTL_SECONDS = 3600
+MAX_SESSIONS = 1000
+
+_RETRY_HINT_RE = re.compile(r"retry in ([\d.]+)\s*s|retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE)
+
+class ServiceBusy(RuntimeError):
+    """Raised when the request queue is full."""
+
+class SessionMemory:
+    """A ConversationHistory per session; idle sessions expire."""
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session id -> (last used, ConversationHistory)
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._sessions:
+            session_id, (last_used, _) = next(iter(self._sessions.items()))
+            if now - last_used < self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def history(self, session_id):
+        """The session's rendered history ("" for a new session)."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return entry[1].render() if entry else ""
+
+    def add(self, session_id, question, answer):
+        now = time.monotonic()
+        with self._lock:
+            _, history = self._sessions.pop(session_id, (now, None))
+            history = history or ConversationHistory()
+            history.add(question, answer)
+            self._sessions[session_id] = (now, history)
+            self._expire(now)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+def _coalesce_key(question, history):
+    return " ".join(with_history(question, history).lower().split())
+
+class _Job:
+    """One agent execution, shared by every subscriber asking the same thing."""
+
+    def __init__(self, key, question, history, timeout):
+        self.key = key
+        self.question = question
+        self.history = history
+        self.timeout = timeout
+        self.submitted = time.perf_counter()
+        self.cancel = threading.Event()
+        self.events = []       # replayed to late subscribers
+        self.subscribers = []  # queue.Queue per subscriber
+        self.done = False
+
+class AgentService:
+    """Runs agent questions for all sessions on a bounded worker pool."""
+
+    def __init__(self, agent_executor, cache=None, templates=None, workers=AGENT_WORKERS,
+                 llm_concurrency=LLM_CONCURRENCY, queue_size=AGENT_QUEUE_SIZE, memory=None, prompt_context=None):
+        self.agent_executor = agent_executor
+        self.cache = cache
+        self.templates = templates
+        self.prompt_context = prompt_context
+        self.memory = memory if memory is not None else SessionMemory()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._inflight = {}  # coalescing key -> _Job, while queued or running
+        self._lock = threading.Lock()
+        self._llm_slots = threading.BoundedSemaphore(llm_concurrency)
+        self._cooldown_until = 0.0
+        self._running = 0
+        self._llm_active = 0
+        self._waits = deque(maxlen=500)
+        self._usage = deque(maxlen=500)  # usage of recent agent runs (not cache or template answers)
+        self.coalesced = 0
+        self.rate_limited = 0
+        self._workers = [threading.Thread(target=self._work, name=f"floatchat-agent-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+        TRACER.gauge("agent_queue_depth", self._queue.qsize)
+        TRACER.gauge("agent_running", lambda: self._running)
+        TRACER.gauge("agent_llm_active", lambda: self._llm_active)
+
+    # --- Client side ---
+
+    def stream(self, session_id, question, timeout=QUERY_TIMEOUT_SECONDS):
+        """
+        Yields the same events as ai_agent.stream_gemini_query, plus
+        {"type": "queued", "position"} while waiting and {"type": "retry", "delay"}
+        before a rate-limited run is retried. Raises ServiceBusy if the queue is
+        full. The answer is added to the session's memory. Closing the generator
+        unsubscribes; a job is cancelled once nobody is listening any more.
+        """
+        job, inbox = self._subscribe(question, self.memory.history(session_id), timeout)
+        try:
+            while True:
+                event = inbox.get()
+                if event is None:
+                    return
+                if isinstance(event, Exception):
+                    raise event
+                if event["type"] == "final":
+                    self.memory.add(session_id, question, event["text"])
+                yield event
+        finally:
+            self._unsubscribe(job, inbox)
+
+    def ask(self, session_id, question, timeout=QUERY_TIMEOUT_SECONDS):
+        """Blocking variant of stream(); returns the final answer text."""
+        for event in self.stream(session_id, question, timeout):
+            if event["type"] == "final":
+                return event["text"]
+        return ""
+
+    def stats(self):
+        waits = sorted(self._waits)
+        usage = list(self._usage)
+
+        def mean(values):
+            values = list(values)
+            return round(sum(values) / len(values)) if values else 0
+
+        return {
+            "queued": self._queue.qsize(),
+            "running": self._running,
+            "llm_active": self._llm_active,
+            "sessions": len(self.memory),
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "wait_ms_mean": round(sum(waits) / len(waits) * 1000) if waits else 0,
+            "wait_ms_p95": round(waits[int(0.95 * (len(waits) - 1))] * 1000) if waits else 0,
+            "llm_calls_mean": round(sum(u["llm_calls"] for u in usage) / len(usage), 1) if usage else 0,
+            "input_tokens_mean": mean(u["input_tokens"] for u in usage),
+            "output_tokens_mean": mean(u["output_tokens"] for u in usage),
+            "context_tokens_mean": mean(sum(u["context_tokens"].values()) for u in usage),
+        }
+
+    def _subscribe(self, question, history, timeout):
+        inbox = queue.Queue()
+        key = _coalesce_key(question, history)
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is not None and not job.cancel.is_set():
+                self.coalesced += 1
+                count("agent_requests", outcome="coalesced")
+            else:
+                job = _Job(key, question, history, timeout)
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    count("agent_requests", outcome="rejected")
+                    raise ServiceBusy("FloatChat is busy right now; please try again in a moment.") from None
+                self._inflight[key] = job
+                count("agent_requests", outcome="queued")
+                inbox.put({"type": "queued", "position": self._queue.qsize()})
+            for event in job.events:
+                inbox.put(event)
+            if job.done:
+                inbox.put(None)
+            else:
+                job.subscribers.append(inbox)
+        return job, inbox
+
+    def _unsubscribe(self, job, inbox):
+        with self._lock:
+            if inbox in job.subscribers:
+                job.subscribers.remove(inbox)
+            if not job.subscribers and not job.done:
+                job.cancel.set()
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+
+    # --- Worker side ---
+
+    def _publish(self, job, event, final=False):
+        with self._lock:
+            if event is not None:
+                job.events.append(event)
+            for inbox in job.subscribers:
+                inbox.put(event)
+            if final:
+                job.done = True
+                for inbox in job.subscribers:
+                    inbox.put(None)
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+
+    @contextlib.contextmanager
+    def _llm_slot(self):
+        """Holds one of the LLM slots; waits out a provider cooldown first."""
+        with self._llm_slots:
+            delay = self._cooldown_until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                self._llm_active += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._llm_active -= 1
+
+    def _back_off(self, attempt, exc):
+        """Starts a cooldown shared by all workers; honours the provider's retry hint."""
+        match = _RETRY_HINT_RE.search(str(exc))
+        if match:
+            delay = float(match.group(1) or match.group(2))
+        else:
+            delay = RATE_LIMIT_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random())
+        delay = min(delay, RATE_LIMIT_BACKOFF_MAX_SECONDS)
+        with self._lock:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+        return delay
+
+    def _run(self, job):
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                for event in stream_gemini_query(job.question, self.agent_executor, cache=self.cache,
+                                                 templates=self.templates, timeout=job.timeout,
+                                                 cancel_event=job.cancel, agent_slot=self._llm_slot,
+                                                 prompt_context=self.prompt_context, history=job.history):
+                    if event["type"] == "final" and event["source"] == "agent":
+                        self._usage.append(event["usage"])
+                    self._publish(job, event)
+                return
+            except Exception as exc:
+                if not is_rate_limit_error(exc) or attempt == RATE_LIMIT_RETRIES or job.cancel.is_set():
+                    raise
+                self.rate_limited += 1
+                count("llm_rate_limited")
+                delay = self._back_off(attempt, exc)
+                self._publish(job, {"type": "retry", "attempt": attempt + 1, "delay": round(delay, 1)})
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            waited = time.perf_counter() - job.submitted
+            self._waits.append(waited)
+            TRACER.record("agent_queue_wait", waited)
+            if job.cancel.is_set():
+                continue  # everyone gave up while it was queued
+            with self._lock:
+                self._running += 1
+            try:
+                self._run(job)
+                self._publish(job, None, final=True)
+            except Exception as exc:
+                self._publish(job, exc, final=True)
+            finally:
+                with self._lock:
+                    self._running -= 1
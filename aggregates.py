@@ -0,0 +1,236 @@
+# aggregates.py
+#
+# Pre-aggregated summary tables so that common questions (averages, ranges,
+# per-float or per-month statistics) are answered from thousands of rows
+# instead of scanning `measurements`. Summaries are refreshed incrementally
+# for the profiles written by each ingestion transaction.
+
+from sqlalchemy import text
+from level_storage import levels_relation, AGENT_HINT as LEVELS_HINT
+from spatial_index import AGENT_HINT as REGIONS_HINT
+
+# Pressure bins (dbar) for the depth-binned tables.
+DEPTH_BINS = [(0, 100), (100, 500), (500, 2000)]
+CELL_DEG = 5
+
+# Applied by db_schema.migrate().
+SUMMARY_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS profile_summary (
+        profile_id INTEGER PRIMARY KEY REFERENCES profiles (profile_id) ON DELETE CASCADE,
+        float_id INTEGER NOT NULL,
+        cycle_number INTEGER,
+        profile_date TIMESTAMP,
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION,
+        n_levels INTEGER NOT NULL,
+        max_pressure REAL,
+        n_temperature INTEGER NOT NULL,
+        min_temperature REAL,
+        max_temperature REAL,
+        avg_temperature DOUBLE PRECISION,
+        n_salinity INTEGER NOT NULL,
+        min_salinity REAL,
+        max_salinity REAL,
+        avg_salinity DOUBLE PRECISION
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS profile_summary_float_idx ON profile_summary (float_id)",
+    """
+    CREATE TABLE IF NOT EXISTS profile_depth_bins (
+        profile_id INTEGER NOT NULL REFERENCES profiles (profile_id) ON DELETE CASCADE,
+        depth_bin TEXT NOT NULL,
+        n_temperature INTEGER NOT NULL,
+        sum_temperature DOUBLE PRECISION,
+        n_salinity INTEGER NOT NULL,
+        sum_salinity DOUBLE PRECISION,
+        PRIMARY KEY (profile_id, depth_bin)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS float_summary (
+        float_id INTEGER PRIMARY KEY,
+        wmo_id TEXT,
+        n_profiles INTEGER NOT NULL,
+        first_profile_date TIMESTAMP,
+        last_profile_date TIMESTAMP,
+        min_latitude DOUBLE PRECISION,
+        max_latitude DOUBLE PRECISION,
+        min_longitude DOUBLE PRECISION,
+        max_longitude DOUBLE PRECISION,
+        n_measurements BIGINT NOT NULL,
+        min_temperature REAL,
+        max_temperature REAL,
+        avg_temperature DOUBLE PRECISION,
+        min_salinity REAL,
+        max_salinity REAL,
+        avg_salinity DOUBLE PRECISION
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS depth_climatology (
+        month DATE NOT NULL,
+        lat_cell DOUBLE PRECISION NOT NULL,
+        lon_cell DOUBLE PRECISION NOT NULL,
+        depth_bin TEXT NOT NULL,
+        n_profiles INTEGER NOT NULL,
+        n_temperature BIGINT NOT NULL,
+        avg_temperature DOUBLE PRECISION,
+        n_salinity BIGINT NOT NULL,
+        avg_salinity DOUBLE PRECISION,
+        PRIMARY KEY (month, lat_cell, lon_cell, depth_bin)
+    )
+    """,
+]
+
+# Short description handed to the SQL agent so it prefers these tables.
+AGENT_HINT = f"""
+Pre-aggregated tables are available and are much faster than scanning `measurements`:
+- profile_summary: one row per profile with date, position, level count and min/max/avg temperature and salinity.
+- float_summary: one row per float (wmo_id) with profile count, date range, position range and min/max/avg temperature and salinity.
+- depth_climatology: monthly averages per {CELL_DEG}-degree lat/lon cell (lat_cell/lon_cell are the cell's south-west corner) and depth_bin ({', '.join(f'{lo}-{hi}' for lo, hi in DEPTH_BINS)} dbar).
+Use them for averages, ranges and counts; only query `measurements` when individual levels are needed.
+""" + LEVELS_HINT + REGIONS_HINT
+
+def _depth_bin_case(column='pressure'):
+    cases = " ".join(f"WHEN {column} >= {lo} AND {column} < {hi} THEN '{lo}-{hi}'" for lo, hi in DEPTH_BINS)
+    return f"CASE {cases} END"
+
+# Cell of a profile in depth_climatology.
+_CELL = f"""date_trunc('month', p.profile_date)::date AS month,
+           floor(p.latitude / {CELL_DEG}) * {CELL_DEG} AS lat_cell,
+           floor(p.longitude / {CELL_DEG}) * {CELL_DEG} AS lon_cell"""
+
+def climatology_cells(session, profile_ids):
+    """The (month, lat_cell, lon_cell) climatology cells the given profiles fall into."""
+    return [tuple(row) for row in session.execute(text(f"""
+    SELECT DISTINCT {_CELL} FROM profiles p
+    WHERE p.profile_id = ANY(:ids) AND p.profile_date IS NOT NULL AND p.latitude IS NOT NULL
+    """), {'ids': [int(pid) for pid in profile_ids]})]
+
+def _lock_keys(session, namespace, keys_sql, params):
+    """
+    Takes a transaction-level advisory lock per key, in sorted order so that
+    concurrent writers cannot deadlock. Held until the caller commits.
+    """
+    session.execute(text(f"""
+    SELECT pg_advisory_xact_lock(hashtext('{namespace}'), k)
+    FROM ({keys_sql} ORDER BY 1) keys (k)
+    """), params)
+
+def refresh_summaries(session, profile_ids, layout=None, stale_cells=()):
+    """
+    Recomputes the summaries touched by the given profiles inside the caller's
+    transaction: their own profile/depth-bin rows, their floats and the
+    climatology cells they fall into. `stale_cells` are cells of profiles that
+    were deleted (see climatology_cells) and are recomputed as well. Levels are
+    read from the table of the given storage layout (default STORAGE_LAYOUT).
+    Floats and cells are locked, so concurrent writers serialize on shared rows.
+    """
+    ids = [int(pid) for pid in profile_ids]
+    stale_cells = list(stale_cells)
+    if not ids and not stale_cells:
+        return
+    params = {'ids': ids}
+    levels = levels_relation(layout)
+
+    session.execute(text(f"""
+    INSERT INTO profile_summary
+    SELECT p.profile_id, p.float_id, p.cycle_number, p.profile_date, p.latitude, p.longitude,
+           count(m.profile_id), max(m.pressure),
+           count(m.temperature), min(m.temperature), max(m.temperature), avg(m.temperature),
+           count(m.salinity), min(m.salinity), max(m.salinity), avg(m.salinity)
+    FROM profiles p LEFT JOIN {levels} m ON m.profile_id = p.profile_id
+    WHERE p.profile_id = ANY(:ids)
+    GROUP BY p.profile_id
+    ON CONFLICT (profile_id) DO UPDATE SET
+        n_levels = EXCLUDED.n_levels, max_pressure = EXCLUDED.max_pressure,
+        n_temperature = EXCLUDED.n_temperature, min_temperature = EXCLUDED.min_temperature,
+        max_temperature = EXCLUDED.max_temperature, avg_temperature = EXCLUDED.avg_temperature,
+        n_salinity = EXCLUDED.n_salinity, min_salinity = EXCLUDED.min_salinity,
+        max_salinity = EXCLUDED.max_salinity, avg_salinity = EXCLUDED.avg_salinity
+    """), params)
+
+    session.execute(text("DELETE FROM profile_depth_bins WHERE profile_id = ANY(:ids)"), params)
+    session.execute(text(f"""
+    INSERT INTO profile_depth_bins
+    SELECT profile_id, depth_bin, count(temperature), sum(temperature), count(salinity), sum(salinity)
+    FROM (SELECT profile_id, temperature, salinity, {_depth_bin_case()} AS depth_bin
+          FROM {levels} WHERE profile_id = ANY(:ids)) binned
+    WHERE depth_bin IS NOT NULL
+    GROUP BY profile_id, depth_bin
+    """), params)
+
+    _lock_keys(session, 'float_summary',
+               "SELECT DISTINCT float_id FROM profiles WHERE profile_id = ANY(:ids)", params)
+    session.execute(text("""
+    INSERT INTO float_summary
+    SELECT s.float_id, f.wmo_id, count(*), min(s.profile_date), max(s.profile_date),
+           min(s.latitude), max(s.latitude), min(s.longitude), max(s.longitude),
+           sum(s.n_levels),
+           min(s.min_temperature), max(s.max_temperature),
+           sum(s.avg_temperature * s.n_temperature) / NULLIF(sum(s.n_temperature), 0),
+           min(s.min_salinity), max(s.max_salinity),
+           sum(s.avg_salinity * s.n_salinity) / NULLIF(sum(s.n_salinity), 0)
+    FROM profile_summary s JOIN floats f ON f.float_id = s.float_id
+    WHERE s.float_id IN (SELECT float_id FROM profiles WHERE profile_id = ANY(:ids))
+    GROUP BY s.float_id, f.wmo_id
+    ON CONFLICT (float_id) DO UPDATE SET
+        n_profiles = EXCLUDED.n_profiles,
+        first_profile_date = EXCLUDED.first_profile_date, last_profile_date = EXCLUDED.last_profile_date,
+        min_latitude = EXCLUDED.min_latitude, max_latitude = EXCLUDED.max_latitude,
+        min_longitude = EXCLUDED.min_longitude, max_longitude = EXCLUDED.max_longitude,
+        n_measurements = EXCLUDED.n_measurements,
+        min_temperature = EXCLUDED.min_temperature, max_temperature = EXCLUDED.max_temperature,
+        avg_temperature = EXCLUDED.avg_temperature,
+        min_salinity = EXCLUDED.min_salinity, max_salinity = EXCLUDED.max_salinity,
+        avg_salinity = EXCLUDED.avg_salinity
+    """), params)
+
+    session.execute(text("""
+    CREATE TEMP TABLE touched_cells (month DATE, lat_cell DOUBLE PRECISION, lon_cell DOUBLE PRECISION)
+    """))
+    session.execute(text(f"""
+    INSERT INTO touched_cells
+    SELECT {_CELL} FROM profiles p
+    WHERE p.profile_id = ANY(:ids) AND p.profile_date IS NOT NULL AND p.latitude IS NOT NULL
+    UNION
+    SELECT * FROM unnest(CAST(:months AS date[]), CAST(:lats AS float8[]), CAST(:lons AS float8[]))
+    """), {**params, 'months': [c[0] for c in stale_cells],
+           'lats': [float(c[1]) for c in stale_cells], 'lons': [float(c[2]) for c in stale_cells]})
+    _lock_keys(session, 'depth_climatology',
+               "SELECT hashtext(concat_ws(':', month, lat_cell, lon_cell)) FROM touched_cells", {})
+    session.execute(text("""
+    DELETE FROM depth_climatology c USING touched_cells t
+    WHERE c.month = t.month AND c.lat_cell = t.lat_cell AND c.lon_cell = t.lon_cell
+    """))
+    session.execute(text(f"""
+    INSERT INTO depth_climatology
+    SELECT g.month, g.lat_cell, g.lon_cell, g.depth_bin, count(DISTINCT g.profile_id),
+           sum(g.n_temperature), sum(g.sum_temperature) / NULLIF(sum(g.n_temperature), 0),
+           sum(g.n_salinity), sum(g.sum_salinity) / NULLIF(sum(g.n_salinity), 0)
+    FROM (SELECT {_CELL}, b.* FROM profiles p JOIN profile_depth_bins b ON b.profile_id = p.profile_id) g
+    JOIN touched_cells t ON g.month = t.month AND g.lat_cell = t.lat_cell AND g.lon_cell = t.lon_cell
+    GROUP BY g.month, g.lat_cell, g.lon_cell, g.depth_bin
+    """))
+    session.execute(text("DROP TABLE touched_cells"))
+
+def rebuild_all(engine, batch_size=5000, after_profile_id=0, layout=None, stale_cells=()):
+    """
+    Recomputes every summary from scratch, in batches of profiles. With
+    after_profile_id only profiles inserted after that id are refreshed, plus
+    the `stale_cells` of profiles deleted since (see refresh_summaries).
+    """
+    from sqlalchemy.orm import Session
+    with engine.connect() as conn:
+        ids = [row[0] for row in conn.execute(text(
+            "SELECT profile_id FROM profiles WHERE profile_id > :after ORDER BY profile_id"),
+            {'after': after_profile_id})]
+    for start in range(0, len(ids), batch_size):
+        with Session(engine) as session:
+            refresh_summaries(session, ids[start:start + batch_size], layout)
+            session.commit()
+    if stale_cells:
+        with Session(engine) as session:
+            refresh_summaries(session, [], layout, stale_cells=stale_cells)
+            session.commit()
@@ -1,18 +1,28 @@
 # ai_agent.py (Refactored for Streamlit with Gemini)
 
 import os
+import ast
+import time
+import queue
+import asyncio
+import threading
+import contextlib
 from pathlib import Path
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from langchain_community.utilities import SQLDatabase
-from langchain_community.agent_toolkits import create_sql_agent
-from langchain_google_genai import ChatGoogleGenerativeAI
+from startup import STARTUP_TIMER
+from tracing import TRACER, span, langchain_callbacks
+
+# SQLAlchemy, LangChain and the Gemini client are imported inside the functions
+# that need them, so importing this module (and starting the app) stays cheap.
 
 # --- Load Environment Variables ---
 load_dotenv(dotenv_path=Path(__file__).with_name(".env"))
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# Upper bound for one question, including every LLM and SQL round trip.
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "90"))
+
 # --- Database Configuration ---
 DB_USER = 'postgres'
 DB_PASSWORD = '123456'  # Your correct password
@@ -21,49 +31,305 @@ DB_PORT = '5432'
 DB_NAME = 'argo_db'
 DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-def initialize_agent():
+def get_engine():
+    """
+    Returns the process-wide read-only engine (see sql_guard), so the agent and
+    the caches share one bounded, warm pool across all Streamlit sessions.
+    """
+    from sql_guard import get_readonly_engine
+    return get_readonly_engine(DATABASE_URL)
+
+def is_api_key_error(exc):
+    """True if Gemini rejected the request (invalid or missing API key)."""
+    from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+    return isinstance(exc, ChatGoogleGenerativeAIError)
+
+def is_rate_limit_error(exc):
+    """True if the LLM provider throttled the request (HTTP 429, quota or resource exhausted)."""
+    message = f"{type(exc).__name__} {exc}".lower()
+    return any(marker in message for marker in ("429", "resourceexhausted", "resource_exhausted",
+                                                "rate limit", "ratelimit", "quota"))
+
+def initialize_agent(llm=None, engine=None):
     """
     Initializes and returns the Gemini-powered SQL agent.
     This function will be imported by our Streamlit app.
+    `llm` and `engine` replace the Gemini model and the default database (benchmarks).
     """
-    if not GOOGLE_API_KEY:
+    if llm is None and not GOOGLE_API_KEY:
         raise ValueError(
             "GOOGLE_API_KEY is missing. Add a valid Gemini API key to the .env file."
         )
 
     print("Initializing AI Agent with Google Gemini...")
 
-    # Initialize the database connection
-    engine = create_engine(DATABASE_URL)
-    db = SQLDatabase(engine)
+    with STARTUP_TIMER.phase("import langchain + gemini"):
+        from langchain_community.agent_toolkits import create_sql_agent
+        from langchain_community.agent_toolkits.sql.prompt import SQL_PREFIX, SQL_FUNCTIONS_SUFFIX
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        from sql_guard import GuardedSQLDatabase
+        from aggregates import AGENT_HINT as AGGREGATES_HINT
+
+    # Initialize the database connection. Table descriptions come from the
+    # on-disk schema cache; only tables missing from it are reflected. Agent
+    # SQL runs read-only with a timeout, a plan cost check and a row cap.
+    with STARTUP_TIMER.phase("schema (cached reflection)"):
+        db = GuardedSQLDatabase(engine if engine is not None else get_engine())
 
     # Initialize the Gemini Pro language model
     # Note: Use a stable model name like 'gemini-2.5-pro' for best results
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        temperature=0,
-        google_api_key=GOOGLE_API_KEY,
-    )
+    if llm is None:
+        with STARTUP_TIMER.phase("gemini client"):
+            llm = ChatGoogleGenerativeAI(
+                model="gemini-2.5-flash",
+                temperature=0,
+                google_api_key=GOOGLE_API_KEY,
+            )
+
+    # create_sql_agent's tool-calling prompt with two slots: the schema of the
+    # relevant tables (see prompt_context) and the agent's opening plan. Without
+    # a schema the plan is the default one (list the tables, then fetch their
+    # schemas); with one, the agent writes its query straight away.
+    hint = AGGREGATES_HINT.replace("{", "{{").replace("}", "}}")
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SQL_PREFIX + hint + "{schema_context}"),
+        ("human", "{input}"),
+        ("ai", "{agent_plan}"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ]).partial(schema_context="", agent_plan=SQL_FUNCTIONS_SUFFIX)
 
     # Create the SQL Agent.
-    # We remove `agent_type` to let LangChain use the default ReAct agent,
-    # which is more compatible with non-OpenAI models.
-    agent_executor = create_sql_agent(llm, db=db, agent_type="tool-calling", verbose=True)
+    # Intermediate steps are kept so the SQL template cache can learn the final query.
+    agent_executor = create_sql_agent(
+        llm, db=db, agent_type="tool-calling", verbose=True, prompt=prompt,
+        agent_executor_kwargs={"return_intermediate_steps": True},
+    )
     
     print("Gemini agent is ready.")
     return agent_executor
 
-def run_gemini_query(user_question, agent_executor):
+def create_query_cache():
+    """
+    Creates the semantic answer cache. It is flushed whenever new profiles
+    are ingested, so cached answers never outlive the data they came from.
+    """
+    from query_cache import SemanticCache
+    from ingest_ledger import ingestion_watermark
+    engine = get_engine()
+
+    def watermark():
+        with engine.connect() as conn:
+            return ingestion_watermark(conn)
+
+    return SemanticCache(watermark_fn=watermark)
+
+def create_sql_template_cache():
+    """Creates the cache of parameterized SQL learned from the agent's answers."""
+    from sql_template_cache import SQLTemplateCache
+    return SQLTemplateCache(get_engine())
+
+def create_prompt_context():
+    """Creates the schema digest that gives the agent the relevant tables up front (see prompt_context)."""
+    from prompt_context import PromptContext
+    return PromptContext(get_engine())
+
+def _agent_inputs(user_question, prompt_context, history):
+    """The agent's inputs, and the estimated tokens of the prompt parts they add."""
+    from prompt_context import with_history, estimate_tokens
+    if prompt_context is not None:
+        return prompt_context.agent_inputs(user_question, history)
+    return {"input": with_history(user_question, history)}, {
+        "history": estimate_tokens(history), "question": estimate_tokens(user_question)}
+
+def _query_usage(usage, context_tokens):
+    """One query's usage: LLM calls and tokens from the tracing callback, plus the prompt context estimate."""
+    TRACER.count("llm_calls", usage["llm_calls"])
+    return {**usage, "context_tokens": context_tokens}
+
+def _is_follow_up(user_question, history):
+    from prompt_context import depends_on_history
+    if history and depends_on_history(user_question):
+        TRACER.count("cache_bypass", reason="follow_up")
+        return True
+    return False
+
+NO_LLM_USAGE = {"llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "context_tokens": {}}
+
+def run_gemini_query(user_question, agent_executor, cache=None, templates=None, prompt_context=None, history=""):
     """
     Takes a user question and the agent and returns the AI's answer.
+    If a SemanticCache is given, near-identical questions are answered from it.
+    If a SQLTemplateCache is given, questions with a known shape run the cached
+    SQL directly; the agent is only used on a miss or when the template fails.
+    With a PromptContext the agent gets the schema of the relevant tables in its
+    prompt instead of looking them up. `history` is the rendered conversation
+    so far (prompt_context.ConversationHistory). It only goes into the agent's
+    input: the caches are keyed on the bare question and skipped for follow-ups
+    that depend on earlier turns (prompt_context.depends_on_history).
     """
-    # The agent is already powerful enough, so we pass the question directly.
+    if _is_follow_up(user_question, history):
+        cache = templates = None
+
+    if cache is not None:
+        cached_answer = cache.get(user_question)
+        if cached_answer is not None:
+            return cached_answer
+
+    if templates is not None:
+        templated_answer = templates.run(user_question)
+        if templated_answer is not None:
+            return templated_answer
+
     # We add error handling for robustness.
-    result = agent_executor.invoke(
-        {"input": user_question},
-        {"handle_parsing_errors": True}
-    )
-    
+    # LLM and tool calls are recorded as spans by the tracing callback.
+    inputs, context_tokens = _agent_inputs(user_question, prompt_context, history)
+    callbacks = langchain_callbacks()
+    started = time.perf_counter()
+    with span("agent_query", mode="invoke"):
+        result = agent_executor.invoke(inputs, {"handle_parsing_errors": True, "callbacks": [callbacks]})
+    _query_usage(callbacks.usage, context_tokens)
+
+    if templates is not None:
+        templates.learn(user_question, result.get("intermediate_steps"))
+    if cache is not None:
+        cache.put(user_question, result["output"], time.perf_counter() - started, callbacks.usage["total_tokens"])
     return result["output"]
 
+# --- Streaming execution ---
+
+_STREAM_END = object()
+
+def _text_of(content):
+    """Extracts plain text from a message chunk's content (a string or a list of parts)."""
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content or [])
+
+def _row_count(observation):
+    """Best-effort row count of an sql_db_query observation like "[(1, 2), (3, 4)]"."""
+    try:
+        rows = ast.literal_eval(observation)
+    except (ValueError, SyntaxError, TypeError):
+        return None
+    return len(rows) if isinstance(rows, list) else None
+
+def _agent_events(event):
+    """Maps a LangChain v2 stream event to the events surfaced in the UI."""
+    kind, data = event["event"], event.get("data", {})
+    if kind == "on_tool_start":
+        tool_input = data.get("input") or {}
+        query = tool_input.get("query") if isinstance(tool_input, dict) else tool_input
+        yield {"type": "step", "tool": event["name"], "text": query or ""}
+    elif kind == "on_tool_end":
+        output = getattr(data.get("output"), "content", data.get("output"))
+        step = {"type": "step_end", "tool": event["name"], "text": str(output)[:500]}
+        if event["name"] == "sql_db_query":
+            step["rows"] = _row_count(str(output))
+        yield step
+    elif kind == "on_chat_model_stream":
+        chunk = data["chunk"]
+        token = _text_of(chunk.content)
+        if token and not getattr(chunk, "tool_call_chunks", None):
+            yield {"type": "token", "text": token}
+    elif kind == "on_chain_end" and not event.get("parent_ids"):
+        yield {"type": "result", "result": data.get("output") or {}}
+
+def stream_gemini_query(user_question, agent_executor, cache=None, templates=None,
+                        timeout=QUERY_TIMEOUT_SECONDS, cancel_event=None, agent_slot=None,
+                        prompt_context=None, history=""):
+    """
+    Runs a question like run_gemini_query, but yields events as the agent works:
+      {"type": "step", "tool", "text"}            a tool call started (text is the SQL for queries)
+      {"type": "step_end", "tool", "text", "rows"} a tool call finished
+      {"type": "token", "text"}                   a piece of the model's answer
+      {"type": "final", "text", "source", "usage"} the complete answer ("agent", "cache" or "template")
+                                                  and its LLM calls and tokens
+    The agent runs on its own event loop thread. It is cancelled when `cancel_event`
+    is set, when `timeout` seconds pass (TimeoutError is raised), or when the
+    consumer stops iterating. `agent_slot`, a context manager factory, is held
+    while the agent runs (not for cache or template answers), e.g. to bound
+    concurrent LLM calls. `prompt_context` and `history` are as in run_gemini_query.
+    """
+    if _is_follow_up(user_question, history):
+        cache = templates = None
+
+    if cache is not None:
+        cached_answer = cache.get(user_question)
+        if cached_answer is not None:
+            yield {"type": "final", "text": cached_answer, "source": "cache", "usage": NO_LLM_USAGE}
+            return
+    if templates is not None:
+        templated_answer = templates.run(user_question)
+        if templated_answer is not None:
+            yield {"type": "final", "text": templated_answer, "source": "template", "usage": NO_LLM_USAGE}
+            return
+
+    inputs, context_tokens = _agent_inputs(user_question, prompt_context, history)
+    callbacks = langchain_callbacks()
+
+    slot = contextlib.ExitStack()
+    if agent_slot is not None:
+        slot.enter_context(agent_slot())
+
+    events = queue.Queue()
+    loop = asyncio.new_event_loop()
+    started = time.perf_counter()
+
+    async def produce():
+        async for event in agent_executor.astream_events(inputs, {"callbacks": [callbacks]}, version="v2"):
+            for ui_event in _agent_events(event):
+                events.put(ui_event)
+
+    async def run_with_timeout():
+        try:
+            await asyncio.wait_for(produce(), timeout)
+        except asyncio.TimeoutError:
+            events.put(TimeoutError(f"The query took longer than {timeout:.0f} seconds and was stopped."))
+        except asyncio.CancelledError:
+            pass
+        except Exception as exc:
+            events.put(exc)
+        finally:
+            events.put(_STREAM_END)
+
+    task = loop.create_task(run_with_timeout())
+    worker = threading.Thread(target=loop.run_until_complete, args=(task,), daemon=True)
+    worker.start()
+
+    result = {}
+    try:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            try:
+                event = events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if event is _STREAM_END:
+                break
+            if isinstance(event, Exception):
+                raise event
+            if event["type"] == "result":
+                result = event["result"]
+            else:
+                yield event
+    finally:
+        # Also reached when the consumer stops iterating (e.g. a Streamlit rerun).
+        if not task.done():
+            loop.call_soon_threadsafe(task.cancel)
+        worker.join(timeout=5)
+        if not worker.is_alive():
+            loop.close()
+        slot.close()
+
+    answer = result.get("output", "")
+    TRACER.record("agent_query", time.perf_counter() - started, mode="stream")
+    usage = _query_usage(callbacks.usage, context_tokens)
+    if templates is not None:
+        templates.learn(user_question, result.get("intermediate_steps"))
+    if cache is not None and answer:
+        cache.put(user_question, answer, time.perf_counter() - started, usage["total_tokens"])
+    yield {"type": "final", "text": answer, "source": "agent", "usage": usage}
+
 # Note: The old `main` function with the `while` loop has been removed.
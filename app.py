@@ -1,10 +1,18 @@
 # app.py
 
+import uuid
 import streamlit as st
-from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+from startup import STARTUP_TIMER, warm_up_in_background, warm_pool
+from tracing import TRACER, METRICS_PORT, serve_metrics
 
 # Import the refactored functions from your Gemini agent script
-from ai_agent import initialize_agent, run_gemini_query 
+with STARTUP_TIMER.phase("import ai_agent"):
+    from ai_agent import (
+        initialize_agent, is_api_key_error, get_engine,
+        create_query_cache, create_sql_template_cache, create_prompt_context, QUERY_TIMEOUT_SECONDS,
+    )
+    from agent_service import AgentService, ServiceBusy
+    from profile_data_api import ProfileDataAPI, VARIABLES
 
 # --- App Configuration ---
 st.set_page_config(
@@ -17,13 +25,51 @@ st.title("🌊 FloatChat - AI Explorer for ARGO Ocean Data")
 st.caption("Powered by Google Gemini Pro")
 
 # --- Agent Initialization ---
-# Use st.cache_resource to initialize the agent only once
+# One agent and one worker pool per server: sessions queue their questions on
+# the service, which bounds LLM concurrency and coalesces identical questions.
+# The prompt context hands the agent the schema of the relevant tables.
 @st.cache_resource
-def load_agent():
-    return initialize_agent()
+def load_agent_service(_query_cache, _sql_templates):
+    return AgentService(initialize_agent(), cache=_query_cache, templates=_sql_templates,
+                        prompt_context=create_prompt_context())
+
+# Shared across sessions so every user benefits from previously answered questions
+@st.cache_resource
+def load_query_cache():
+    return create_query_cache()
+
+@st.cache_resource
+def load_sql_templates():
+    return create_sql_template_cache()
+
+# Plot data comes straight from the database, reduced server-side; never through the LLM.
+@st.cache_resource
+def load_profile_data():
+    return ProfileDataAPI(get_engine())
+
+# Prometheus-style /metrics endpoint, once per server, when METRICS_PORT is set.
+@st.cache_resource
+def start_metrics_server():
+    return serve_metrics(METRICS_PORT) if METRICS_PORT else None
+
+start_metrics_server()
+
+# Runs once per server: the connection pool and the embedding model load
+# in the background while the agent is being built.
+@st.cache_resource
+def start_warm_up(_query_cache):
+    return warm_up_in_background([
+        ("connection pool", lambda: warm_pool(get_engine())),
+        ("embedding model", _query_cache.warm_up),
+    ])
+
+query_cache = load_query_cache()
+sql_templates = load_sql_templates()
+profile_data = load_profile_data()
+start_warm_up(query_cache)
 
 try:
-    agent_executor = load_agent()
+    agent_service = load_agent_service(query_cache, sql_templates)
 except ValueError as exc:
     st.error(str(exc))
     st.stop()
@@ -32,13 +78,154 @@ except Exception as exc:
     st.exception(exc)
     st.stop()
 
+# --- Cache Metrics ---
+with st.sidebar:
+    st.subheader("Answer cache")
+    stats = query_cache.stats()
+    st.metric("Hit rate", f"{stats['hit_rate']:.0%}", f"{stats['hits']} hits / {stats['misses']} misses")
+    st.caption(f"Saved {stats['saved_seconds']} s and {stats['saved_tokens']} tokens; "
+               f"{stats['entries']} cached answers, {stats['invalidations']} flushes on new data.")
+    template_stats = sql_templates.stats()
+    st.caption(f"SQL templates: {template_stats['templates']} learned, {template_stats['hits']} direct answers, "
+               f"{template_stats['errors']} fell back to the agent.")
+
+    st.subheader("Answering")
+    stream_answers = st.toggle("Stream answers and agent steps", value=True)
+    query_timeout = st.number_input("Query timeout (seconds)", min_value=10, max_value=600,
+                                    value=int(QUERY_TIMEOUT_SECONDS), step=10)
+
+    st.subheader("Agent service")
+    service_stats = agent_service.stats()
+    st.caption(f"{service_stats['queued']} queued, {service_stats['running']} running "
+               f"({service_stats['llm_active']} calling Gemini) for {service_stats['sessions']} sessions. "
+               f"Queue wait {service_stats['wait_ms_mean']} ms mean, {service_stats['wait_ms_p95']} ms p95; "
+               f"{service_stats['coalesced']} questions shared a run, {service_stats['rate_limited']} rate-limit retries.")
+    st.caption(f"Per agent query: {service_stats['llm_calls_mean']} Gemini calls, "
+               f"{service_stats['input_tokens_mean']:,} input / {service_stats['output_tokens_mean']:,} output tokens "
+               f"(schema and history context ~{service_stats['context_tokens_mean']:,} tokens).")
+
+    plot_stats = profile_data.stats()
+    st.caption(f"Plot data: {plot_stats['hits']} cached / {plot_stats['misses']} computed, "
+               f"{plot_stats['entries']} results cached.")
+
+    with st.expander("Startup timing"):
+        st.code(STARTUP_TIMER.format_report() or "No timings recorded yet.")
+
+    with st.expander("Where the time goes"):
+        rows = [f"{name:<18} {n:>5}x {mean_ms:8.0f} ms mean {max_ms:8.0f} ms max"
+                for name, n, _, mean_ms, max_ms, _ in TRACER.summary()]
+        st.code("\n".join(rows) or "No operations recorded yet.")
+
+# --- Plots ---
+UNITS = {"temperature": "°C", "salinity": "PSU"}
+
+def show_plots():
+    """Depth profile, time series, T/S diagram or map for an optional float, from ProfileDataAPI."""
+    columns = st.columns([2, 2, 3])
+    wmo_id = columns[0].text_input("Float (WMO id, optional)").strip() or None
+    variable = columns[1].selectbox("Variable", VARIABLES)
+    plot = columns[2].radio("Plot", ["Depth profile", "Time series", "T/S diagram", "Map"], horizontal=True)
+    label = f"{variable.capitalize()} ({UNITS[variable]})"
+
+    if plot == "Depth profile":
+        data = profile_data.depth_profile(variable, wmo_id=wmo_id)
+        frame = data.to_frame()
+        frame["low"], frame["high"] = frame["mean"] - frame["std"], frame["mean"] + frame["std"]
+        pressure = {"field": "pressure", "type": "quantitative", "scale": {"reverse": True}, "title": "Pressure (dbar)"}
+        st.vega_lite_chart(frame, {"layer": [
+            {"mark": {"type": "area", "orient": "horizontal", "opacity": 0.3},
+             "encoding": {"y": pressure, "x": {"field": "low", "type": "quantitative", "title": label},
+                          "x2": {"field": "high"}}},
+            {"mark": {"type": "line", "orient": "horizontal"},
+             "encoding": {"y": pressure, "x": {"field": "mean", "type": "quantitative"}}},
+        ]}, width="stretch")
+        st.caption(f"Mean ± standard deviation per {data.meta['bin_dbar']} dbar bin over {data.meta['levels']:,} levels.")
+    elif plot == "Time series":
+        layer = st.slider("Pressure layer (dbar)", 0, 2000, (0, 2000), step=50)
+        whole_profile = layer == (0, 2000)
+        data = profile_data.time_series(variable, wmo_id=wmo_id, min_pressure=None if whole_profile else layer[0],
+                                        max_pressure=None if whole_profile else layer[1])
+        st.line_chart(data.to_frame(), x="time", y="value", y_label=label)
+        st.caption(f"{len(data):,} of {data.meta['profiles']:,} profile means shown (LTTB downsampling).")
+    elif plot == "T/S diagram":
+        data = profile_data.ts_density(wmo_id=wmo_id)
+        st.vega_lite_chart(data.to_frame(), {
+            "mark": {"type": "square", "size": 12},
+            "encoding": {"x": {"field": "salinity", "type": "quantitative", "scale": {"zero": False},
+                               "title": "Salinity (PSU)"},
+                         "y": {"field": "temperature", "type": "quantitative", "title": "Temperature (°C)"},
+                         "color": {"field": "count", "type": "quantitative", "scale": {"type": "log"}},
+                         "tooltip": [{"field": "count"}, {"field": "pressure", "title": "mean pressure"}]},
+        }, width="stretch")
+        st.caption(f"{data.meta['levels']:,} levels binned into {len(data):,} cells.")
+    else:
+        data = profile_data.map_grid(variable, wmo_id=wmo_id)
+        st.vega_lite_chart(data.to_frame(), {
+            "mark": {"type": "square"},
+            "encoding": {"x": {"field": "lon", "type": "quantitative", "title": "Longitude"},
+                         "y": {"field": "lat", "type": "quantitative", "title": "Latitude"},
+                         "color": {"field": "mean", "type": "quantitative", "title": label},
+                         "size": {"field": "profiles", "type": "quantitative"},
+                         "tooltip": [{"field": "profiles"}, {"field": "mean"}]},
+        }, width="stretch")
+        st.caption(f"{data.meta['profiles']:,} profiles in {len(data):,} grid cells.")
+
+with st.expander("📈 Plots"):
+    try:
+        show_plots()
+    except Exception as exc:
+        st.error(f"Could not load the plot data: {exc}")
+
+def stream_response(prompt):
+    """Shows the agent's SQL steps as they run, then streams the answer token by token."""
+    status = st.status("Querying the database with Gemini...", expanded=False)
+    answer_box = st.empty()
+    tokens = []
+    for event in agent_service.stream(st.session_state.session_id, prompt, timeout=query_timeout):
+        if event["type"] == "queued" and event["position"] > 1:
+            status.update(label=f"Waiting for a free agent ({event['position']} in queue)...")
+        elif event["type"] == "retry":
+            # Gemini is rate-limiting: the run starts over after the cooldown.
+            status.update(label=f"Gemini is busy, retrying in {event['delay']:.0f} s...")
+            tokens.clear()
+            answer_box.empty()
+        elif event["type"] == "step":
+            status.update(label=f"Running `{event['tool']}`...")
+            if event["tool"] == "sql_db_query":
+                status.code(event["text"], language="sql")
+        elif event["type"] == "step_end" and event.get("rows") is not None:
+            status.write(f"Returned {event['rows']} rows.")
+        elif event["type"] == "token":
+            tokens.append(event["text"])
+            answer_box.markdown("".join(tokens) + "▌")
+        elif event["type"] == "final":
+            source = {"cache": "the answer cache", "template": "a cached SQL template"}.get(event["source"], "Gemini")
+            usage = event.get("usage") or {}
+            if usage.get("llm_calls"):
+                source += (f" ({usage['llm_calls']} calls, {usage['input_tokens']:,} input / "
+                           f"{usage['output_tokens']:,} output tokens)")
+            status.update(label=f"Answered by {source}", state="complete")
+            answer_box.markdown(event["text"])
+            return event["text"]
+    return "".join(tokens)
+
 # --- Chat History Management ---
+# Keys this browser session's conversation memory in the agent service.
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 if "messages" not in st.session_state:
     st.session_state.messages = [{
         "role": "assistant", 
         "content": "Hello! I'm FloatChat. Ask me about the ARGO data in the database."
     }]
 
+# A rerun while a query is still pending means it was interrupted (Stop button or new input);
+# the interrupted stream cancels the in-flight agent run when it is closed.
+if st.session_state.get("pending_query"):
+    st.session_state.messages.append({"role": "assistant", "content": "_Query cancelled._"})
+    st.session_state.pending_query = None
+
 # Display chat messages from history
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -53,19 +240,30 @@ if prompt := st.chat_input("What is the average salinity?"):
 
     # Get and display assistant response
     with st.chat_message("assistant"):
-        # Show a thinking spinner while the agent works
-        with st.spinner("Querying the database with Gemini..."):
-            try:
-                response = run_gemini_query(prompt, agent_executor)
-            except ChatGoogleGenerativeAIError:
+        st.session_state.pending_query = prompt
+        try:
+            if stream_answers:
+                st.button("Stop", key="stop_query")
+                response = stream_response(prompt)
+            else:
+                # Show a thinking spinner while the agent works
+                with st.spinner("Querying the database with Gemini..."):
+                    response = agent_service.ask(st.session_state.session_id, prompt, timeout=query_timeout)
+                st.markdown(response)
+        except (TimeoutError, ServiceBusy) as exc:
+            response = str(exc)
+            st.markdown(response)
+        except Exception as exc:
+            if is_api_key_error(exc):
                 response = (
                     "Gemini rejected the configured API key. "
                     "Create a valid Gemini API key in Google AI Studio, update "
                     "`GOOGLE_API_KEY` in `.env`, then restart Streamlit."
                 )
-            except Exception as exc:
+            else:
                 response = f"Sorry, I hit an error while answering: {exc}"
             st.markdown(response)
+        st.session_state.pending_query = None
     
     # Add assistant response to history
     st.session_state.messages.append({"role": "assistant", "content": response})
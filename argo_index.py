@@ -0,0 +1,99 @@
+# argo_index.py
+#
+# Loads the ARGO global profile index (ar_index_global_prof.txt). The text file
+# is parsed once into a typed, compressed Parquet snapshot; later selections by
+# region, time window, ocean or institution read only the columns and rows they
+# need straight from the snapshot.
+
+import os
+import glob
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+INDEX_COLUMNS = ['file', 'date', 'latitude', 'longitude', 'ocean', 'profiler_type', 'institution', 'date_update']
+CATEGORICAL_COLUMNS = ['ocean', 'institution', 'profiler_type']
+
+SNAPSHOT_SCHEMA = pa.schema([
+    ('file', pa.string()),
+    ('date', pa.timestamp('s')),
+    ('latitude', pa.float32()),
+    ('longitude', pa.float32()),
+    ('ocean', pa.dictionary(pa.int32(), pa.string())),
+    ('profiler_type', pa.dictionary(pa.int32(), pa.string())),
+    ('institution', pa.dictionary(pa.int32(), pa.string())),
+    ('date_update', pa.timestamp('s')),
+])
+
+PARSE_CHUNK_ROWS = 500_000
+ROW_GROUP_ROWS = 250_000
+
+def snapshot_path_for(index_path):
+    """Returns the snapshot path for the current mtime/size of the text index."""
+    st = os.stat(index_path)
+    return f"{index_path}.{st.st_size}-{int(st.st_mtime)}.parquet"
+
+def _parse_dates(values):
+    return pd.to_datetime(values, format='%Y%m%d%H%M%S', errors='coerce')
+
+def build_snapshot(index_path, snapshot_path):
+    """Parses the text index chunk by chunk into a Parquet snapshot."""
+    reader = pd.read_csv(
+        index_path, comment='#', header=0, names=INDEX_COLUMNS,
+        dtype={'file': str, 'date': str, 'latitude': str, 'longitude': str,
+               'ocean': str, 'profiler_type': str, 'institution': str, 'date_update': str},
+        chunksize=PARSE_CHUNK_ROWS,
+    )
+    tmp_path = snapshot_path + ".tmp"
+    with pq.ParquetWriter(tmp_path, SNAPSHOT_SCHEMA, compression='zstd') as writer:
+        for chunk in reader:
+            chunk['date'] = _parse_dates(chunk['date'])
+            chunk['date_update'] = _parse_dates(chunk['date_update'])
+            chunk['latitude'] = pd.to_numeric(chunk['latitude'], errors='coerce').astype('float32')
+            chunk['longitude'] = pd.to_numeric(chunk['longitude'], errors='coerce').astype('float32')
+            # Rows without a valid location are useless for region selection.
+            chunk = chunk.dropna(subset=['latitude', 'longitude'])
+            for col in CATEGORICAL_COLUMNS:
+                chunk[col] = chunk[col].astype('category')
+            table = pa.Table.from_pandas(chunk, schema=SNAPSHOT_SCHEMA, preserve_index=False)
+            writer.write_table(table, row_group_size=ROW_GROUP_ROWS)
+    os.replace(tmp_path, snapshot_path)
+
+def ensure_snapshot(index_path):
+    """Returns an up-to-date snapshot path, rebuilding it when the text index changed."""
+    snapshot_path = snapshot_path_for(index_path)
+    if not os.path.exists(snapshot_path):
+        for stale in glob.glob(f"{index_path}.*.parquet"):
+            os.remove(stale)
+        build_snapshot(index_path, snapshot_path)
+    return snapshot_path
+
+def _bbox_filters(bbox):
+    """Builds DNF filters for (min_lat, max_lat, min_lon, max_lon); min_lon > max_lon crosses the dateline."""
+    min_lat, max_lat, min_lon, max_lon = bbox
+    lat = [('latitude', '>=', min_lat), ('latitude', '<=', max_lat)]
+    if min_lon <= max_lon:
+        return [lat + [('longitude', '>=', min_lon), ('longitude', '<=', max_lon)]]
+    return [lat + [('longitude', '>=', min_lon)], lat + [('longitude', '<=', max_lon)]]
+
+def load_index(index_path, bbox=None, start=None, end=None, time_column='date',
+               oceans=None, institutions=None, columns=None):
+    """
+    Returns the index rows matching the given filters as a DataFrame.
+
+    bbox is (min_lat, max_lat, min_lon, max_lon); start/end bound `time_column`;
+    oceans/institutions are lists of codes. Only `columns` are read (all by default).
+    """
+    common = []
+    if start is not None:
+        common.append((time_column, '>=', pd.Timestamp(start)))
+    if end is not None:
+        common.append((time_column, '<=', pd.Timestamp(end)))
+    if oceans:
+        common.append(('ocean', 'in', list(oceans)))
+    if institutions:
+        common.append(('institution', 'in', list(institutions)))
+
+    filters = [group + common for group in _bbox_filters(bbox)] if bbox else ([common] if common else None)
+    table = pq.read_table(ensure_snapshot(index_path), columns=columns, filters=filters)
+    return table.to_pandas()
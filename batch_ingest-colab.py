@@ -1,9 +1,10 @@
 import os
 import requests
-import pandas as pd
 from tqdm.notebook import tqdm  # Use notebook-friendly tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import zipfile
+from argo_index import load_index  # upload argo_index.py next to this notebook
+from http_download import Downloader  # and http_download.py
 
 # --- Mount Google Drive ---
 from google.colab import drive
@@ -15,19 +16,18 @@ DOWNLOAD_DIR = "/content/argo_data" # A temporary directory inside Colab
 FILE_LIMIT = 1000
 MAX_WORKERS = 20 # We can use more workers in the cloud
 
+# One keep-alive connection per worker, all to the same host.
+DOWNLOADER = Downloader(per_host=MAX_WORKERS)
+
 # Bounding box for the Indian Ocean
 MIN_LAT, MAX_LAT = -30, 30
 MIN_LON, MAX_LON = 30, 110
 
 def download_file(url, local_path):
-    """Downloads a single file via HTTP."""
+    """Downloads a single file with the shared, pooled downloader (retries and resume included)."""
     try:
-        with requests.get(url, stream=True, timeout=60) as r:
-            r.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            return url
+        DOWNLOADER.fetch(url, local_path)
+        return url
     except requests.exceptions.RequestException:
         return None
 
@@ -40,21 +40,14 @@ print("   - Downloading master index file...")
 download_file(INDEX_FILE_URL, index_local_path)
 
 print("   - Parsing and filtering index file...")
-df = pd.read_csv(index_local_path, comment='#', header=None, parse_dates=[8], names=[
-    'file', 'date', 'latitude', 'longitude', 'ocean', 'profiler_type', 'institution', 'date_update'
-], low_memory=False)
-
-df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
-df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
-df.dropna(subset=['latitude', 'longitude'], inplace=True)
-
-region_df = df[(df['latitude'] >= MIN_LAT) & (df['latitude'] <= MAX_LAT) & (df['longitude'] >= MIN_LON) & (df['longitude'] <= MAX_LON)].copy()
+region_df = load_index(index_local_path, bbox=(MIN_LAT, MAX_LAT, MIN_LON, MAX_LON),
+                       columns=['file', 'date_update'])
 region_df.sort_values(by='date_update', ascending=False, inplace=True)
 limited_df = region_df.head(FILE_LIMIT)
 print(f"   - Found {len(limited_df)} files to download.")
 
 # --- Parallel Download ---
-urls_to_download = [f"https://data-argo.ifremer.fr/{row['file']}" for _, row in limited_df.iterrows()]
+urls_to_download = [f"https://data-argo.ifremer.fr/dac/{row['file']}" for _, row in limited_df.iterrows()]
 local_paths = [os.path.join(DOWNLOAD_DIR, os.path.basename(url)) for url in urls_to_download]
 
 with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
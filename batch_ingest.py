@@ -1,18 +1,40 @@
 # batch_ingest.py (Final, Robust Version)
 
 import os
+import time
+import logging
+import queue
+import threading
 import requests
 import pandas as pd
 from tqdm import tqdm
 from sqlalchemy.orm import sessionmaker
-from ingest_data import process_nc_file, DATABASE_URL, create_engine
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from ingest_data import decode_nc_file, decode_nc_bytes, write_profile_arrays, DATABASE_URL, create_engine
+from http_download import get_downloader
+import ingest_ledger
+from db_schema import migrate
+from argo_index import load_index
+from spatial_index import region_bbox, points_in_region
+from tracing import TRACER, span, count, configure_logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # --- Configuration ---
-INDEX_FILE_URL = "https://data-argo.ifremer.fr/ar_index_global_prof.txt"
+# GDAC root; index file paths are relative to its dac/ directory.
+ARGO_BASE_URL = os.getenv("ARGO_BASE_URL", "https://data-argo.ifremer.fr")
+INDEX_FILE_URL = f"{ARGO_BASE_URL}/ar_index_global_prof.txt"
 DOWNLOAD_DIR = "data"
 FILE_LIMIT = 1000
-MAX_WORKERS = 5
+
+# Workers per pipeline stage: downloads are I/O bound, decoding is CPU bound
+# (one process per core), writers share a single pooled engine.
+DOWNLOAD_WORKERS = 8
+DECODE_WORKERS = os.cpu_count() or 1
+WRITER_WORKERS = 2
+QUEUE_SIZE = 32
+
+# Keep downloaded files in memory and decode them from there (no temp files).
+STREAM_TO_MEMORY = os.getenv("STREAM_TO_MEMORY", "1") == "1"
 
 DB_USER = 'postgres'
 DB_PASSWORD = '123456' # Your password
@@ -21,89 +43,322 @@ DB_PORT = '5432'
 DB_NAME = 'argo_db'
 DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-MIN_LAT, MAX_LAT = -30, 30
-MIN_LON, MAX_LON = 30, 110
+# Any name from spatial_index.REGIONS, a bbox tuple or a polygon dict.
+REGION = 'Indian Ocean'
+
+logger = logging.getLogger("floatchat.ingest")
+
+# --- Pipelined ingestion scheduler ---
+
+_DONE = object()
+
+class StageStats:
+    """Thread-safe throughput counters for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.files = 0
+        self.failed = 0
+        self.rows = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, rows=0, ok=True):
+        with self._lock:
+            now = time.perf_counter()
+            if self.started is None:
+                self.started = now
+            self.finished = now
+            if ok:
+                self.files += 1
+                self.rows += rows
+            else:
+                self.failed += 1
+
+    def mark_start(self):
+        with self._lock:
+            if self.started is None:
+                self.started = time.perf_counter()
+
+    def report(self):
+        elapsed = (self.finished or 0) - (self.started or 0)
+        files_s = self.files / elapsed if elapsed > 0 else 0.0
+        rows_s = self.rows / elapsed if elapsed > 0 else 0.0
+        return (f"   - {self.name:<9} {self.files} ok / {self.failed} failed in {elapsed:.1f}s "
+                f"({files_s:.1f} files/s, {rows_s:,.0f} rows/s)")
 
-def download_file(url, local_path):
-    """Downloads a single file via HTTP with a timeout."""
+def decode_downloaded_file(local_path, data=None):
+    """
+    Runs in a worker process: decodes one downloaded file (from `data` bytes
+    when given, otherwise from `local_path`, which is then deleted).
+    Returns (arrays or None, seconds, error message or None); the timing is
+    recorded by the parent, since spans in worker processes are not collected.
+    """
+    started = time.perf_counter()
     try:
-        with requests.get(url, stream=True, timeout=60) as r:
-            r.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        return True
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Failed to download {url}: {e}")
-        return False
-
-def download_and_process(row, db_url):
-    """A self-contained function for a single thread."""
-    file_path = row['file']
-    file_url = f"https://data-argo.ifremer.fr/{file_path}"
-    local_nc_path = os.path.join(DOWNLOAD_DIR, f"{os.path.basename(file_path)}_{os.getpid()}")
-
-    if download_file(file_url, local_nc_path):
-        engine = create_engine(db_url)
-        Session = sessionmaker(bind=engine)
-        with Session() as session:
-            process_nc_file(local_nc_path, session)
-        
+        arrays = decode_nc_bytes(data, local_path) if data is not None else decode_nc_file(local_path)
+        return arrays, time.perf_counter() - started, None
+    except Exception as e:
+        return None, time.perf_counter() - started, f"{type(e).__name__}: {e}"
+    finally:
+        if data is None:
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
+
+def _failed_job(job, stage, error):
+    """Marks a job as failed; the writers record it in the ledger."""
+    job.update(not_modified=False, arrays=None, failed_stage=stage, error=error)
+    return job
+
+def _download_stage(jobs, decode_q, stats, workers, progress, stop, base_url=ARGO_BASE_URL,
+                    download_dir=DOWNLOAD_DIR, to_memory=STREAM_TO_MEMORY):
+    """
+    Downloads files on an I/O thread pool (sharing one keep-alive connection
+    pool) and feeds jobs to the decode queue. Files whose last ingested ETag
+    still matches come back as not modified and are not transferred.
+    No new downloads are started once `stop` is set.
+    """
+    downloader = get_downloader()
+
+    def fetch(job):
+        file_path = job['file']
+        try:
+            job['local_path'] = os.path.join(download_dir, f"{os.path.basename(file_path)}_{os.getpid()}_{threading.get_ident()}")
+            with span("download", file=file_path):
+                result = downloader.fetch(f"{base_url}/dac/{file_path}", None if to_memory else job['local_path'],
+                                          etag=job.get('known_etag'))
+        except requests.exceptions.RequestException as e:
+            # Not recorded in the ledger, so the file is simply retried next run.
+            logger.warning("failed to download %s: %s", file_path, e)
+            count("files_failed", stage="download")
+            stats.record(ok=False)
+            progress.update(1)
+            return
+        except Exception as e:
+            logger.exception("failed to download %s", file_path)
+            count("files_failed", stage="download")
+            stats.record(ok=False)
+            decode_q.put(_failed_job(job, "download", f"{type(e).__name__}: {e}"))
+            return
+        job['not_modified'] = result.not_modified
+        job['data'] = result.data
+        job['size_bytes'], job['etag'] = result.size, result.etag or job.get('known_etag')
+        stats.record(rows=result.size)
+        decode_q.put(job)  # blocks when decoders fall behind
+
+    stats.mark_start()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Bound in-flight downloads so the file list is not submitted all at once.
+            slots = threading.Semaphore(workers * 2)
+            for job in jobs:
+                if stop.is_set():
+                    break
+                slots.acquire()
+                executor.submit(fetch, job).add_done_callback(lambda _: slots.release())
+    finally:
+        decode_q.put(_DONE)
+
+def _decode_stage(decode_q, write_q, stats, workers, writer_count, progress, stop, errors):
+    """
+    Decodes NetCDF files on a process pool and feeds profile arrays to the writers.
+    If the pool breaks (a worker process died), the run is stopped: the error is
+    appended to `errors`, and the remaining downloads are drained and left for
+    the next run.
+    """
+    slots = threading.Semaphore(workers * 2)
+
+    def on_decoded(job, future):
+        slots.release()
+        if future.exception() is None:
+            job['arrays'], seconds, error = future.result()
+            TRACER.record("decode", seconds, error=error, file=job['file'])
+        else:
+            job['arrays'], error = None, f"{type(future.exception()).__name__}: {future.exception()}"
+        if job['arrays'] is None:
+            job['error'] = error
+            count("files_failed", stage="decode")
+            stats.record(ok=False)
+        else:
+            stats.record(rows=int(job['arrays']['pressure'].size))
+        # Undecodable files still go to the writers so the failure lands in the ledger.
+        write_q.put(job)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while (job := decode_q.get()) is not _DONE:
+                if job['not_modified'] or 'failed_stage' in job:
+                    write_q.put(job)  # nothing to decode, the writer only updates the ledger
+                    continue
+                stats.mark_start()
+                slots.acquire()
+                try:
+                    future = executor.submit(decode_downloaded_file, job['local_path'], job.pop('data'))
+                except BrokenProcessPool:
+                    slots.release()
+                    write_q.put(_failed_job(job, "decode", "decoder process pool is broken"))
+                    raise
+                future.add_done_callback(lambda f, job=job: on_decoded(job, f))
+    except BrokenProcessPool as e:
+        logger.error("decoder process pool failed, stopping the run: %s", e)
+        errors.append(f"decoder process pool failed: {e}")
+        stop.set()
+        # Keep the downloader from blocking on a full queue; these files are retried next run.
+        while (job := decode_q.get()) is not _DONE:
+            if job.get('data') is None and job.get('local_path') and os.path.exists(job['local_path']):
+                os.remove(job['local_path'])
+            progress.update(1)
+    finally:
+        for _ in range(writer_count):
+            write_q.put(_DONE)
+
+def _write_stage(write_q, Session, stats, progress):
+    """
+    Writes decoded files using a session from the shared engine. The data and the
+    ledger entry are committed together, so a crash never leaves a half-ingested
+    file marked as done, and a reprocessed file atomically replaces the old profiles.
+    """
+    while (job := write_q.get()) is not _DONE:
+        stats.mark_start()
         try:
-            os.remove(local_nc_path)
-        except OSError:
-            pass
-        return file_path
-    return None
+            _write_job(job, Session, stats)
+        except Exception:
+            # Even the ledger could not be updated (e.g. the database went away);
+            # the file is retried next run and the writer keeps draining the queue.
+            logger.exception("failed to record %s in the ledger", job['file'])
+            stats.record(ok=False)
+        progress.update(1)
+
+def _write_job(job, Session, stats):
+    with Session() as session:
+        if job['not_modified']:
+            ingest_ledger.mark_unchanged(session, job['file'], job['date_update'])
+            session.commit()
+            count("files_skipped", reason="not_modified")
+            stats.record(rows=0)
+            return
+        try:
+            if job['arrays'] is None:
+                raise ValueError(f"could not {job.get('failed_stage', 'decode')} NetCDF file: {job.get('error')}")
+            rows = write_profile_arrays(session, [job['arrays']], replace=True)
+            ingest_ledger.mark_done(session, job['file'], job['date_update'],
+                                    job.get('size_bytes'), job.get('etag'), rows)
+            with span("db_commit"):
+                session.commit()
+            stats.record(rows=rows)
+        except Exception as e:
+            session.rollback()
+            logger.warning("failed to ingest %s: %s", job['file'], e)
+            if job['arrays'] is not None:
+                count("files_failed", stage="write")
+            ingest_ledger.mark_failed(session, job['file'], job['date_update'], e)
+            session.commit()
+            stats.record(ok=False)
+
+def run_pipeline(index_rows, db_url=DATABASE_URL, download_workers=DOWNLOAD_WORKERS,
+                 decode_workers=DECODE_WORKERS, writer_workers=WRITER_WORKERS, queue_size=QUEUE_SIZE,
+                 base_url=ARGO_BASE_URL, download_dir=DOWNLOAD_DIR):
+    """
+    Ingests the given index rows ('file' and 'date_update' columns, optionally
+    'etag' from the ledger) through download -> decode -> write stages
+    connected by bounded queues, and returns the per-stage statistics.
+    Raises RuntimeError if a stage failed as a whole (e.g. the decoder pool
+    broke); the files ingested until then are committed.
+    """
+    engine = create_engine(db_url, pool_size=writer_workers, max_overflow=0, pool_pre_ping=True)
+    Session = sessionmaker(bind=engine)
+    etags = index_rows['etag'] if 'etag' in index_rows else pd.Series(None, index=index_rows.index, dtype=object)
+    jobs = [
+        {'file': row.file, 'date_update': None if pd.isna(row.date_update) else row.date_update.to_pydatetime(),
+         'known_etag': None if pd.isna(etag) else etag}
+        for row, etag in zip(index_rows[['file', 'date_update']].itertuples(index=False), etags)
+    ]
+    decode_q = queue.Queue(maxsize=queue_size)
+    write_q = queue.Queue(maxsize=queue_size)
+    stats = {name: StageStats(name) for name in ('download', 'decode', 'write')}
+    stop, errors = threading.Event(), []
+
+    with tqdm(total=len(jobs), desc="Processing files") as progress:
+        threads = [
+            threading.Thread(target=_download_stage, args=(jobs, decode_q, stats['download'], download_workers, progress,
+                                                                stop, base_url, download_dir)),
+            threading.Thread(target=_decode_stage, args=(decode_q, write_q, stats['decode'], decode_workers, writer_workers,
+                                                              progress, stop, errors)),
+        ] + [
+            threading.Thread(target=_write_stage, args=(write_q, Session, stats['write'], progress))
+            for _ in range(writer_workers)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    engine.dispose()
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return stats
 
 def main():
+    configure_logging(os.getenv("LOG_LEVEL", "INFO"))
     print("🚀 Starting Multithreaded Batch Ingestion...")
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
     index_local_path = os.path.join(DOWNLOAD_DIR, "ar_index_global_prof.txt")
 
-    if not os.path.exists(index_local_path):
-        print("   - Downloading master index file...")
-        if not download_file(INDEX_FILE_URL, index_local_path):
-            print("   - CRITICAL: Could not download index file. Exiting.")
+    # Conditional request: the index is only transferred when it changed upstream.
+    print("   - Checking master index file...")
+    try:
+        local_mtime = os.path.getmtime(index_local_path) if os.path.exists(index_local_path) else None
+        result = get_downloader().fetch(INDEX_FILE_URL, index_local_path, last_modified=local_mtime)
+        print("   - Master index file is up to date." if result.not_modified
+              else f"   - Downloaded master index file ({result.size / 1e6:.0f} MB).")
+    except requests.exceptions.RequestException as e:
+        if not os.path.exists(index_local_path):
+            print(f"   - CRITICAL: Could not download index file ({e}). Exiting.")
             return
-    else:
-        print("   - Master index file already exists.")
+        print(f"   - Could not refresh the index file ({e}); using the local copy.")
+
+    print("   - Loading index snapshot (parsed once per index version)...")
+    # Locations are validated, and the region filter and column projection are
+    # pushed down into the Parquet reader instead of running on the full frame.
+    region_df = load_index(index_local_path, bbox=region_bbox(REGION),
+                           columns=['file', 'latitude', 'longitude', 'date_update'])
+    # The bbox pushdown is exact for boxes; polygon regions are refined here.
+    region_df = region_df[points_in_region(region_df['latitude'], region_df['longitude'], REGION)]
+    print(f"   - {len(region_df)} profiles in region.")
+
+    # Only files that are new or changed upstream since the last run are fetched.
+    engine = create_engine(DATABASE_URL)
+    migrate(engine, verbose=True)
+    changed_df = ingest_ledger.select_changed_files(engine, region_df, with_etag=True)
+    engine.dispose()
+    print(f"   - {len(changed_df)} of {len(region_df)} regional files are new or updated since the last run.")
+    count("files_skipped", len(region_df) - len(changed_df), reason="unchanged")
 
-    print("   - Parsing index file...")
-    column_names = ['file', 'date', 'latitude', 'longitude', 'ocean', 'profiler_type', 'institution', 'date_update']
-    
-    # ✅ PARSE 'date_update' for correct chronological sorting
-    df = pd.read_csv(index_local_path, comment='#', header=None,
-                     names=column_names,
-                     parse_dates=['date_update'],
-                     low_memory=False)
-
-    print("   - Cleaning and validating data types...")
-    df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
-    df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
-    
-    # ✅ ADDED critical step to remove rows with invalid locations
-    original_rows = len(df)
-    df.dropna(subset=['latitude', 'longitude'], inplace=True)
-    cleaned_rows = len(df)
-    print(f"   - Removed {original_rows - cleaned_rows} rows with invalid location data.")
-
-    print(f"   - Filtering for region...")
-    region_df = df[(df['latitude'] >= MIN_LAT) & (df['latitude'] <= MAX_LAT) & (df['longitude'] >= MIN_LON) & (df['longitude'] <= MAX_LON)].copy()
-    
     # This sort now works correctly because 'date_update' is a proper date object
-    region_df.sort_values(by='date_update', ascending=False, inplace=True)
-    limited_df = region_df.head(FILE_LIMIT)
+    changed_df = changed_df.sort_values(by='date_update', ascending=False)
+    limited_df = changed_df.head(FILE_LIMIT)
+    count("files_skipped", len(changed_df) - len(limited_df), reason="limit")
     
-    print(f"   - Found {len(limited_df)} files to process with {MAX_WORKERS} parallel workers.")
+    print(f"   - Found {len(limited_df)} files to process "
+          f"({DOWNLOAD_WORKERS} downloaders, {DECODE_WORKERS} decoders, {WRITER_WORKERS} writers).")
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = { executor.submit(download_and_process, row, DATABASE_URL): row['file'] for _, row in limited_df.iterrows() }
-        success_count = 0
-        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing files"):
-            if future.result() is not None:
-                success_count += 1
+    try:
+        stats = run_pipeline(limited_df)
+    except RuntimeError as e:
+        raise SystemExit(f"❌ Batch ingestion stopped: {e}")
+    success_count = stats['write'].files
 
+    print("   - Stage throughput (download rows = bytes):")
+    for stage in stats.values():
+        print(stage.report())
+    print("   - Slowest operations (total time):")
+    for name, n, total, mean_ms, max_ms, errors in TRACER.summary():
+        print(f"     {name:<18} {n:>6} calls, {total:7.1f}s total, {mean_ms:8.1f} ms mean, {max_ms:8.1f} ms max, {errors} errors")
+    for path in TRACER.dump_profiles():
+        print(f"     profile: {path}")
     print(f"\n✅ Batch Ingestion Complete! Successfully processed {success_count}/{len(limited_df)} files.")
 
 if __name__ == "__main__":
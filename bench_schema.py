@@ -0,0 +1,148 @@
+# bench_schema.py
+#
+# Benchmarks ingest and query latency of the measurements schema as row counts
+# grow, comparing:
+#   plain       - base tables only (no keys or indexes, as before db_schema)
+#   managed     - all db_schema migrations (unique keys, BRIN, covering index)
+#   partitioned - managed + yearly range partitions on measurements
+# Each variant runs in its own scratch schema, which is dropped afterwards.
+#
+# Usage: python bench_schema.py --sizes 200000 1000000 5000000
+
+import io
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from ingest_data import DATABASE_URL
+import db_schema
+
+LEVELS_PER_PROFILE = 100
+PROFILES_PER_FLOAT = 200
+FIRST_YEAR, LAST_YEAR = 2015, 2024
+QUERY_REPEATS = 5
+
+QUERIES = {
+    'profile lookup': ("SELECT profile_id FROM profiles WHERE float_id = :fid AND cycle_number = :cn", 'lookup'),
+    'profile levels': ("SELECT pressure, temperature, salinity FROM measurements WHERE profile_id = :pid", 'profile'),
+    'month of profiles': ("SELECT count(*) FROM profiles WHERE profile_date >= :start AND profile_date < :end", 'month'),
+    'month avg temperature': ("SELECT avg(temperature) FROM measurements WHERE profile_date >= :start AND profile_date < :end", 'month'),
+}
+
+def setup_variant(url, variant):
+    schema = f"bench_{variant}"
+    admin = create_engine(url)
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    admin.dispose()
+
+    engine = create_engine(url, connect_args={'options': f'-csearch_path={schema}'})
+    if variant == 'plain':
+        with engine.begin() as conn:
+            for statement in db_schema.BASE_DDL + db_schema.MEASUREMENT_DATE_DDL[:1]:
+                conn.execute(text(statement))
+    else:
+        db_schema.migrate(engine)
+        if variant == 'partitioned':
+            db_schema.partition_measurements(engine, FIRST_YEAR, LAST_YEAR)
+    return engine, schema
+
+def _copy(conn, table, columns, frame):
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def load_rows(engine, first_profile, n_profiles, rng):
+    """Appends synthetic floats/profiles/measurements; returns seconds spent in the measurements COPY."""
+    profile_ids = np.arange(first_profile, first_profile + n_profiles) + 1
+    float_ids = (profile_ids - 1) // PROFILES_PER_FLOAT + 1
+    span = np.datetime64(f'{LAST_YEAR + 1}-01-01') - np.datetime64(f'{FIRST_YEAR}-01-01')
+    # Profiles arrive roughly in date order, like a real archive sync.
+    offsets = np.sort(rng.integers(0, span.astype('timedelta64[s]').astype(np.int64), n_profiles))
+    dates = np.datetime64(f'{FIRST_YEAR}-01-01', 's') + offsets.astype('timedelta64[s]')
+
+    profiles = pd.DataFrame({
+        'profile_id': profile_ids, 'float_id': float_ids,
+        'cycle_number': (profile_ids - 1) % PROFILES_PER_FLOAT + 1, 'profile_date': dates,
+        'latitude': rng.uniform(-30, 30, n_profiles), 'longitude': rng.uniform(30, 110, n_profiles),
+    })
+    n_rows = n_profiles * LEVELS_PER_PROFILE
+    measurements = pd.DataFrame({
+        'profile_id': np.repeat(profile_ids, LEVELS_PER_PROFILE),
+        'pressure': np.tile(np.linspace(5, 2000, LEVELS_PER_PROFILE, dtype=np.float32), n_profiles),
+        'temperature': rng.uniform(2, 30, n_rows).astype(np.float32),
+        'salinity': rng.uniform(33, 37, n_rows).astype(np.float32),
+        'profile_date': np.repeat(dates, LEVELS_PER_PROFILE),
+    })
+
+    with engine.begin() as conn:
+        new_floats = np.unique(float_ids)
+        conn.execute(text("INSERT INTO floats (float_id, wmo_id) SELECT f, f::text FROM unnest(CAST(:ids AS int[])) f "
+                          "ON CONFLICT DO NOTHING"), {'ids': new_floats.tolist()})
+        _copy(conn, 'profiles', list(profiles.columns), profiles)
+        started = time.perf_counter()
+        _copy(conn, 'measurements', list(measurements.columns), measurements)
+        elapsed = time.perf_counter() - started
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text("ANALYZE"))
+    return elapsed
+
+def time_queries(engine, n_profiles, rng):
+    results = {}
+    with engine.connect() as conn:
+        for name, (sql, kind) in QUERIES.items():
+            timings = []
+            for _ in range(QUERY_REPEATS):
+                pid = int(rng.integers(1, n_profiles + 1))
+                month = pd.Timestamp(f'{rng.integers(FIRST_YEAR, LAST_YEAR + 1)}-{rng.integers(1, 13):02d}-01')
+                params = {
+                    'lookup': {'fid': (pid - 1) // PROFILES_PER_FLOAT + 1, 'cn': (pid - 1) % PROFILES_PER_FLOAT + 1},
+                    'profile': {'pid': pid},
+                    'month': {'start': month.to_pydatetime(), 'end': (month + pd.offsets.MonthBegin()).to_pydatetime()},
+                }[kind]
+                started = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                timings.append(time.perf_counter() - started)
+            results[name] = float(np.median(timings)) * 1000
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the measurements schema variants.")
+    parser.add_argument('--database-url', default=DATABASE_URL)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200_000, 1_000_000, 5_000_000],
+                        help="measurement row counts to benchmark at (cumulative)")
+    parser.add_argument('--variants', nargs='+', default=['plain', 'managed', 'partitioned'])
+    parser.add_argument('--keep', action='store_true', help="keep the scratch schemas")
+    args = parser.parse_args()
+
+    print("🚀 Benchmarking measurements schema...")
+    rows = []
+    for variant in args.variants:
+        engine, schema = setup_variant(args.database_url, variant)
+        rng = np.random.default_rng(0)
+        loaded = 0
+        for size in sorted(args.sizes):
+            n_new = max(size // LEVELS_PER_PROFILE - loaded, 0)
+            copy_s = load_rows(engine, loaded, n_new, rng) if n_new else 0.0
+            loaded += n_new
+            result = {'variant': variant, 'rows': loaded * LEVELS_PER_PROFILE,
+                      'ingest rows/s': round(n_new * LEVELS_PER_PROFILE / copy_s) if copy_s else None}
+            result.update({f"{name} (ms)": round(ms, 2) for name, ms in time_queries(engine, loaded, rng).items()})
+            rows.append(result)
+            print(f"   - {variant}: {result['rows']:,} rows loaded")
+        engine.dispose()
+        if not args.keep:
+            admin = create_engine(args.database_url)
+            with admin.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+            admin.dispose()
+
+    print()
+    print(pd.DataFrame(rows).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# bench_storage.py
+#
+# Compares the two level storage layouts (see level_storage.py) on the same
+# synthetic ARGO files:
+#   rows   - one `measurements` row per level
+#   arrays - one `profile_levels` row per profile with packed real[]/bytea columns
+# Reports on-disk size (table + indexes + TOAST), ingest time through
+# write_profile_arrays and the latency of depth-profile queries, for the
+# arrays layout both through the `measurement_levels` view and on the arrays
+# directly. Each layout runs in its own scratch schema, dropped afterwards.
+#
+# Usage: python bench_storage.py --files 50 --profiles 100 --levels 800
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from ingest_data import DATABASE_URL, decode_nc_file, write_profile_arrays
+from level_storage import levels_relation
+import db_schema
+import synthetic_argo
+
+QUERY_REPEATS = 20
+
+# (name, layouts it applies to, SQL). {levels} is the per-level relation of the layout.
+QUERIES = [
+    ("one profile, all levels", ('rows', 'arrays'),
+     "SELECT pressure, temperature, salinity FROM {levels} WHERE profile_id = :pid ORDER BY pressure"),
+    ("one profile, adjusted + QC view", ('arrays',),
+     "SELECT * FROM measurement_levels_qc WHERE profile_id = :pid ORDER BY level"),
+    ("one profile, packed arrays", ('arrays',),
+     "SELECT pressure, temperature, salinity FROM profile_levels WHERE profile_id = :pid"),
+    ("float depth profile 0-500 dbar", ('rows', 'arrays'),
+     "SELECT m.profile_id, m.pressure, m.temperature FROM {levels} m JOIN profiles p ON p.profile_id = m.profile_id "
+     "WHERE p.float_id = :fid AND m.pressure < 500"),
+    ("month avg temperature 0-100 dbar", ('rows', 'arrays'),
+     "SELECT avg(temperature) FROM {levels} WHERE profile_date >= :start AND profile_date < :end AND pressure < 100"),
+    ("full scan avg temperature", ('rows', 'arrays'),
+     "SELECT avg(temperature) FROM {levels}"),
+]
+
+STORAGE_TABLES = {'rows': ['measurements'], 'arrays': ['profile_levels']}
+
+def setup_layout(url, layout):
+    schema = f"bench_storage_{layout}"
+    admin = create_engine(url)
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    admin.dispose()
+    engine = create_engine(url, connect_args={'options': f'-csearch_path={schema}'})
+    db_schema.migrate(engine)
+    return engine, schema
+
+def ingest(engine, decoded, layout):
+    """Writes every decoded file in its own transaction, like batch_ingest; returns seconds."""
+    started = time.perf_counter()
+    for arrays in decoded:
+        with Session(engine) as session:
+            write_profile_arrays(session, [arrays], layout=layout)
+            session.commit()
+    elapsed = time.perf_counter() - started
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text("VACUUM ANALYZE"))
+    return elapsed
+
+def storage_mb(engine, layout):
+    with engine.connect() as conn:
+        return sum(conn.execute(text("SELECT pg_total_relation_size(CAST(:t AS regclass))"), {'t': table}).scalar()
+                   for table in STORAGE_TABLES[layout]) / 1e6
+
+def time_queries(engine, layout, rng):
+    levels = levels_relation(layout)
+    results = {}
+    with engine.connect() as conn:
+        profile_ids = [row[0] for row in conn.execute(text("SELECT profile_id FROM profiles"))]
+        float_ids = [row[0] for row in conn.execute(text("SELECT float_id FROM floats"))]
+        months = [row[0] for row in conn.execute(text(
+            "SELECT DISTINCT date_trunc('month', profile_date) FROM profiles WHERE profile_date IS NOT NULL"))]
+        for name, layouts, sql in QUERIES:
+            if layout not in layouts:
+                continue
+            timings = []
+            for _ in range(QUERY_REPEATS):
+                month = pd.Timestamp(months[rng.integers(len(months))])
+                params = {
+                    'pid': int(rng.choice(profile_ids)), 'fid': int(rng.choice(float_ids)),
+                    'start': month.to_pydatetime(), 'end': (month + pd.offsets.MonthBegin()).to_pydatetime(),
+                }
+                started = time.perf_counter()
+                conn.execute(text(sql.format(levels=levels)), params).fetchall()
+                timings.append(time.perf_counter() - started)
+            results[name] = float(np.median(timings)) * 1000
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rows and packed arrays level storage layouts.")
+    parser.add_argument('--database-url', default=DATABASE_URL)
+    parser.add_argument('--files', type=int, default=50, help="synthetic float files")
+    parser.add_argument('--profiles', type=int, default=100, help="profiles per file")
+    parser.add_argument('--levels', type=int, default=800, help="levels per profile")
+    parser.add_argument('--layouts', nargs='+', default=['rows', 'arrays'])
+    parser.add_argument('--keep', action='store_true', help="keep the scratch schemas")
+    args = parser.parse_args()
+
+    print(f"🧪 Generating {args.files} files x {args.profiles} profiles x {args.levels} levels...")
+    root = tempfile.mkdtemp(prefix="floatchat_storage_")
+    try:
+        decoded = []
+        for i in range(args.files):
+            path = os.path.join(root, f"{2900000 + i}_prof.nc")
+            synthetic_argo.write_float_file(path, str(2900000 + i), args.profiles, args.levels, seed=i)
+            decoded.append(decode_nc_file(path))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print("🚀 Benchmarking level storage layouts...")
+    rows = []
+    for layout in args.layouts:
+        engine, schema = setup_layout(args.database_url, layout)
+        seconds = ingest(engine, decoded, layout)
+        with engine.connect() as conn:
+            n_levels = conn.execute(text("SELECT sum(n_levels) FROM profile_summary")).scalar() or 0
+        result = {'layout': layout, 'levels': n_levels, 'size (MB)': round(storage_mb(engine, layout), 1),
+                  'ingest (s)': round(seconds, 2), 'ingest levels/s': round(n_levels / seconds)}
+        result.update({f"{name} (ms)": round(ms, 2)
+                       for name, ms in time_queries(engine, layout, np.random.default_rng(0)).items()})
+        rows.append(result)
+        print(f"   - {layout}: {n_levels:,} levels ingested in {seconds:.1f}s")
+        engine.dispose()
+        if not args.keep:
+            admin = create_engine(args.database_url)
+            with admin.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+            admin.dispose()
+
+    print()
+    print(pd.DataFrame(rows).set_index('layout').T.to_string())
+
+if __name__ == "__main__":
+    main()
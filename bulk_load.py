@@ -0,0 +1,225 @@
+# bulk_load.py
+#
+# Offline bulk loader for archived NetCDF dumps (e.g. the argo_data.zip made
+# by batch_ingest-colab.py). Reads .nc files straight from directories or zip
+# archives without extracting them, shards them by float across worker
+# processes, and has each worker load its shard in a single transaction with
+# batched COPY streams. Summaries are refreshed once at the end. With
+# --dry-run files are only decoded.
+#
+# Usage:
+#   python bulk_load.py argo_data.zip
+#   python bulk_load.py data/ more_data.zip --workers 8 --replace
+#   python bulk_load.py argo_data.zip --dry-run
+
+import os
+import re
+import glob
+import time
+import zlib
+import queue
+import logging
+import zipfile
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tqdm import tqdm
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from ingest_data import DATABASE_URL, decode_nc_bytes, write_profile_arrays
+from level_storage import STORAGE_LAYOUT
+from ingest_ledger import ingestion_watermark
+from aggregates import rebuild_all
+from db_schema import migrate
+
+WORKERS = int(os.getenv("BULK_LOAD_WORKERS", str(os.cpu_count() or 1)))
+# Files decoded before each COPY; bounds worker memory, not the transaction.
+BATCH_FILES = int(os.getenv("BULK_LOAD_BATCH_FILES", "50"))
+
+# ARGO file names carry the WMO id: 2902273_prof.nc, R2902273_001.nc, BD2902273_001D.nc ...
+_WMO_RE = re.compile(r'(\d{5,7})')
+
+logger = logging.getLogger("floatchat.ingest")
+
+def list_sources(paths):
+    """Returns (zip path or None, file name) for every .nc file under the given directories, archives or files."""
+    items = []
+    for path in paths:
+        if os.path.isdir(path):
+            items += [(None, f) for f in sorted(glob.glob(os.path.join(path, '**', '*.nc'), recursive=True))]
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                items += [(path, info.filename) for info in archive.infolist()
+                          if not info.is_dir() and info.filename.endswith('.nc')]
+        elif path.endswith('.nc') and os.path.isfile(path):
+            items.append((None, path))
+        else:
+            raise FileNotFoundError(f"not a directory, zip archive or .nc file: {path}")
+    return items
+
+def shard_of(name, n_shards):
+    """Files of one float always land in the same shard, so shards never write the same profiles."""
+    match = _WMO_RE.search(os.path.basename(name))
+    key = match.group(1) if match else os.path.basename(name)
+    return zlib.crc32(key.encode()) % n_shards
+
+def _level_count(arrays):
+    return int((~(np.isnan(arrays['pressure']) & np.isnan(arrays['temperature'])
+                  & np.isnan(arrays['salinity']))).sum())
+
+def load_shard(shard, items, db_url, dry_run, replace, layout, batch_files, progress):
+    """
+    Runs in a worker process: decodes the shard's files from memory and writes
+    them in one transaction, one COPY per `batch_files` files. Reports
+    (files, rows) increments on `progress` and returns the shard's totals, with
+    the climatology cells of profiles replaced by a committed shard.
+    """
+    stats = {'shard': shard, 'files': 0, 'failed': 0, 'profiles': 0, 'rows': 0,
+             'decode_s': 0.0, 'write_s': 0.0, 'error': None, 'stale_cells': []}
+    archives = {}
+    engine = None if dry_run else create_engine(db_url)
+    session = None if dry_run else Session(engine)
+    batch = []
+
+    def read(container, name):
+        if container is None:
+            with open(name, 'rb') as f:
+                return f.read()
+        if container not in archives:
+            archives[container] = zipfile.ZipFile(container)
+        return archives[container].read(name)
+
+    def flush():
+        started = time.perf_counter()
+        rows = write_profile_arrays(session, batch, replace=replace, refresh_aggregates=False, layout=layout,
+                                    stale_cells=stats['stale_cells'])
+        stats['write_s'] += time.perf_counter() - started
+        stats['rows'] += rows
+        progress.put((0, rows))
+        batch.clear()
+
+    try:
+        for container, name in items:
+            started = time.perf_counter()
+            try:
+                arrays = decode_nc_bytes(read(container, name), name)
+            except Exception as e:
+                logger.warning("failed to decode %s: %s", name, e)
+                stats['failed'] += 1
+                progress.put((1, 0))
+                continue
+            finally:
+                stats['decode_s'] += time.perf_counter() - started
+            stats['files'] += 1
+            stats['profiles'] += len(arrays['cycle_number'])
+            if dry_run:
+                rows = _level_count(arrays)
+                stats['rows'] += rows
+                progress.put((1, rows))
+                continue
+            progress.put((1, 0))
+            batch.append(arrays)
+            if len(batch) >= batch_files:
+                flush()
+        if session is not None:
+            if batch:
+                flush()
+            session.commit()
+    except Exception as e:
+        # The shard is all or nothing; rerunning it skips the profiles that are already stored.
+        if session is not None:
+            session.rollback()
+        stats['stale_cells'] = []
+        stats['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        for archive in archives.values():
+            archive.close()
+        if session is not None:
+            session.close()
+            engine.dispose()
+    return stats
+
+def bulk_load(sources, db_url=DATABASE_URL, workers=WORKERS, dry_run=False, replace=False,
+              layout=None, batch_files=BATCH_FILES):
+    """Loads every .nc file found in `sources`. Returns the per-shard stats."""
+    layout = layout or STORAGE_LAYOUT
+    items = list_sources(sources)
+    if not items:
+        print("❌ No NetCDF files found.")
+        return []
+    shards = [[] for _ in range(workers)]
+    for item in items:
+        shards[shard_of(item[1], workers)].append(item)
+    print(f"Found {len(items)} files; loading in {sum(1 for s in shards if s)} shards "
+          f"({'dry run, decode only' if dry_run else f'{layout} layout'}).")
+
+    watermark = 0
+    if not dry_run:
+        engine = create_engine(db_url)
+        migrate(engine, verbose=True)
+        with engine.connect() as conn:
+            watermark = ingestion_watermark(conn) or 0
+        engine.dispose()
+
+    started = time.perf_counter()
+    with multiprocessing.Manager() as manager:
+        progress = manager.Queue()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(load_shard, i, shard, db_url, dry_run, replace, layout, batch_files, progress)
+                       for i, shard in enumerate(shards) if shard]
+            rows = 0
+            with tqdm(total=len(items), desc="Loading files", unit="file") as bar:
+                while not all(f.done() for f in futures) or not progress.empty():
+                    try:
+                        files, new_rows = progress.get(timeout=0.2)
+                    except queue.Empty:
+                        continue
+                    rows += new_rows
+                    bar.update(files)
+                    bar.set_postfix(rows=f"{rows:,}", rows_s=f"{rows / (time.perf_counter() - started):,.0f}")
+            results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - started
+
+    stale_cells = sorted({cell for r in results for cell in r['stale_cells']})
+    if not dry_run and (stale_cells or any(r['rows'] for r in results)):
+        print("   - Refreshing summaries for the new profiles...")
+        engine = create_engine(db_url)
+        rebuild_all(engine, after_profile_id=watermark, layout=layout, stale_cells=stale_cells)
+        engine.dispose()
+
+    files = sum(r['files'] for r in results)
+    rows = sum(r['rows'] for r in results)
+    print(f"\n✅ {files} files, {sum(r['profiles'] for r in results):,} profiles, {rows:,} levels in {elapsed:.1f}s "
+          f"({files / elapsed:.1f} files/s, {rows / elapsed:,.0f} levels/s)")
+    print(f"   - decode {sum(r['decode_s'] for r in results):.1f}s, write {sum(r['write_s'] for r in results):.1f}s "
+          f"(summed over workers)")
+    failed = sum(r['failed'] for r in results)
+    if failed:
+        print(f"   - ⚠️ {failed} files could not be decoded")
+    for r in results:
+        if r['error']:
+            print(f"   - ❌ shard {r['shard']} rolled back ({r['files']} files): {r['error']}")
+    return results
+
+def main(argv=None, default_sources=()):
+    parser = argparse.ArgumentParser(description="Bulk-load NetCDF files from directories or zip archives.")
+    parser.add_argument('sources', nargs='*', default=list(default_sources),
+                        help="directories, zip archives or .nc files")
+    parser.add_argument('--database-url', default=DATABASE_URL)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--batch-files', type=int, default=BATCH_FILES, help="files per COPY stream")
+    parser.add_argument('--layout', choices=['rows', 'arrays'], default=STORAGE_LAYOUT)
+    parser.add_argument('--replace', action='store_true', help="replace profiles that are already stored")
+    parser.add_argument('--dry-run', action='store_true', help="only decode the files")
+    args = parser.parse_args(argv)
+    if not args.sources:
+        parser.error("no sources given")
+
+    print("🚀 Starting bulk load...")
+    bulk_load(args.sources, db_url=args.database_url, workers=args.workers, dry_run=args.dry_run,
+              replace=args.replace, layout=args.layout, batch_files=args.batch_files)
+
+if __name__ == "__main__":
+    main()
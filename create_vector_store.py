@@ -1,13 +1,16 @@
 # create_vector_store.py
 
-import chromadb
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import SentenceTransformerEmbeddings
-from langchain_core.documents import Document  # <-- new import
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+from ingest_data import DATABASE_URL
+from rag_corpus import update_index
+from vector_index import INDEX_DIR
 
 def main():
     """
     Creates and persists a vector store with contextual information about the ARGO database.
+    Static notes are combined with documents generated from the ingested data;
+    only documents that changed since the last build are re-embedded.
     """
     print("🚀 Creating the vector store 'cheat sheet'...")
 
@@ -15,6 +18,7 @@ def main():
     text_data = [
         "The 'floats' table contains metadata for each ARGO float, including a unique 'wmo_id'.",
         "The 'profiles' table stores information for each measurement cycle of a float, including the 'date', 'latitude', and 'longitude'.",
+        "A cycle can have an ascending profile (direction 'A') and a descending one (direction 'D'); filter on direction = 'A' for one profile per cycle.",
         "The 'measurements' table holds the scientific sensor readings like 'pressure', 'temperature', and 'salinity' for each profile.",
         "To link tables, the 'floats' table's 'float_id' connects to the 'profiles' table's 'float_id'.",
         "The 'profiles' table's 'profile_id' connects to the 'measurements' table's 'profile_id'.",
@@ -27,20 +31,14 @@ def main():
         "Temperature is measured in degrees Celsius."
     ]
 
-    # Convert strings to Document objects
-    documents = [Document(page_content=text) for text in text_data]
+    engine = create_engine(DATABASE_URL)
+    try:
+        total, embedded = update_index(engine, text_data)
+    except SQLAlchemyError as e:
+        print(f"⚠️ Database unavailable ({e.__class__.__name__}), building from the static notes only.")
+        total, embedded = update_index(None, text_data)
 
-    # Embedding model
-    embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
-
-    # Create the vector store
-    vector_store = Chroma.from_documents(
-        documents=documents,
-        embedding=embedding_function,
-        persist_directory="./chroma_db"
-    )
-
-    print(f"✅ Vector store created and saved to './chroma_db' with {len(documents)} documents.")
+    print(f"✅ Vector index saved to '{INDEX_DIR}' with {total} documents ({embedded} newly embedded).")
     print("This 'cheat sheet' is now ready for the AI agent to use.")
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+# db_schema.py
+#
+# Owns the database schema: base tables, keys, indexes and the tables used by
+# the ledger and the summaries. Changes are applied as numbered migrations and
+# recorded in `schema_migrations`, so `migrate()` is safe to run at every start.
+
+from sqlalchemy import text
+from ingest_ledger import LEDGER_DDL
+from aggregates import SUMMARY_DDL
+from level_storage import PROFILE_LEVELS_DDL
+from spatial_index import TILE_INDEX_DDL
+
+BASE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS floats (
+        float_id SERIAL PRIMARY KEY,
+        wmo_id TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS profiles (
+        profile_id SERIAL PRIMARY KEY,
+        float_id INTEGER NOT NULL REFERENCES floats (float_id),
+        cycle_number INTEGER NOT NULL,
+        profile_date TIMESTAMP,
+        latitude DOUBLE PRECISION,
+        longitude DOUBLE PRECISION
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS measurements (
+        profile_id INTEGER NOT NULL,
+        pressure REAL,
+        temperature REAL,
+        salinity REAL
+    )
+    """,
+]
+
+# Collapse duplicates left by the old SELECT-then-INSERT code before adding unique keys.
+DEDUPE_DDL = [
+    """
+    UPDATE profiles p SET float_id = keep.float_id
+    FROM floats f JOIN (SELECT wmo_id, min(float_id) AS float_id FROM floats GROUP BY wmo_id) keep
+      ON keep.wmo_id = f.wmo_id
+    WHERE p.float_id = f.float_id AND f.float_id <> keep.float_id
+    """,
+    "DELETE FROM floats f USING floats k WHERE f.wmo_id = k.wmo_id AND f.float_id > k.float_id",
+    """
+    DELETE FROM measurements m USING profiles p, profiles k
+    WHERE m.profile_id = p.profile_id
+      AND p.float_id = k.float_id AND p.cycle_number = k.cycle_number AND p.profile_id > k.profile_id
+    """,
+    """
+    DELETE FROM profiles p USING profiles k
+    WHERE p.float_id = k.float_id AND p.cycle_number = k.cycle_number AND p.profile_id > k.profile_id
+    """,
+]
+
+KEYS_DDL = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS floats_wmo_id_key ON floats (wmo_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS profiles_float_cycle_key ON profiles (float_id, cycle_number)",
+]
+
+INDEX_DDL = [
+    # Profiles are inserted roughly in date order, which is what BRIN needs.
+    "CREATE INDEX IF NOT EXISTS profiles_profile_date_brin ON profiles USING brin (profile_date)",
+    # Covers per-profile reads of all three variables without touching the heap.
+    """
+    CREATE INDEX IF NOT EXISTS measurements_profile_id_idx
+    ON measurements (profile_id) INCLUDE (pressure, temperature, salinity)
+    """,
+]
+
+# Denormalized date on measurements, used as the partition key.
+MEASUREMENT_DATE_DDL = [
+    "ALTER TABLE measurements ADD COLUMN IF NOT EXISTS profile_date TIMESTAMP",
+    """
+    UPDATE measurements m SET profile_date = p.profile_date
+    FROM profiles p WHERE p.profile_id = m.profile_id AND m.profile_date IS NULL
+    """,
+]
+
+# Per-cycle files hold the ascending profile (<wmo>_<cycle>.nc) and, for some
+# cycles, a descending one (<wmo>_<cycle>D.nc); both are kept.
+DIRECTION_DDL = [
+    "ALTER TABLE profiles ADD COLUMN IF NOT EXISTS direction CHAR(1) NOT NULL DEFAULT 'A'",
+    "CREATE UNIQUE INDEX IF NOT EXISTS profiles_float_cycle_direction_key ON profiles (float_id, cycle_number, direction)",
+    "DROP INDEX IF EXISTS profiles_float_cycle_key",
+]
+
+# (version, description, statements). Append only; never edit an applied migration.
+MIGRATIONS = [
+    (1, "base tables", BASE_DDL),
+    (2, "unique keys for upserts", DEDUPE_DDL + KEYS_DDL),
+    (3, "profile date BRIN and covering measurements index", INDEX_DDL),
+    (4, "ingestion ledger", [LEDGER_DDL]),
+    (5, "summary tables", SUMMARY_DDL),
+    (6, "profile_date on measurements", MEASUREMENT_DATE_DDL),
+    (7, "packed profile_levels and measurement_levels view", PROFILE_LEVELS_DDL),
+    (8, "lat/lon tile index on profiles", TILE_INDEX_DDL),
+    (9, "profile direction in the profile key", DIRECTION_DDL),
+]
+
+def applied_versions(conn):
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """))
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def migrate(engine, verbose=False):
+    """Applies every pending migration, each in its own transaction. Returns the versions applied."""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            # Serialize concurrent starters on the same database.
+            conn.execute(text("SELECT pg_advisory_xact_lock(72016001)"))
+            if version in applied_versions(conn):
+                continue
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.execute(text("INSERT INTO schema_migrations (version, description) VALUES (:v, :d)"),
+                         {'v': version, 'd': description})
+        applied.append(version)
+        if verbose:
+            print(f"   - Applied migration {version}: {description}")
+    return applied
+
+# --- Time-range partitioning of measurements ---
+
+def is_partitioned(conn, table='measurements'):
+    return conn.execute(text("""
+    SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid
+                   WHERE c.relname = :t AND pg_table_is_visible(c.oid))
+    """), {'t': table}).scalar()
+
+def create_year_partitions(conn, first_year, last_year):
+    """Creates yearly partitions of measurements (idempotent)."""
+    for year in range(first_year, last_year + 1):
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS measurements_y{year} PARTITION OF measurements
+        FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')
+        """))
+
+def partition_measurements(engine, first_year, last_year):
+    """
+    Converts measurements into a table range-partitioned by profile_date with
+    one partition per year and a default partition for undated rows. Runs in
+    one transaction; existing rows are copied into the new partitions.
+    """
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            create_year_partitions(conn, first_year, last_year)
+            return False
+        conn.execute(text("ALTER TABLE measurements RENAME TO measurements_unpartitioned"))
+        conn.execute(text("ALTER INDEX IF EXISTS measurements_profile_id_idx RENAME TO measurements_unpartitioned_profile_id_idx"))
+        conn.execute(text("""
+        CREATE TABLE measurements (LIKE measurements_unpartitioned INCLUDING DEFAULTS)
+        PARTITION BY RANGE (profile_date)
+        """))
+        create_year_partitions(conn, first_year, last_year)
+        conn.execute(text("CREATE TABLE measurements_default PARTITION OF measurements DEFAULT"))
+        for statement in INDEX_DDL[1:]:
+            conn.execute(text(statement))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS measurements_profile_date_brin ON measurements USING brin (profile_date)"))
+        conn.execute(text("INSERT INTO measurements SELECT * FROM measurements_unpartitioned"))
+
+        # Serial columns keep their sequence: hand ownership over before dropping the old table.
+        sequences = conn.execute(text("""
+        SELECT column_name, pg_get_serial_sequence('measurements_unpartitioned', column_name)
+        FROM information_schema.columns
+        WHERE table_name = 'measurements_unpartitioned' AND table_schema = current_schema()
+        """)).fetchall()
+        for column, sequence in sequences:
+            if sequence:
+                conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY measurements.{column}"))
+        conn.execute(text("DROP TABLE measurements_unpartitioned"))
+    return True
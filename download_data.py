@@ -1,6 +1,7 @@
 import os
 import requests
 from tqdm import tqdm
+from http_download import get_downloader
 
 # --- Configuration ---
 # This is the direct HTTP URL to the file
@@ -16,31 +17,23 @@ print("🚀 Starting HTTP download...")
 if not os.path.exists(DOWNLOAD_DIR):
     os.makedirs(DOWNLOAD_DIR)
 
+# Download with a tqdm progress bar. The shared downloader retries with backoff and resumes an interrupted
+# download from the partial file; the server copy is only transferred again
+# if it changed since the local one was written.
 try:
-    # Use requests to get the file, stream=True allows downloading large files
-    response = requests.get(FILE_URL, stream=True)
-    # Raise an error if the download failed (e.g., 404 Not Found)
-    response.raise_for_status() 
-
-    # Get the total file size from the headers
-    total_size = int(response.headers.get('content-length', 0))
-
-    print(f"Downloading {FILENAME} ({total_size / 1_000_000:.2f} MB)...")
-
-    # Open the local file in binary write mode and create a tqdm progress bar
-    with open(LOCAL_FILEPATH, 'wb') as f, tqdm(
-        total=total_size,
-        unit='B',
-        unit_scale=True,
-        unit_divisor=1024,
-        desc=FILENAME
-    ) as pbar:
-        # Download the file in chunks and update the progress bar
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-            pbar.update(len(chunk))
-
-    print(f"✅ Finished downloading {FILENAME}")
+    local_mtime = os.path.getmtime(LOCAL_FILEPATH) if os.path.exists(LOCAL_FILEPATH) else None
+    with tqdm(unit='B', unit_scale=True, unit_divisor=1024, desc=FILENAME) as pbar:
+        def on_progress(n_bytes, total_bytes):
+            pbar.total = total_bytes
+            pbar.update(n_bytes)
+
+        result = get_downloader().fetch(FILE_URL, LOCAL_FILEPATH, last_modified=local_mtime,
+                                        on_progress=on_progress)
+
+    if result.not_modified:
+        print(f"✅ {FILENAME} is already up to date")
+    else:
+        print(f"✅ Finished downloading {FILENAME} ({result.size / 1_000_000:.2f} MB)")
 
 except requests.exceptions.RequestException as e:
     print(f"❌ An error occurred: {e}")
@@ -0,0 +1,189 @@
+# http_download.py
+#
+# Shared HTTP download layer: one pooled requests.Session (keep-alive across
+# files), large write chunks, exponential-backoff retries that resume partial
+# transfers with HTTP Range, a per-host concurrency limit, and conditional
+# requests (ETag / Last-Modified) so unchanged files are not transferred again.
+# Files can be written to disk or kept in memory for direct decoding.
+
+import os
+import io
+import time
+import random
+import threading
+from email.utils import formatdate
+from collections import defaultdict
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+# Writes are buffered in CHUNK_SIZE blocks; the socket is read in smaller pieces
+# so an interrupted transfer keeps (and resumes after) almost everything received.
+CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1 << 20)))
+READ_SIZE = 64 * 1024
+PER_HOST_CONNECTIONS = int(os.getenv("DOWNLOAD_PER_HOST", "8"))
+MAX_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "5"))
+BACKOFF_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+TIMEOUT = (10, 60)  # connect, read
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+class DownloadError(requests.exceptions.RequestException):
+    """Raised when a download still fails after all retries."""
+
+class DownloadResult:
+    """Outcome of one download. `data` is set for in-memory downloads, `path` for files."""
+
+    def __init__(self, url, status, path=None, data=None, size=0, etag=None, last_modified=None):
+        self.url = url
+        self.status = status  # 'ok' or 'not_modified'
+        self.path = path
+        self.data = data
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def not_modified(self):
+        return self.status == 'not_modified'
+
+class Downloader:
+    """Thread-safe downloader sharing one connection pool across all threads."""
+
+    def __init__(self, per_host=PER_HOST_CONNECTIONS, chunk_size=CHUNK_SIZE, retries=MAX_RETRIES,
+                 backoff=BACKOFF_SECONDS, timeout=TIMEOUT):
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        # pool_block makes extra threads wait for a pooled connection instead of opening new ones.
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=per_host, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+        self._slots_lock = threading.Lock()
+
+    def _slot(self, url):
+        with self._slots_lock:
+            return self._host_slots[urlsplit(url).netloc]
+
+    def _sleep_before_retry(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+        time.sleep(min(delay, BACKOFF_MAX_SECONDS))
+
+    def fetch(self, url, local_path=None, etag=None, last_modified=None, on_progress=None):
+        """
+        Downloads `url` to `local_path`, or into memory when local_path is None.
+        With `etag` / `last_modified` (an HTTP date string or a POSIX timestamp)
+        the request is conditional and returns status 'not_modified' when the
+        server copy is unchanged. Interrupted transfers resume from the bytes
+        already received. `on_progress(chunk_bytes, total_bytes)` is called per chunk.
+        Raises DownloadError once the retries are exhausted.
+        """
+        part_path = f"{local_path}.part" if local_path else None
+        validator_path = f"{local_path}.part.validator" if local_path else None
+        buffer = None if local_path else io.BytesIO()
+        # The validator (ETag or Last-Modified) of a partial file left by an earlier run.
+        validator = (open(validator_path).read() if validator_path and os.path.exists(validator_path)
+                     and os.path.exists(part_path) else None)
+        last_error = None
+
+        with self._slot(url):
+            for attempt in range(self.retries + 1):
+                received = os.path.getsize(part_path) if part_path and os.path.exists(part_path) else (
+                    buffer.tell() if buffer is not None else 0)
+                headers = {}
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = (last_modified if isinstance(last_modified, str)
+                                                    else formatdate(last_modified, usegmt=True))
+                if received:
+                    headers["Range"] = f"bytes={received}-"
+                    if validator:
+                        # Only resume if the server still has the same version of the file.
+                        headers["If-Range"] = validator
+                response = None
+                try:
+                    response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+                    if response.status_code == 304:
+                        response.close()
+                        return DownloadResult(url, 'not_modified', etag=etag,
+                                              last_modified=response.headers.get("Last-Modified"))
+                    if response.status_code == 416:
+                        # The partial file does not fit the server copy: start over.
+                        response.close()
+                        if part_path and os.path.exists(part_path):
+                            os.remove(part_path)
+                        if buffer is not None:
+                            buffer.seek(0)
+                            buffer.truncate()
+                        raise requests.exceptions.ConnectionError(f"416 for {url}, restarting")
+                    if response.status_code in RETRY_STATUS:
+                        raise requests.exceptions.HTTPError(f"{response.status_code} for {url}", response=response)
+                    response.raise_for_status()
+
+                    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+                    resumed = response.status_code == 206
+                    total = int(response.headers.get("Content-Length", 0)) + (received if resumed else 0)
+                    if part_path:
+                        if validator:
+                            with open(validator_path, "w") as f:
+                                f.write(validator)
+                        with open(part_path, "ab" if resumed else "wb", buffering=self.chunk_size) as f:
+                            for chunk in response.iter_content(chunk_size=READ_SIZE):
+                                f.write(chunk)
+                                if on_progress:
+                                    on_progress(len(chunk), total)
+                        os.replace(part_path, local_path)
+                        if os.path.exists(validator_path):
+                            os.remove(validator_path)
+                        size = os.path.getsize(local_path)
+                    else:
+                        if not resumed:
+                            buffer.seek(0)
+                            buffer.truncate()
+                        for chunk in response.iter_content(chunk_size=READ_SIZE):
+                            buffer.write(chunk)
+                            if on_progress:
+                                on_progress(len(chunk), total)
+                        size = buffer.tell()
+                    return DownloadResult(
+                        url, 'ok', path=local_path, data=None if local_path else buffer.getvalue(), size=size,
+                        etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"),
+                    )
+                except requests.exceptions.HTTPError as e:
+                    last_error = e
+                    if response is None or response.status_code not in RETRY_STATUS:
+                        break  # 404 and friends will not get better
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError) as e:
+                    last_error = e
+                finally:
+                    if response is not None:
+                        response.close()
+                if attempt < self.retries:
+                    self._sleep_before_retry(attempt, response)
+
+        if part_path and isinstance(last_error, requests.exceptions.HTTPError):
+            # A permanent error: the partial file is useless.
+            for path in (part_path, validator_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        raise DownloadError(f"Download failed after {attempt + 1} attempts: {last_error}")
+
+_downloader = None
+_downloader_lock = threading.Lock()
+
+def get_downloader():
+    """Returns the process-wide Downloader."""
+    global _downloader
+    with _downloader_lock:
+        if _downloader is None:
+            _downloader = Downloader()
+        return _downloader
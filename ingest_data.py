@@ -1,12 +1,20 @@
 # ingest_data.py (Final Version with Progress Bar)
 
+import io
 import os
 import glob
+import logging
+import netCDF4
+import numpy as np
 import xarray as xr
 import pandas as pd
 from tqdm import tqdm  # Import tqdm for the progress bar
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
+from aggregates import refresh_summaries, climatology_cells
+from level_storage import STORAGE_LAYOUT, encode_profile_levels, copy_profile_levels
+from db_schema import migrate
+from tracing import TRACER, span, count
 
 # --- Database Configuration ---
 DB_USER = 'postgres'
@@ -16,11 +24,35 @@ DB_PORT = '5432'
 DB_NAME = 'argo_db'
 DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-def process_nc_file(filepath, session):
-    """Reads a single NetCDF file and populates the database."""
+# 'bulk' is the vectorized COPY engine, 'reference' is the original per-profile loop.
+INGEST_MODE = os.getenv("INGEST_MODE", "bulk")
+
+MEASUREMENT_COLUMNS = ['profile_id', 'pressure', 'temperature', 'salinity', 'profile_date']
+
+# 'lean' reads only the variables we ingest with netCDF4; 'xarray' decodes the whole dataset.
+NC_DECODER = os.getenv("NC_DECODER", "lean")
+
+# Stands in for a CYCLE_NUMBER that is missing (the _FillValue) in the file; such profiles are skipped.
+MISSING_CYCLE = -1
+
+# Level variables we ingest; their _ADJUSTED and _QC variants are read alongside.
+LEVEL_VARIABLES = {'pressure': 'PRES', 'temperature': 'TEMP', 'salinity': 'PSAL'}
+
+logger = logging.getLogger("floatchat.ingest")
+
+def process_nc_file(filepath, session, layout=None):
+    """
+    Reads a single NetCDF file and populates the database, one profile at a
+    time, in the given storage layout (default STORAGE_LAYOUT). The summary
+    tables are refreshed in the same transaction.
+    """
+    layout = layout or STORAGE_LAYOUT
     try:
-        with xr.open_dataset(filepath, decode_times=True) as ds:
-            wmo_id = ds.attrs.get('platform_number', os.path.basename(filepath).split('_')[0]).strip()
+        with span("open_dataset", file=os.path.basename(filepath)):
+            ds = xr.open_dataset(filepath, decode_times=True)
+        with ds, span("db_write", file=os.path.basename(filepath)):
+            wmo_id = _platform_id(ds['PLATFORM_NUMBER'].values if 'PLATFORM_NUMBER' in ds else [],
+                                  _default_platform(ds.attrs, filepath))
             
             select_float_sql = text("SELECT float_id FROM floats WHERE wmo_id = :wmo_id")
             float_obj = session.execute(select_float_sql, {'wmo_id': wmo_id}).fetchone()
@@ -33,60 +65,414 @@ def process_nc_file(filepath, session):
                 float_id = float_obj[0]
             
             num_profiles = ds.dims['N_PROF']
+            directions = _directions(ds['DIRECTION'].values if 'DIRECTION' in ds else None, num_profiles)
+            new_ids, encoded_levels = [], []
             for i in range(num_profiles):
                 profile_data = ds.isel(N_PROF=i)
-                cycle_num = int(profile_data['CYCLE_NUMBER'].item())
+                cycle_num = int(_cycle_numbers(profile_data['CYCLE_NUMBER'].values)[()])
+                if cycle_num == MISSING_CYCLE:
+                    count("profiles_skipped", reason="no_cycle")
+                    continue
                 
-                select_profile_sql = text("SELECT profile_id FROM profiles WHERE float_id = :fid AND cycle_number = :cn")
-                if session.execute(select_profile_sql, {'fid': float_id, 'cn': cycle_num}).fetchone():
+                select_profile_sql = text("SELECT profile_id FROM profiles WHERE float_id = :fid AND cycle_number = :cn "
+                                          "AND direction = :dir")
+                if session.execute(select_profile_sql, {'fid': float_id, 'cn': cycle_num, 'dir': directions[i]}).fetchone():
+                    count("profiles_skipped", reason="exists")
                     continue
 
                 profile_sql = text("""
-                INSERT INTO profiles (float_id, cycle_number, profile_date, latitude, longitude)
-                VALUES (:fid, :cn, :p_date, :lat, :lon)
+                INSERT INTO profiles (float_id, cycle_number, direction, profile_date, latitude, longitude)
+                VALUES (:fid, :cn, :dir, :p_date, :lat, :lon)
                 RETURNING profile_id;
                 """)
                 profile_params = {
                     'fid': float_id,
                     'cn': cycle_num,
+                    'dir': directions[i],
                     'p_date': pd.to_datetime(profile_data['JULD'].values).to_pydatetime(),
                     'lat': profile_data['LATITUDE'].item(),
                     'lon': profile_data['LONGITUDE'].item()
                 }
                 profile_id = session.execute(profile_sql, profile_params).fetchone()[0]
-                
+                new_ids.append(profile_id)
+
+                if layout == 'arrays':
+                    encoded, n_levels = encode_profile_levels(
+                        read_profile_arrays(ds.isel(N_PROF=[i])), np.array([0]), np.array([profile_id]))
+                    encoded_levels.append(encoded)
+                    count("rows_inserted", n_levels)
+                    continue
+
                 measurements_df = pd.DataFrame({
                     'profile_id': profile_id,
                     'pressure': profile_data['PRES'].values,
                     'temperature': profile_data['TEMP'].values,
                     'salinity': profile_data['PSAL'].values,
+                    'profile_date': profile_params['p_date'],
                 })
                 measurements_df.dropna(how='all', subset=['pressure', 'temperature', 'salinity'], inplace=True)
                 
                 if not measurements_df.empty:
-                    measurements_df.to_sql('measurements', session.get_bind(), if_exists='append', index=False)
-            
+                    measurements_df.to_sql('measurements', session.connection(), if_exists='append', index=False)
+                    count("rows_inserted", len(measurements_df))
+
+            copy_profile_levels(session, encoded_levels)
+            refresh_summaries(session, new_ids, layout)
             session.commit()
     except Exception:
         session.rollback()
-        # Suppress individual file errors to allow the batch to continue
-        pass
+        # A bad file does not stop the batch, but it is logged and counted.
+        logger.exception("failed to ingest %s", filepath)
+        count("files_failed", stage="ingest")
+
+# --- Vectorized (bulk) ingestion engine ---
+
+def _level_extras(read, names):
+    """Adjusted values and QC flags (as uint8 codes) for the level variables present in the file."""
+    extras = {}
+    for key, var in LEVEL_VARIABLES.items():
+        if f'{var}_ADJUSTED' in names:
+            extras[f'{key}_adjusted'] = np.atleast_2d(read(f'{var}_ADJUSTED', 'level'))
+        if f'{var}_QC' in names:
+            extras[f'{key}_qc'] = np.atleast_2d(read(f'{var}_QC', 'qc'))
+    return extras
+
+def _cycle_numbers(values, fill=None):
+    """CYCLE_NUMBER as int64; missing values (NaN once decoded, or the raw _FillValue) become MISSING_CYCLE."""
+    values = np.asarray(values)
+    missing = np.isnan(values) if values.dtype.kind == 'f' else np.zeros(values.shape, dtype=bool)
+    if fill is not None:
+        missing |= values == fill
+    return np.where(missing, MISSING_CYCLE, values).astype(np.int64)
+
+def _directions(chars, n_prof):
+    """DIRECTION of each profile as 'A' (ascending) or 'D' (descending); missing values count as ascending."""
+    if chars is None:
+        return np.full(n_prof, 'A')
+    chars = np.asarray(chars).astype('S1').reshape(n_prof, -1)[:, 0]
+    return np.where(chars == b'D', 'D', 'A')
+
+def _platform_id(chars, default):
+    """
+    WMO id of the first profile from PLATFORM_NUMBER, either raw N_PROF x STRING8
+    chars or one byte string per profile (as xarray decodes it); `default` when blank.
+    """
+    chars = np.asarray(chars)
+    if chars.size:
+        first = chars.reshape(chars.shape[0], -1)[0] if chars.ndim else chars.reshape(1)
+        wmo_id = b''.join(first.astype('S').tolist()).decode('ascii', 'ignore').strip()
+        if wmo_id:
+            return wmo_id
+    return str(default).strip()
+
+def _default_platform(attrs, filepath):
+    """The platform_number global attribute, else the file name prefix."""
+    return attrs.get('platform_number', os.path.basename(filepath).split('_')[0] if filepath else '')
+
+def read_profile_arrays(ds, filepath=None):
+    """Reads the variables we ingest from an open dataset as whole NumPy arrays; level values are float32."""
+
+    def read(name, kind):
+        values = ds[name].values
+        return values.astype(np.float32) if kind == 'level' else values.astype('S1').view(np.uint8)
+
+    return {
+        'wmo_id': _platform_id(ds['PLATFORM_NUMBER'].values if 'PLATFORM_NUMBER' in ds else [],
+                               _default_platform(ds.attrs, filepath)),
+        'cycle_number': _cycle_numbers(ds['CYCLE_NUMBER'].values),
+        'direction': _directions(ds['DIRECTION'].values if 'DIRECTION' in ds else None, ds.sizes['N_PROF']),
+        'profile_date': ds['JULD'].values.astype('datetime64[us]'),
+        'latitude': ds['LATITUDE'].values.astype(np.float64),
+        'longitude': ds['LONGITUDE'].values.astype(np.float64),
+        'pressure': np.atleast_2d(ds['PRES'].values.astype(np.float32)),
+        'temperature': np.atleast_2d(ds['TEMP'].values.astype(np.float32)),
+        'salinity': np.atleast_2d(ds['PSAL'].values.astype(np.float32)),
+        **_level_extras(read, ds.variables),
+    }
+
+# --- Lean decoder: reads only the variables we ingest, straight from netCDF4 ---
+
+def _raw(nc, name):
+    """Variable contents exactly as stored: no masking, scaling or char-to-string conversion."""
+    var = nc.variables[name]
+    var.set_auto_maskandscale(False)
+    var.set_auto_chartostring(False)
+    return var[...], getattr(var, '_FillValue', None)
+
+def _read_float(nc, name, dtype):
+    values, fill = _raw(nc, name)
+    values = np.asarray(values, dtype=dtype)  # netCDF4 returns a fresh array: no extra copy
+    if fill is not None:
+        values[values == dtype(fill)] = np.nan
+    return values
+
+def _read_juld(nc):
+    """JULD (days since the reference date in its units, 1950-01-01 for ARGO) as datetime64[us]; fill -> NaT."""
+    days, fill = _raw(nc, 'JULD')
+    days = np.asarray(days, dtype=np.float64)
+    units = getattr(nc.variables['JULD'], 'units', 'days since 1950-01-01 00:00:00 UTC')
+    if not units.startswith('days since'):
+        raise ValueError(f"unsupported JULD units: {units!r}")
+    reference = pd.Timestamp(units.split('since', 1)[1].replace('UTC', '').strip())
+    reference = np.datetime64(reference.tz_convert(None) if reference.tzinfo else reference, 'us')
+    valid = np.isfinite(days) if fill is None else np.isfinite(days) & (days != fill)
+    dates = np.full(days.shape, np.datetime64('NaT'), dtype='datetime64[us]')
+    dates[valid] = reference + np.round(days[valid] * 86_400_000_000).astype(np.int64).astype('timedelta64[us]')
+    return dates
+
+def _read_platform(nc, filepath):
+    """WMO id from PLATFORM_NUMBER (char N_PROF x STRING8), else the global attribute or the file name."""
+    chars = np.atleast_2d(_raw(nc, 'PLATFORM_NUMBER')[0]) if 'PLATFORM_NUMBER' in nc.variables else []
+    return _platform_id(chars, _default_platform(nc.__dict__, filepath))
+
+def read_profile_arrays_lean(nc, filepath=None):
+    """Same arrays as read_profile_arrays, from an open netCDF4.Dataset; level values are float32."""
+    cycles, cycle_fill = _raw(nc, 'CYCLE_NUMBER')
+
+    def read(name, kind):
+        if kind == 'level':
+            return _read_float(nc, name, np.float32)
+        chars = np.asarray(_raw(nc, name)[0]).astype('S1')
+        # Writers that store S1 with a trailing string1 dimension (e.g. xarray).
+        return (chars[..., 0] if chars.ndim > 2 and chars.shape[-1] == 1 else chars).view(np.uint8)
+
+    return {
+        'wmo_id': _read_platform(nc, filepath),
+        'cycle_number': _cycle_numbers(cycles, cycle_fill),
+        'direction': _directions(_raw(nc, 'DIRECTION')[0] if 'DIRECTION' in nc.variables else None,
+                                 len(nc.dimensions['N_PROF'])),
+        'profile_date': _read_juld(nc),
+        'latitude': _read_float(nc, 'LATITUDE', np.float64),
+        'longitude': _read_float(nc, 'LONGITUDE', np.float64),
+        'pressure': np.atleast_2d(_read_float(nc, 'PRES', np.float32)),
+        'temperature': np.atleast_2d(_read_float(nc, 'TEMP', np.float32)),
+        'salinity': np.atleast_2d(_read_float(nc, 'PSAL', np.float32)),
+        **_level_extras(read, nc.variables),
+    }
+
+def _decode(filepath, data=None):
+    name = os.path.basename(filepath)
+    with span("open_dataset", file=name, decoder=NC_DECODER):
+        if NC_DECODER == 'lean':
+            with netCDF4.Dataset(name if data is not None else filepath, memory=data) as nc:
+                return read_profile_arrays_lean(nc, filepath)
+        store = xr.backends.NetCDF4DataStore(netCDF4.Dataset(name, memory=data)) if data is not None else filepath
+        with xr.open_dataset(store, decode_times=True) as ds:
+            return read_profile_arrays(ds, filepath)
+
+def decode_nc_file(filepath):
+    """Opens a NetCDF file and returns its profile arrays (no database access)."""
+    return _decode(filepath)
+
+def decode_nc_bytes(data, filepath):
+    """Decodes a NetCDF file held in memory (e.g. streamed from HTTP) without touching disk."""
+    return _decode(filepath, data)
+
+def get_or_create_float(session, wmo_id):
+    """Returns the float_id for a WMO id, inserting the float if it is new (one round trip)."""
+    result = session.execute(text("""
+    INSERT INTO floats (wmo_id) VALUES (:wmo_id)
+    ON CONFLICT (wmo_id) DO UPDATE SET wmo_id = EXCLUDED.wmo_id
+    RETURNING float_id
+    """), {'wmo_id': wmo_id})
+    return result.fetchone()[0]
+
+def _profile_keys(arrays):
+    """(cycle number, direction) of each profile, the per-float key of the profiles table."""
+    return list(zip(arrays['cycle_number'].tolist(), arrays['direction'].tolist()))
+
+def _first_cycle_positions(arrays):
+    """
+    Returns the position of the first profile of each cycle and direction (later
+    duplicates are skipped, as are profiles without a cycle number).
+    """
+    keys = arrays['cycle_number'] * 2 + (arrays['direction'] == 'D')
+    _, first_idx = np.unique(keys, return_index=True)
+    first_idx = first_idx[arrays['cycle_number'][first_idx] != MISSING_CYCLE]
+    first_idx.sort()
+    return first_idx
+
+def delete_profiles(session, float_id, keys):
+    """
+    Deletes stored profiles (and their measurements) of a float, given their
+    (cycle number, direction) keys: a descending profile only replaces the
+    descending profile of its cycle. Returns the climatology cells the deleted
+    profiles fell into, to be refreshed.
+    """
+    keys = sorted(set(keys))
+    ids = session.execute(text("""
+    SELECT profile_id FROM profiles
+    WHERE float_id = :fid AND (cycle_number, direction) IN (
+        SELECT * FROM unnest(CAST(:cns AS integer[]), CAST(:dirs AS char(1)[]))
+    )
+    """), {'fid': float_id, 'cns': [int(c) for c, _ in keys], 'dirs': [d for _, d in keys]}).scalars().all()
+    if not ids:
+        return []
+    cells = climatology_cells(session, ids)
+    session.execute(text("DELETE FROM measurements WHERE profile_id = ANY(:ids)"), {'ids': ids})
+    session.execute(text("DELETE FROM profiles WHERE profile_id = ANY(:ids)"), {'ids': ids})
+    return cells
+
+def insert_profiles_bulk(session, float_id, arrays, positions):
+    """
+    Inserts the selected profiles in one multi-row INSERT. Profiles whose cycle and
+    direction are already stored are skipped by the unique key.
+    Returns (inserted positions, profile ids).
+    """
+    if len(positions) == 0:
+        return positions, np.empty(0, dtype=np.int64)
+
+    dates = pd.to_datetime(arrays['profile_date'][positions])
+    lats = arrays['latitude'][positions]
+    lons = arrays['longitude'][positions]
+    values, params = [], {'fid': float_id}
+    for n, pos in enumerate(positions):
+        values.append(f"(:fid, :cn{n}, :dir{n}, :pd{n}, :lat{n}, :lon{n})")
+        params[f'cn{n}'] = int(arrays['cycle_number'][pos])
+        params[f'dir{n}'] = str(arrays['direction'][pos])
+        params[f'pd{n}'] = None if pd.isna(dates[n]) else dates[n].to_pydatetime()
+        params[f'lat{n}'] = None if np.isnan(lats[n]) else float(lats[n])
+        params[f'lon{n}'] = None if np.isnan(lons[n]) else float(lons[n])
+
+    # RETURNING order is not guaranteed, so map ids back through the cycle and direction.
+    rows = session.execute(text(f"""
+    INSERT INTO profiles (float_id, cycle_number, direction, profile_date, latitude, longitude)
+    VALUES {', '.join(values)}
+    ON CONFLICT (float_id, cycle_number, direction) DO NOTHING
+    RETURNING profile_id, cycle_number, direction;
+    """), params).fetchall()
+    id_by_key = {(cn, direction): pid for pid, cn, direction in rows}
+    keys = _profile_keys(arrays)
+    inserted = np.array([pos for pos in positions if keys[pos] in id_by_key], dtype=np.int64)
+    ids = np.array([id_by_key[keys[pos]] for pos in inserted], dtype=np.int64)
+    return inserted, ids
+
+def flatten_measurements(arrays, positions, profile_ids):
+    """Flattens the (N_PROF, N_LEVELS) arrays of the selected profiles into measurement rows."""
+    pres = arrays['pressure'][positions]
+    temp = arrays['temperature'][positions]
+    psal = arrays['salinity'][positions]
+    keep = ~(np.isnan(pres) & np.isnan(temp) & np.isnan(psal))
+    per_level = lambda values: np.repeat(values, pres.shape[1]).reshape(pres.shape)[keep]
+    return pd.DataFrame({
+        'profile_id': per_level(profile_ids),
+        'pressure': pres[keep],
+        'temperature': temp[keep],
+        'salinity': psal[keep],
+        'profile_date': per_level(arrays['profile_date'][positions]),
+    }, columns=MEASUREMENT_COLUMNS)
+
+def copy_frames(session, table, columns, frames):
+    """Streams DataFrame rows into `table` with a single COPY FROM STDIN; returns the row count."""
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return 0
+    buffer = io.StringIO()
+    for frame in frames:
+        frame.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+
+    raw_conn = session.connection().connection
+    with raw_conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    return sum(len(f) for f in frames)
+
+def copy_measurements(session, frames):
+    """Streams measurement rows into PostgreSQL with a single COPY FROM STDIN."""
+    return copy_frames(session, 'measurements', MEASUREMENT_COLUMNS, frames)
+
+def write_profile_arrays(session, arrays_list, replace=False, refresh_aggregates=True, layout=None,
+                         stale_cells=None):
+    """
+    Writes decoded files to the database; levels go out in one COPY stream, as
+    measurement rows or as packed profile_levels rows depending on `layout`
+    (default STORAGE_LAYOUT).
+    With replace=True, profiles already stored for the same cycles and directions are deleted first,
+    so a reprocessed file supersedes the old data inside the caller's transaction.
+    With refresh_aggregates=True the summary tables are updated in the same transaction,
+    including the climatology cells of replaced profiles; otherwise those cells are
+    appended to `stale_cells` (a list) for the caller's later refresh.
+    Returns the number of levels written.
+    """
+    layout = layout or STORAGE_LAYOUT
+    with span("db_write", files=len(arrays_list), layout=layout) as attrs:
+        frames, new_ids, deleted_cells = [], [], []
+        for arrays in arrays_list:
+            float_id = get_or_create_float(session, arrays['wmo_id'])
+            if replace:
+                deleted_cells.extend(delete_profiles(session, float_id, _profile_keys(arrays)))
+            positions, profile_ids = insert_profiles_bulk(
+                session, float_id, arrays, _first_cycle_positions(arrays)
+            )
+            no_cycle = int((arrays['cycle_number'] == MISSING_CYCLE).sum())
+            count("profiles_skipped", no_cycle, reason="no_cycle")
+            count("profiles_skipped", len(arrays['cycle_number']) - no_cycle - len(positions), reason="exists")
+            if len(positions):
+                if layout == 'arrays':
+                    frames.append(encode_profile_levels(arrays, positions, profile_ids))
+                else:
+                    frames.append(flatten_measurements(arrays, positions, profile_ids))
+                new_ids.extend(profile_ids.tolist())
+        if layout == 'arrays':
+            with span("copy_profile_levels"):
+                copy_profile_levels(session, [encoded for encoded, _ in frames])
+            rows = sum(n for _, n in frames)
+        else:
+            with span("copy_measurements"):
+                rows = copy_measurements(session, frames)
+        if refresh_aggregates:
+            with span("refresh_summaries", profiles=len(new_ids)):
+                refresh_summaries(session, new_ids, layout, stale_cells=deleted_cells)
+        elif stale_cells is not None:
+            stale_cells.extend(deleted_cells)
+        attrs['rows'] = rows
+    count("rows_inserted", rows)
+    return rows
+
+def process_nc_file_bulk(filepath, session):
+    """Vectorized counterpart of process_nc_file. Returns the number of measurement rows inserted."""
+    try:
+        rows = write_profile_arrays(session, [decode_nc_file(filepath)])
+        session.commit()
+        return rows
+    except Exception:
+        session.rollback()
+        # A bad file does not stop the batch, but it is logged and counted.
+        logger.exception("failed to ingest %s", filepath)
+        count("files_failed", stage="ingest")
+        return 0
+
+INGEST_MODES = {
+    'reference': process_nc_file,
+    'bulk': process_nc_file_bulk,
+}
 
 if __name__ == "__main__":
-    print("🚀 Starting local file ingestion...")
-    data_dir = "data"
-    nc_files = glob.glob(os.path.join(data_dir, '*.nc'))
-    
-    if not nc_files:
-        print("❌ No NetCDF files found in the 'data' directory.")
+    if INGEST_MODE != 'reference':
+        # Directories and zip archives, sharded across processes (see bulk_load.py).
+        # Extra arguments are passed on, e.g. `python ingest_data.py argo_data.zip --dry-run`.
+        import bulk_load
+        bulk_load.main(default_sources=["data"])
     else:
-        print(f"Found {len(nc_files)} files to ingest into the database.")
-        engine = create_engine(DATABASE_URL)
-        Session = sessionmaker(bind=engine)
-        
-        # Use tqdm for a progress bar
-        for f in tqdm(nc_files, desc="Ingesting files"):
-            with Session() as session:
-                process_nc_file(f, session)
-        
-        print("\n✅ Data ingestion complete!")
\ No newline at end of file
+        print("🚀 Starting local file ingestion...")
+        data_dir = "data"
+        nc_files = glob.glob(os.path.join(data_dir, '*.nc'))
+
+        if not nc_files:
+            print("❌ No NetCDF files found in the 'data' directory.")
+        else:
+            print(f"Found {len(nc_files)} files to ingest into the database.")
+            engine = create_engine(DATABASE_URL)
+            migrate(engine, verbose=True)
+            Session = sessionmaker(bind=engine)
+            ingest = INGEST_MODES[INGEST_MODE]
+            print(f"Using '{INGEST_MODE}' ingestion mode.")
+
+            # Use tqdm for a progress bar
+            for f in tqdm(nc_files, desc="Ingesting files"):
+                with Session() as session:
+                    ingest(f, session)
+
+            print("\n✅ Data ingestion complete!")
+            for name, n, total, mean_ms, max_ms, errors in TRACER.summary():
+                print(f"   - {name:<18} {n:>6} calls, {total:7.1f}s total, {mean_ms:8.1f} ms mean, {max_ms:8.1f} ms max, {errors} errors")
@@ -0,0 +1,82 @@
+# ingest_ledger.py
+#
+# Persistent record of which index files have been ingested, so that each run
+# only fetches files that are new or were updated upstream since the last run.
+
+import pandas as pd
+from sqlalchemy import text
+
+# Applied by db_schema.migrate().
+LEDGER_DDL = """
+CREATE TABLE IF NOT EXISTS ingest_ledger (
+    file TEXT PRIMARY KEY,
+    date_update TIMESTAMP,
+    size_bytes BIGINT,
+    etag TEXT,
+    status TEXT NOT NULL,
+    rows_ingested BIGINT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Ledger statuses. Anything that is not 'done' is retried on the next run.
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+def select_changed_files(engine, index_df, with_etag=False):
+    """
+    Returns the index rows that still need ingesting: files never ingested,
+    files whose last attempt failed or crashed, and files whose upstream
+    'date_update' is newer than the one recorded when they were ingested.
+    With with_etag=True an 'etag' column holds the ETag of the last ingested
+    copy, for conditional downloads.
+    """
+    ledger = pd.read_sql(
+        text("SELECT file, date_update AS ledger_date_update, etag FROM ingest_ledger WHERE status = :done"),
+        engine, params={'done': STATUS_DONE}
+    )
+    merged = index_df.merge(ledger, on='file', how='left')
+    changed = merged['ledger_date_update'].isna() | (merged['date_update'] > merged['ledger_date_update'])
+    columns = list(index_df.columns) + (['etag'] if with_etag else [])
+    return merged.loc[changed, columns]
+
+def _upsert(session, params):
+    session.execute(text("""
+    INSERT INTO ingest_ledger (file, date_update, size_bytes, etag, status, rows_ingested, attempts, error, updated_at)
+    VALUES (:file, :date_update, :size_bytes, :etag, :status, :rows_ingested, 1, :error, now())
+    ON CONFLICT (file) DO UPDATE SET
+        date_update = EXCLUDED.date_update,
+        size_bytes = COALESCE(EXCLUDED.size_bytes, ingest_ledger.size_bytes),
+        etag = COALESCE(EXCLUDED.etag, ingest_ledger.etag),
+        status = EXCLUDED.status,
+        rows_ingested = EXCLUDED.rows_ingested,
+        attempts = ingest_ledger.attempts + 1,
+        error = EXCLUDED.error,
+        updated_at = now();
+    """), params)
+
+def mark_done(session, file, date_update, size_bytes=None, etag=None, rows=0):
+    """Records a successful ingestion. Call inside the same transaction as the data write."""
+    _upsert(session, {
+        'file': file, 'date_update': date_update, 'size_bytes': size_bytes, 'etag': etag,
+        'status': STATUS_DONE, 'rows_ingested': rows, 'error': None,
+    })
+
+def mark_unchanged(session, file, date_update):
+    """Records that the server copy matched the ingested one (HTTP 304); the data stays as is."""
+    session.execute(text("""
+    UPDATE ingest_ledger SET date_update = :date_update, updated_at = now() WHERE file = :file
+    """), {'file': file, 'date_update': date_update})
+
+def mark_failed(session, file, date_update, error):
+    """Records a failed attempt so the file is retried on the next run."""
+    _upsert(session, {
+        'file': file, 'date_update': date_update, 'size_bytes': None, 'etag': None,
+        'status': STATUS_FAILED, 'rows_ingested': 0, 'error': str(error)[:1000],
+    })
+
+def ingestion_watermark(conn):
+    """Returns a value that changes whenever profiles are ingested or replaced."""
+    return conn.execute(text("SELECT max(profile_id) FROM profiles")).scalar()
@@ -0,0 +1,126 @@
+# level_storage.py
+#
+# Storage layouts for the per-level data of a profile:
+#   rows   - one `measurements` row per level (pressure, temperature, salinity);
+#   arrays - one `profile_levels` row per profile holding packed real[] arrays
+#            for the values and their _ADJUSTED variants (missing values are
+#            NaN), and bytea QC flags; written with a binary COPY.
+# The `measurement_levels` view unnests the packed values into one row per
+# level (NaN back to NULL), so row-oriented SQL and the summaries work with
+# either layout; `measurement_levels_qc` adds the adjusted values and QC flags.
+
+import io
+import os
+import struct
+import numpy as np
+
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "rows")
+
+LEVEL_KEYS = ['pressure', 'temperature', 'salinity']
+ARRAY_COLUMNS = LEVEL_KEYS + [f'{key}_adjusted' for key in LEVEL_KEYS]
+QC_COLUMNS = [f'{key}_qc' for key in LEVEL_KEYS]
+PROFILE_LEVEL_COLUMNS = ['profile_id', 'profile_date', 'n_levels'] + ARRAY_COLUMNS + QC_COLUMNS
+
+def _unnest_view(name, array_columns, qc_columns=()):
+    """
+    A view with one row per level of profile_levels. Every array unnested costs
+    time even when the query does not use it, hence a lean view and a full one.
+    """
+    values = [f"NULLIF(u.{column}, 'NaN') AS {column}" for column in array_columns]
+    flags = [f"chr(NULLIF(get_byte(l.{column}, u.level::int - 1), 0)) AS {column}" for column in qc_columns]
+    return f"""
+    CREATE OR REPLACE VIEW {name} AS
+    SELECT l.profile_id, u.level::int AS level, {', '.join(values + flags)}, l.profile_date
+    FROM profile_levels l
+    CROSS JOIN LATERAL unnest({', '.join(f'l.{column}' for column in array_columns)})
+         WITH ORDINALITY AS u({', '.join(array_columns)}, level)
+    """
+
+# Applied by db_schema.migrate().
+PROFILE_LEVELS_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS profile_levels (
+        profile_id INTEGER PRIMARY KEY REFERENCES profiles (profile_id) ON DELETE CASCADE,
+        profile_date TIMESTAMP,
+        n_levels INTEGER NOT NULL,
+        {', '.join(f'{column} REAL[]' for column in ARRAY_COLUMNS)},
+        {', '.join(f'{column} BYTEA' for column in QC_COLUMNS)}
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS profile_levels_profile_date_brin ON profile_levels USING brin (profile_date)",
+    _unnest_view('measurement_levels', LEVEL_KEYS),
+    _unnest_view('measurement_levels_qc', ARRAY_COLUMNS, QC_COLUMNS),
+]
+
+def levels_relation(layout=None):
+    """The table or view with one row per level (profile_id, pressure, temperature, salinity, profile_date)."""
+    return 'measurement_levels' if (layout or STORAGE_LAYOUT) == 'arrays' else 'measurements'
+
+def unused_relations(layout=None):
+    """The level tables and views that stay empty in the given layout (hidden from the agent's schema digest)."""
+    if (layout or STORAGE_LAYOUT) == 'arrays':
+        return ['measurements']
+    return ['profile_levels', 'measurement_levels', 'measurement_levels_qc']
+
+# Appended to the agent prompt.
+AGENT_HINT = "" if STORAGE_LAYOUT != 'arrays' else """
+Levels are stored packed per profile: query the view `measurement_levels` (one row per level with profile_id,
+level, pressure, temperature, salinity and profile_date) instead of `measurements`, and filter it by
+profile_id or profile_date. `measurement_levels_qc` adds the *_adjusted values and *_qc flags.
+"""
+
+# --- Binary COPY encoding of profile_levels rows ---
+
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_TRAILER = struct.pack('>h', -1)
+_NULL = struct.pack('>i', -1)
+_PG_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+_FLOAT4_OID = 700
+
+def _field(payload):
+    return _NULL if payload is None else struct.pack('>i', len(payload)) + payload
+
+def _float4_array(values):
+    """A float4[] in COPY binary format. Missing values are stored as NaN, so there are no NULL elements."""
+    elements = np.empty(len(values), dtype=[('size', '>i4'), ('value', '>f4')])
+    elements['size'] = 4
+    elements['value'] = values
+    return struct.pack('>iiiii', 1, 0, _FLOAT4_OID, len(values), 1) + elements.tobytes()
+
+def encode_profile_levels(arrays, positions, profile_ids):
+    """
+    Encodes one profile_levels row per selected profile in COPY binary format.
+    Levels where pressure, temperature and salinity are all missing are dropped,
+    exactly like the rows layout, so both layouts hold the same levels.
+    Returns (row bytes, number of levels).
+    """
+    pres, temp, psal = (arrays[key][positions] for key in LEVEL_KEYS)
+    keep = ~(np.isnan(pres) & np.isnan(temp) & np.isnan(psal))
+    dates = arrays['profile_date'][positions].astype('datetime64[us]')
+    columns = [arrays.get(column) for column in ARRAY_COLUMNS + QC_COLUMNS]
+    chunks = []
+    for n, (pos, pid, mask, date) in enumerate(zip(positions, profile_ids, keep, dates)):
+        fields = [struct.pack('>i', int(pid)),
+                  None if np.isnat(date) else struct.pack('>q', int((date - _PG_EPOCH).astype(np.int64))),
+                  struct.pack('>i', int(mask.sum()))]
+        for column, values in zip(ARRAY_COLUMNS + QC_COLUMNS, columns):
+            if values is None:
+                fields.append(None)
+            elif column in QC_COLUMNS:
+                fields.append(values[pos][mask].tobytes())
+            else:
+                fields.append(_float4_array(values[pos][mask]))
+        chunks.append(struct.pack('>h', len(fields)) + b''.join(_field(f) for f in fields))
+    return b''.join(chunks), int(keep.sum())
+
+def copy_profile_levels(session, encoded_rows):
+    """Streams encoded profile_levels rows into PostgreSQL with one binary COPY."""
+    encoded_rows = [rows for rows in encoded_rows if rows]
+    if not encoded_rows:
+        return
+    buffer = io.BytesIO(_COPY_HEADER + b''.join(encoded_rows) + _COPY_TRAILER)
+    raw_conn = session.connection().connection
+    with raw_conn.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY profile_levels ({', '.join(PROFILE_LEVEL_COLUMNS)}) FROM STDIN WITH (FORMAT binary)", buffer
+        )
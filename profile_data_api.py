@@ -0,0 +1,282 @@
+# profile_data_api.py
+#
+# Chart-ready data straight from PostgreSQL, next to the agent: plots never go
+# through the LLM. Every query reduces the data on the server, so a plot over
+# millions of levels transfers a few thousand numbers:
+#   depth_profile - levels averaged per pressure bin (mean, std, min, max, count);
+#   ts_density    - temperature/salinity pairs counted on a 2-D grid (T/S diagram);
+#   time_series   - one value per profile (a layer mean, or the profile summary),
+#                   downsampled with LTTB to a fixed number of points;
+#   map_grid      - profiles per lat/lon cell with the cell's mean value.
+# Results are NumPy columns (ChartData, convertible to Arrow or pandas) and are
+# cached per query parameters; the cache is flushed when new profiles arrive.
+
+import time
+import threading
+import numpy as np
+from cachetools import TTLCache
+from sqlalchemy import text
+
+from level_storage import levels_relation
+from spatial_index import profiles_in_region
+from ingest_ledger import ingestion_watermark
+from tracing import span, count
+
+CACHE_TTL_SECONDS = 600
+CACHE_MAX_ENTRIES = 256
+WATERMARK_CHECK_SECONDS = 30
+
+VARIABLES = ('temperature', 'salinity')
+DEPTH_BIN_DBAR = 10
+MAX_PRESSURE_DBAR = 2000
+TIME_SERIES_POINTS = 1000
+MAP_CELL_DEG = 1.0
+TS_BINS = 100
+TS_RANGES = {'temperature': (-2.0, 32.0), 'salinity': (30.0, 38.0)}
+
+class ChartData:
+    """Columns of equal length as NumPy arrays, plus metadata about the query (e.g. rows before downsampling)."""
+
+    def __init__(self, columns, **meta):
+        self.columns = columns
+        self.meta = meta
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.table(self.columns)
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.columns)
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: the indices of `n_out` points that keep the
+    visual shape of the series (x ascending, no NaNs). The first and last
+    points are always kept; every bucket in between keeps the point forming
+    the largest triangle with the previously kept point and the next bucket's mean.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bounds = (np.arange(n_out - 1) * ((n - 2) / (n_out - 2))).astype(np.int64) + 1
+    bounds[-1] = n - 1
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = bounds[i], bounds[i + 1]
+        if i + 2 <= n_out - 2:
+            next_x, next_y = x[end:bounds[i + 2]].mean(), y[end:bounds[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+def _check_variable(variable):
+    if variable not in VARIABLES:
+        raise ValueError(f"unknown variable {variable!r}; expected one of {', '.join(VARIABLES)}")
+
+def _filters(alias, wmo_id=None, start=None, end=None, bbox=None, date_alias=None):
+    """
+    WHERE clauses (joined with AND, or "TRUE") and parameters for the common
+    filters. `alias` has float_id, latitude and longitude; dates are read from
+    `date_alias` (default `alias`), e.g. the levels relation for partition pruning.
+    bbox is (lat_min, lat_max, lon_min, lon_max), possibly crossing the dateline,
+    or a region name or polygon; it is looked up on profiles through the tile and
+    date index (spatial_index.profiles_in_region), also for profile_summary rows.
+    """
+    clauses, params = [], {}
+    if wmo_id:
+        clauses.append(f"{alias}.float_id = (SELECT float_id FROM floats WHERE wmo_id = :wmo_id)")
+        params['wmo_id'] = str(wmo_id)
+    if start is not None:
+        clauses.append(f"{date_alias or alias}.profile_date >= :start")
+        params['start'] = start
+    if end is not None:
+        clauses.append(f"{date_alias or alias}.profile_date < :end")
+        params['end'] = end
+    if bbox is not None:
+        region, region_params = profiles_in_region(bbox, start, end)
+        clauses.append(f"{alias}.profile_id IN (SELECT profile_id FROM ({region}) r)")
+        params.update(region_params)
+    return " AND ".join(clauses) or "TRUE", params
+
+def _fetch_columns(conn, sql, params, dtypes):
+    """Runs a query and returns its result as {column: array}; NULLs become NaN / NaT."""
+    rows = conn.execute(text(sql), params).fetchall()
+    values = list(zip(*rows)) if rows else [()] * len(dtypes)
+    columns = {}
+    for (name, dtype), column in zip(dtypes.items(), values):
+        if dtype == 'datetime64[us]':
+            columns[name] = np.array([np.datetime64('NaT') if v is None else v for v in column], dtype=dtype)
+        elif np.dtype(dtype).kind == 'f':
+            columns[name] = np.array([np.nan if v is None else v for v in column], dtype=dtype)
+        else:
+            columns[name] = np.array(column, dtype=dtype)
+    return columns
+
+class ProfileDataAPI:
+    """Server-side reduced plot data for one database, with a TTL cache keyed by query parameters."""
+
+    def __init__(self, engine, layout=None, ttl_seconds=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.engine = engine
+        self.levels = levels_relation(layout)
+        self._cache = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._watermark_checked = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _check_watermark(self):
+        """Flushes the cache when profiles were ingested since the last check."""
+        now = time.monotonic()
+        if now - self._watermark_checked < WATERMARK_CHECK_SECONDS:
+            return
+        with self.engine.connect() as conn:
+            watermark = ingestion_watermark(conn)
+        with self._lock:
+            if watermark != self._watermark:
+                self._cache.clear()
+                self._watermark = watermark
+            self._watermark_checked = now
+
+    def _cached(self, name, params, compute):
+        self._check_watermark()
+        key = (name, tuple(sorted((k, repr(v)) for k, v in params.items())))
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self.hits += 1
+                count("chart_data", outcome="hit", chart=name)
+                return result
+            self.misses += 1
+        count("chart_data", outcome="miss", chart=name)
+        with span("chart_data", chart=name), self.engine.connect() as conn:
+            result = compute(conn)
+        with self._lock:
+            self._cache[key] = result
+        return result
+
+    def stats(self):
+        return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    def depth_profile(self, variable='temperature', wmo_id=None, start=None, end=None, bbox=None,
+                      bin_dbar=DEPTH_BIN_DBAR, max_pressure=MAX_PRESSURE_DBAR):
+        """Mean, std, min, max and count of `variable` per pressure bin (bin centres in dbar)."""
+        _check_variable(variable)
+        where, params = _filters('p', wmo_id, start, end, bbox, date_alias='m')
+        params.update(bin=float(bin_dbar), max_pressure=float(max_pressure))
+        sql = f"""
+        SELECT floor(m.pressure / :bin) * :bin + :bin / 2 AS pressure,
+               avg(m.{variable}), stddev_samp(m.{variable}), min(m.{variable}), max(m.{variable}),
+               count(m.{variable})
+        FROM {self.levels} m JOIN profiles p ON p.profile_id = m.profile_id
+        WHERE m.pressure >= 0 AND m.pressure < :max_pressure AND m.{variable} IS NOT NULL AND {where}
+        GROUP BY 1 ORDER BY 1
+        """
+
+        def compute(conn):
+            columns = _fetch_columns(conn, sql, params, {
+                'pressure': 'float64', 'mean': 'float32', 'std': 'float32', 'min': 'float32', 'max': 'float32',
+                'count': 'int64'})
+            return ChartData(columns, variable=variable, bin_dbar=bin_dbar, levels=int(columns['count'].sum()))
+        return self._cached("depth_profile", dict(params, variable=variable), compute)
+
+    def ts_density(self, wmo_id=None, start=None, end=None, bbox=None, bins=TS_BINS,
+                   max_pressure=MAX_PRESSURE_DBAR):
+        """
+        A T/S diagram as a 2-D histogram: one row per non-empty (salinity,
+        temperature) cell with its centre, level count and mean pressure.
+        """
+        where, params = _filters('p', wmo_id, start, end, bbox, date_alias='m')
+        (t_min, t_max), (s_min, s_max) = TS_RANGES['temperature'], TS_RANGES['salinity']
+        params.update(bins=int(bins), t_min=t_min, t_max=t_max, s_min=s_min, s_max=s_max,
+                      max_pressure=float(max_pressure))
+        sql = f"""
+        SELECT width_bucket(m.salinity, :s_min, :s_max, :bins) AS s_bin,
+               width_bucket(m.temperature, :t_min, :t_max, :bins) AS t_bin,
+               count(*), avg(m.pressure)
+        FROM {self.levels} m JOIN profiles p ON p.profile_id = m.profile_id
+        WHERE m.temperature >= :t_min AND m.temperature < :t_max
+          AND m.salinity >= :s_min AND m.salinity < :s_max
+          AND m.pressure < :max_pressure AND {where}
+        GROUP BY 1, 2
+        """
+
+        def compute(conn):
+            columns = _fetch_columns(conn, sql, params, {
+                'salinity': 'float32', 'temperature': 'float32', 'count': 'int64', 'pressure': 'float32'})
+            s_step, t_step = (s_max - s_min) / bins, (t_max - t_min) / bins
+            columns['salinity'] = (s_min + (columns['salinity'] - 0.5) * s_step).astype(np.float32)
+            columns['temperature'] = (t_min + (columns['temperature'] - 0.5) * t_step).astype(np.float32)
+            return ChartData(columns, levels=int(columns['count'].sum()))
+        return self._cached("ts_density", params, compute)
+
+    def time_series(self, variable='temperature', wmo_id=None, start=None, end=None, bbox=None,
+                    min_pressure=None, max_pressure=None, max_points=TIME_SERIES_POINTS):
+        """
+        One value per profile over time, downsampled with LTTB to `max_points`.
+        With a pressure layer the value is the layer mean over the levels;
+        without one it is the profile mean from profile_summary (no level scan).
+        """
+        _check_variable(variable)
+        if min_pressure is None and max_pressure is None:
+            where, params = _filters('s', wmo_id, start, end, bbox)
+            sql = f"""
+            SELECT s.profile_date, s.avg_{variable}
+            FROM profile_summary s
+            WHERE s.profile_date IS NOT NULL AND s.avg_{variable} IS NOT NULL AND {where}
+            ORDER BY s.profile_date, s.profile_id
+            """
+        else:
+            where, params = _filters('p', wmo_id, start, end, bbox, date_alias='m')
+            params.update(min_pressure=float(min_pressure or 0), max_pressure=float(max_pressure or MAX_PRESSURE_DBAR))
+            sql = f"""
+            SELECT p.profile_date, avg(m.{variable})
+            FROM {self.levels} m JOIN profiles p ON p.profile_id = m.profile_id
+            WHERE m.pressure >= :min_pressure AND m.pressure < :max_pressure AND m.{variable} IS NOT NULL
+              AND p.profile_date IS NOT NULL AND {where}
+            GROUP BY p.profile_id, p.profile_date
+            ORDER BY p.profile_date, p.profile_id
+            """
+
+        def compute(conn):
+            columns = _fetch_columns(conn, sql, params, {'time': 'datetime64[us]', 'value': 'float32'})
+            n_profiles = len(columns['time'])
+            keep = lttb(columns['time'].astype(np.int64), columns['value'], max_points)
+            columns = {name: values[keep] for name, values in columns.items()}
+            return ChartData(columns, variable=variable, profiles=n_profiles)
+        return self._cached("time_series", dict(params, variable=variable, max_points=max_points), compute)
+
+    def map_grid(self, variable='temperature', wmo_id=None, start=None, end=None, bbox=None,
+                 cell_deg=MAP_CELL_DEG):
+        """Profile count and mean profile value of `variable` per lat/lon cell (cell centres)."""
+        _check_variable(variable)
+        where, params = _filters('s', wmo_id, start, end, bbox)
+        params['cell'] = float(cell_deg)
+        sql = f"""
+        SELECT floor(s.latitude / :cell) * :cell + :cell / 2 AS lat,
+               floor(s.longitude / :cell) * :cell + :cell / 2 AS lon,
+               count(*), avg(s.avg_{variable})
+        FROM profile_summary s
+        WHERE s.latitude IS NOT NULL AND s.longitude IS NOT NULL AND {where}
+        GROUP BY 1, 2
+        """
+
+        def compute(conn):
+            columns = _fetch_columns(conn, sql, params, {
+                'lat': 'float32', 'lon': 'float32', 'profiles': 'int64', 'mean': 'float32'})
+            return ChartData(columns, variable=variable, profiles=int(columns['profiles'].sum()))
+        return self._cached("map_grid", dict(params, variable=variable), compute)
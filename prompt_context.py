@@ -0,0 +1,361 @@
+# prompt_context.py
+#
+# Compact prompt context for the SQL agent. Without it, every question starts
+# with the agent listing the tables and fetching their schemas (CREATE TABLE
+# plus sample rows) through its tools: extra LLM round trips and a large
+# prompt. Instead:
+#   - a schema digest (tables, columns with short types, keys, units and join
+#     paths) is built once per schema fingerprint and cached in memory and on
+#     disk next to the schema cache;
+#   - only the tables relevant to the question (plus the tables they join to)
+#     go into the prompt, the rest are listed by name;
+#   - conversation history is carried as the last turns verbatim and one
+#     summary line per older turn, within a token budget;
+#   - prompt sizes are estimated per part and counted in the tracer.
+
+import re
+import json
+import time
+import threading
+from collections import deque
+from pathlib import Path
+from sqlalchemy import text
+
+from schema_cache import SCHEMA_CACHE_DIR, schema_fingerprint
+from level_storage import unused_relations
+from tracing import count
+
+# Tokens are counted with tiktoken's cl100k_base (close enough to Gemini's
+# tokenizer for budgets and reports); when its encoding cannot be loaded (it is
+# downloaded on first use) they are estimated from the length.
+TOKEN_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN = 4
+MAX_TABLES = 4
+FINGERPRINT_RECHECK_SECONDS = 60
+HISTORY_RECENT_TURNS = 2
+HISTORY_TOKEN_BUDGET = 600
+HISTORY_ANSWER_CHARS = 500
+SUMMARY_LINE_CHARS = 200
+
+# Bookkeeping tables the agent never needs.
+INTERNAL_TABLES = {'schema_migrations', 'ingest_ledger'}
+
+# Units of the ARGO variables; applied to every column carrying the name (avg_temperature, max_pressure ...).
+UNITS = {
+    'pressure': 'dbar',
+    'temperature': 'degC',
+    'salinity': 'PSU',
+    'latitude': 'degN',
+    'longitude': 'degE',
+}
+
+# Question words mapped to the terms used in table and column names.
+SYNONYMS = {
+    'temp': ['temperature'], 'warm': ['temperature'], 'warmest': ['temperature'], 'cold': ['temperature'],
+    'coldest': ['temperature'], 'hot': ['temperature'], 'heat': ['temperature'],
+    'salt': ['salinity'], 'salty': ['salinity'], 'saline': ['salinity'], 'psu': ['salinity'],
+    'deep': ['pressure', 'depth'], 'deepest': ['pressure', 'depth'], 'shallow': ['pressure', 'depth'],
+    'dbar': ['pressure'], 'surface': ['pressure', 'depth'],
+    'where': ['latitude', 'longitude'], 'location': ['latitude', 'longitude'], 'position': ['latitude', 'longitude'],
+    'near': ['latitude', 'longitude'], 'region': ['latitude', 'longitude'], 'area': ['latitude', 'longitude'],
+    'map': ['latitude', 'longitude'], 'north': ['latitude'], 'south': ['latitude'], 'equator': ['latitude'],
+    'east': ['longitude'], 'west': ['longitude'], 'lat': ['latitude'], 'lon': ['longitude'],
+    'when': ['date'], 'recent': ['date'], 'latest': ['date'], 'year': ['date'], 'day': ['date'],
+    'time': ['date'], 'season': ['month'], 'monthly': ['month', 'climatology'], 'trend': ['month', 'climatology'],
+    'average': ['avg'], 'mean': ['avg'], 'maximum': ['max'], 'highest': ['max'], 'minimum': ['min'],
+    'lowest': ['min'], 'wmo': ['float'], 'platform': ['float'], 'buoy': ['float'],
+    'quality': ['qc'], 'flag': ['qc'], 'measurement': ['level'],
+}
+
+# Name parts too generic to say anything about relevance.
+_IGNORED_TERMS = {'id', 'n', 'number'}
+_WORD_RE = re.compile(r'[a-z]+')
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s')
+
+# Questions that only make sense after an earlier turn: they open with a
+# continuation ("and in March?", "what about salinity?"), refer back with a
+# pronoun ("its deepest level") or are a bare fragment ("for float 2902273?").
+_CONTINUATION_RE = re.compile(r"^\s*(and|also|or|but|then|so|same|what about|how about|now)\b", re.I)
+_REFERENCE_RE = re.compile(
+    r"\b(it|its|they|them|their|those|these|same|previous|former|latter"
+    r"|(this|that) (one|float|profile|cycle|region|area))\b", re.I)
+_FRAGMENT_RE = re.compile(r"^\s*(in|for|at|during|near|from|by|on|with|without)\b", re.I)
+FRAGMENT_MAX_WORDS = 4
+
+# Stands in for the agent's default "list the tables, then fetch their schemas" plan.
+CONTEXT_PLAN = ("The schema of the relevant tables is given above, so I can write the query directly. "
+                "I will only look up the schema of another table if I need one that is not described.")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+            except Exception:
+                _encoding = False  # not installed or offline: estimate instead
+        return _encoding
+
+def estimate_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _singular(word):
+    return word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+
+def _terms(text):
+    """Lower-cased words with a naive plural strip, expanded through SYNONYMS."""
+    terms = set()
+    for word in map(_singular, _WORD_RE.findall(text.lower())):
+        terms.add(word)
+        terms.update(SYNONYMS.get(word, ()))
+    return terms - _IGNORED_TERMS
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+# --- Schema digest ---
+
+_COLUMNS_SQL = """
+SELECT c.relname, c.relkind, a.attname, t.typname, COALESCE(a.attnum = ANY (pk.conkey), false)
+FROM pg_class c
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+JOIN pg_type t ON t.oid = a.atttypid
+LEFT JOIN pg_constraint pk ON pk.conrelid = c.oid AND pk.contype = 'p'
+WHERE c.relnamespace = current_schema()::regnamespace
+  AND c.relkind IN ('r', 'p', 'v', 'm') AND NOT c.relispartition
+ORDER BY c.relname, a.attnum
+"""
+
+_FOREIGN_KEYS_SQL = """
+SELECT c.relname, a.attname, r.relname, ra.attname
+FROM pg_constraint k
+JOIN pg_class c ON c.oid = k.conrelid AND NOT c.relispartition
+JOIN pg_class r ON r.oid = k.confrelid
+CROSS JOIN LATERAL unnest(k.conkey, k.confkey) AS u(attnum, ref_attnum)
+JOIN pg_attribute a ON a.attrelid = k.conrelid AND a.attnum = u.attnum
+JOIN pg_attribute ra ON ra.attrelid = k.confrelid AND ra.attnum = u.ref_attnum
+WHERE k.contype = 'f' AND k.connamespace = current_schema()::regnamespace
+"""
+
+def build_digest(conn, fingerprint):
+    """
+    Reads tables and views of the current schema from the catalog. Join paths
+    come from foreign keys, plus inferred ones for columns named like another
+    table's single-column primary key (views and summary tables have no FKs).
+    """
+    tables = {}
+    for table, kind, column, type_name, is_pk in conn.execute(text(_COLUMNS_SQL)):
+        if table in INTERNAL_TABLES:
+            continue
+        entry = tables.setdefault(table, {'kind': 'view' if kind in ('v', 'm') else 'table',
+                                          'columns': [], 'joins': []})
+        type_name = f"{type_name[1:]}[]" if type_name.startswith('_') else type_name
+        entry['columns'].append([column, type_name, bool(is_pk)])
+
+    for table, column, ref_table, ref_column in conn.execute(text(_FOREIGN_KEYS_SQL)):
+        if table in tables and ref_table in tables:
+            tables[table]['joins'].append([column, ref_table, ref_column])
+
+    # The table owning a key column: float_id -> floats, not float_summary (which also has it as its PK).
+    owners = {}
+    for table, entry in tables.items():
+        keys = [column for column, _, is_pk in entry['columns'] if is_pk]
+        if len(keys) == 1 and keys[0] not in {column for column, _, _ in entry['joins']}:
+            owners.setdefault(keys[0], []).append(table)
+    primary_keys = {}
+    for column, candidates in owners.items():
+        stem = column[:-3] if column.endswith('_id') else column
+        named = [table for table in candidates if table in (stem, f"{stem}s")]
+        if named or len(candidates) == 1:
+            primary_keys[column] = (named or candidates)[0]
+    for table, entry in tables.items():
+        joined = {column for column, _, _ in entry['joins']}
+        for column, _, _ in entry['columns']:
+            ref_table = primary_keys.get(column)
+            if ref_table and ref_table != table and column not in joined:
+                entry['joins'].append([column, ref_table, column])
+    return {'fingerprint': fingerprint, 'tables': tables}
+
+def _unit(column):
+    if column.startswith('n_') or column.endswith('_qc'):
+        return None
+    return next((unit for key, unit in UNITS.items() if key in column), None)
+
+def describe_table(name, entry):
+    """One line per table: `name(col type PK, col type [unit] -> other.col, ...)`."""
+    joins = {column: f"{ref_table}.{ref_column}" for column, ref_table, ref_column in entry['joins']}
+    parts = []
+    for column, type_name, is_pk in entry['columns']:
+        part = f"{column} {type_name}"
+        if is_pk:
+            part += " PK"
+        unit = _unit(column)
+        if unit:
+            part += f" [{unit}]"
+        if column in joins:
+            part += f" -> {joins[column]}"
+        parts.append(part)
+    return f"{name}{' (view)' if entry['kind'] == 'view' else ''}({', '.join(parts)})"
+
+def relevant_tables(question, digest, max_tables=MAX_TABLES, exclude=()):
+    """
+    Scores each table by the question terms found in its name (triple weight)
+    and column names, keeps up to `max_tables` scoring at least half the best
+    score and adds every table they join to, transitively. Returns an empty
+    list when nothing matches.
+    """
+    tables = {name: entry for name, entry in digest['tables'].items() if name not in exclude}
+    terms = _terms(question)
+    scores = {}
+    for name, entry in tables.items():
+        name_terms = {_singular(part) for part in name.split('_')}
+        column_terms = {_singular(part) for column, _, _ in entry['columns'] for part in column.split('_')}
+        score = 3 * len(terms & name_terms) + len(terms & column_terms)
+        if score:
+            scores[name] = score
+    if not scores:
+        return []
+    best = max(scores.values())
+    selected = sorted((name for name in scores if 2 * scores[name] >= best),
+                      key=lambda name: (-scores[name], name))[:max_tables]
+    pending = list(selected)
+    while pending:
+        for _, ref_table, _ in tables[pending.pop()]['joins']:
+            if ref_table in tables and ref_table not in selected:
+                selected.append(ref_table)
+                pending.append(ref_table)
+    return sorted(selected)
+
+# --- Conversation history ---
+
+def summarize_turn(question, answer):
+    """An extractive one-line summary of a turn: the question and the answer's first sentence."""
+    first_sentence = _SENTENCE_END_RE.split(" ".join(answer.split()), maxsplit=1)[0]
+    return _clip(f"{question} -> {first_sentence}", SUMMARY_LINE_CHARS)
+
+class ConversationHistory:
+    """
+    One conversation: the last `recent_turns` turns verbatim (answers clipped),
+    older turns as one summary line each. The oldest summary lines are dropped
+    when the rendered history exceeds `budget` tokens.
+    """
+
+    def __init__(self, recent_turns=HISTORY_RECENT_TURNS, budget=HISTORY_TOKEN_BUDGET):
+        self.recent_turns = recent_turns
+        self.budget = budget
+        self.recent = deque()
+        self.summary = deque()
+
+    def add(self, question, answer):
+        self.recent.append((question, _clip(answer, HISTORY_ANSWER_CHARS)))
+        while len(self.recent) > self.recent_turns:
+            self.summary.append(summarize_turn(*self.recent.popleft()))
+        while self.summary and estimate_tokens(self.render()) > self.budget:
+            self.summary.popleft()
+
+    def render(self):
+        lines = []
+        if self.summary:
+            lines.append("Earlier questions:")
+            lines += [f"- {line}" for line in self.summary]
+        for question, answer in self.recent:
+            lines += [f"User: {question}", f"Assistant: {answer}"]
+        return "\n".join(lines)
+
+def with_history(question, history):
+    """The agent input: the question, preceded by the rendered conversation history if there is any."""
+    if not history:
+        return question
+    return "\n".join(["Previous conversation (for context; answer only the current question):",
+                      history, "", f"Current question: {question}"])
+
+def depends_on_history(question):
+    """
+    True for follow-up questions that cannot be answered (or cached) on their
+    own; standalone questions are answered the same with or without history.
+    """
+    if _CONTINUATION_RE.search(question) or _REFERENCE_RE.search(question):
+        return True
+    return bool(_FRAGMENT_RE.search(question)) and len(question.split()) <= FRAGMENT_MAX_WORDS
+
+# --- Per-question context ---
+
+class PromptContext:
+    """Schema digest of one database, refreshed when its schema fingerprint changes."""
+
+    def __init__(self, engine, cache_dir=SCHEMA_CACHE_DIR, max_tables=MAX_TABLES, layout=None):
+        self.engine = engine
+        self.cache_dir = Path(cache_dir)
+        self.max_tables = max_tables
+        self.exclude = set(unused_relations(layout))
+        self._digest = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def digest(self):
+        """The current digest. The fingerprint is re-read at most every FINGERPRINT_RECHECK_SECONDS."""
+        with self._lock:
+            now = time.monotonic()
+            if self._digest is None or now - self._checked > FINGERPRINT_RECHECK_SECONDS:
+                with self.engine.connect() as conn:
+                    fingerprint = schema_fingerprint(conn)
+                    if self._digest is None or self._digest['fingerprint'] != fingerprint:
+                        self._digest = self._load(fingerprint) or self._save(build_digest(conn, fingerprint))
+                self._checked = now
+            return self._digest
+
+    def _path(self, fingerprint):
+        return self.cache_dir / f"digest_{fingerprint}.json"
+
+    def _load(self, fingerprint):
+        try:
+            return json.loads(self._path(fingerprint).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, digest):
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._path(digest['fingerprint']).with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(digest))
+            tmp_path.replace(self._path(digest['fingerprint']))
+        except OSError:
+            pass
+        return digest
+
+    def schema_context(self, question, history=""):
+        """
+        The digest lines of the tables relevant to `question` (or, for a
+        follow-up that names none, to the conversation), and the names of the others.
+        """
+        digest = self.digest()
+        selected = (relevant_tables(question, digest, self.max_tables, self.exclude)
+                    or relevant_tables(history, digest, self.max_tables, self.exclude)
+                    or sorted(set(digest['tables']) - self.exclude))
+        others = sorted(set(digest['tables']) - set(selected) - self.exclude)
+        lines = ["", "Schema of the relevant tables (column type, [unit], -> join path):"]
+        lines += [describe_table(name, digest['tables'][name]) for name in selected]
+        if others:
+            lines.append(f"Other tables: {', '.join(others)}.")
+        return "\n".join(lines)
+
+    def agent_inputs(self, question, history=""):
+        """
+        The agent inputs for one question (input, schema_context, agent_plan)
+        and the estimated tokens of each part of the prompt they add.
+        """
+        schema = self.schema_context(question, history)
+        inputs = {"input": with_history(question, history), "schema_context": schema, "agent_plan": CONTEXT_PLAN}
+        tokens = {"schema": estimate_tokens(schema), "history": estimate_tokens(history),
+                  "question": estimate_tokens(question)}
+        for part, n in tokens.items():
+            count("prompt_tokens", n, part=part)
+        return inputs, tokens
@@ -0,0 +1,163 @@
+# query_cache.py
+#
+# Semantic response cache for the SQL agent. Questions are split into a shape
+# and their literals (WMO ids, dates, numbers, quoted names; see
+# sql_template_cache.extract_literals), and the shape is embedded. A new
+# question reuses a cached answer only if its literals are identical and its
+# shape embedding is close enough, so "float 2902273" never gets the answer
+# for "float 2902274". Entries expire by TTL and LRU, and the whole cache is
+# flushed when new data is ingested (the ingestion watermark changes).
+
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from tracing import count
+from sql_template_cache import extract_literals
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+SIMILARITY_THRESHOLD = 0.92
+TTL_SECONDS = 6 * 3600
+MAX_ENTRIES = 512
+WATERMARK_CHECK_SECONDS = 30
+
+_UNSET = object()
+
+def normalize_question(question):
+    """Lower-cases, strips punctuation and collapses whitespace."""
+    question = re.sub(r"[^\w\s.-]", " ", question.lower())
+    return re.sub(r"\s+", " ", question).strip(" .")
+
+def cache_key(question):
+    """(normalized shape, literals): entries only ever match questions with the same literals."""
+    shape, literals = extract_literals(question)
+    return normalize_question(shape), tuple(literals)
+
+class SemanticCache:
+    """
+    Caches agent answers keyed by question embedding.
+
+    `embed_fn` maps a string to a vector (defaults to the project's sentence
+    transformer, loaded on first use). `watermark_fn` returns a value that
+    changes whenever new data is ingested.
+    """
+
+    def __init__(self, embed_fn=None, watermark_fn=None, threshold=SIMILARITY_THRESHOLD,
+                 ttl_seconds=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._embed_fn = embed_fn
+        self._watermark_fn = watermark_fn
+        self._watermark = _UNSET
+        self._watermark_checked = 0.0
+        self._entries = OrderedDict()  # cache_key() -> entry dict
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+
+    # --- Embeddings ---
+
+    def _embed(self, text):
+        if self._embed_fn is None:
+            from langchain_huggingface import HuggingFaceEmbeddings
+            model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+            self._embed_fn = model.embed_query
+        vector = np.asarray(self._embed_fn(text), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    # --- Invalidation ---
+
+    def _check_watermark(self):
+        if self._watermark_fn is None:
+            return
+        now = time.monotonic()
+        if now - self._watermark_checked < WATERMARK_CHECK_SECONDS:
+            return
+        self._watermark_checked = now
+        try:
+            watermark = self._watermark_fn()
+        except Exception:
+            return
+        if watermark != self._watermark:
+            if self._watermark is not _UNSET:
+                self.clear()
+                self.invalidations += 1
+            self._watermark = watermark
+
+    def _evict_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry['created'] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def warm_up(self):
+        """Loads the embedding model ahead of the first question."""
+        self._embed("warm up")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # --- Lookup ---
+
+    def get(self, question):
+        """Returns the cached answer for a question, or None on a miss."""
+        self._check_watermark()
+        key = cache_key(question)
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            candidates = [k for k in self._entries if k[1] == key[1]] if entry is None else []
+        if candidates:
+            vector = self._embed(key[0])
+            with self._lock:
+                keys = [k for k in candidates if k in self._entries]
+                if keys:
+                    matrix = np.stack([self._entries[k]['vector'] for k in keys])
+                    scores = matrix @ vector
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.threshold:
+                        entry = self._entries[keys[best]]
+                        key = keys[best]
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                count("cache_misses", cache="semantic")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            count("cache_hits", cache="semantic")
+            self.saved_seconds += entry['latency']
+            self.saved_tokens += entry['tokens']
+            return entry['answer']
+
+    def put(self, question, answer, latency=0.0, tokens=0):
+        """Stores an answer together with what it cost to produce."""
+        key = cache_key(question)
+        vector = self._embed(key[0])
+        with self._lock:
+            self._entries[key] = {
+                'vector': vector, 'answer': answer, 'created': time.time(),
+                'latency': latency, 'tokens': tokens,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'saved_seconds': round(self.saved_seconds, 2),
+            'saved_tokens': self.saved_tokens,
+        }
@@ -1,11 +1,9 @@
 # rag_agent.py (The Correct, Refactored Version)
 
-from sqlalchemy import create_engine
-from langchain_community.utilities import SQLDatabase
-from langchain_community.agent_toolkits import create_sql_agent
-from langchain_ollama import ChatOllama
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from startup import STARTUP_TIMER
+
+# SQLAlchemy and LangChain are imported inside get_rag_agent, so importing
+# this module stays cheap. The embedding model loads on the first retrieval.
 
 # --- Database Configuration ---
 DB_USER = 'postgres'
@@ -15,6 +13,17 @@ DB_PORT = '5432'
 DB_NAME = 'argo_db'
 DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# Token budget for the retrieved documents in each prompt.
+RAG_CONTEXT_TOKENS = 800
+
+# The ReAct suffix without the default opening thought, which always lists the
+# tables and fetches their schemas first.
+RAG_SUFFIX = """Begin!
+
+Question: {input}
+Thought: I should check whether the context answers the question. If it does not, I should query the database, using the schema given with the question when there is one.
+{agent_scratchpad}"""
+
 def get_rag_agent():
     """
     Initializes and returns the RAG components (retriever and agent).
@@ -22,27 +31,62 @@ def get_rag_agent():
     """
     print("🤖 Initializing RAG Agent for the UI...")
 
+    with STARTUP_TIMER.phase("import rag dependencies"):
+        from langchain_community.agent_toolkits import create_sql_agent
+        from langchain_community.agent_toolkits.sql.prompt import SQL_PREFIX
+        from langchain_ollama import ChatOllama
+        from vector_index import VectorIndex
+        from sql_guard import GuardedSQLDatabase, get_readonly_engine
+        from aggregates import AGENT_HINT as AGGREGATES_HINT
+
     # --- Initialize Components ---
-    embedding_function = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    vector_store = Chroma(persist_directory="./chroma_db", embedding_function=embedding_function)
-    retriever = vector_store.as_retriever()
-    print("   - Vector store loaded successfully.")
+    with STARTUP_TIMER.phase("vector index (memory-mapped)"):
+        retriever = VectorIndex.load().as_retriever(k=4)
+    print("   - Vector index loaded successfully.")
 
-    db_engine = create_engine(DATABASE_URL)
-    db = SQLDatabase(db_engine)
+    with STARTUP_TIMER.phase("schema (cached reflection)"):
+        db = GuardedSQLDatabase(get_readonly_engine(DATABASE_URL))
     llm = ChatOllama(model="llama3:8b", temperature=0)
-    sql_agent_executor = create_sql_agent(llm, db=db, verbose=True) # Turn verbose on for debugging in terminal
+    sql_agent_executor = create_sql_agent(llm, db=db, prefix=SQL_PREFIX + AGGREGATES_HINT, suffix=RAG_SUFFIX,
+                                          verbose=True) # Turn verbose on for debugging in terminal
     print("   - SQL agent created.")
     
     return retriever, sql_agent_executor
 
-def run_rag_query(user_question, retriever, sql_agent_executor):
+def retrieved_context(docs, budget=RAG_CONTEXT_TOKENS):
+    """The retrieved documents in rank order, without duplicates, up to `budget` tokens."""
+    from prompt_context import estimate_tokens
+    parts, seen, used = [], set(), 0
+    for doc in docs:
+        content = doc.page_content.strip()
+        if content in seen:
+            continue
+        tokens = estimate_tokens(content)
+        if parts and used + tokens > budget:
+            break
+        parts.append(content)
+        seen.add(content)
+        used += tokens
+    return "\n".join(parts)
+
+def run_rag_query(user_question, retriever, sql_agent_executor, prompt_context=None, history=""):
     """
     Takes a user question and the agent components and returns the AI's answer.
+    With a PromptContext (see prompt_context) the schema of the relevant tables
+    is included, so the agent does not look it up; `history` is the rendered
+    conversation so far.
     """
+    from tracing import span, count, langchain_callbacks
+    from prompt_context import with_history, estimate_tokens
+
     # 1. Retrieve context
-    docs = retriever.invoke(user_question)
-    context = "\n".join([d.page_content for d in docs])
+    with span("retrieval"):
+        docs = retriever.invoke(user_question)
+    context = retrieved_context(docs)
+    schema = prompt_context.schema_context(user_question, history) if prompt_context is not None else ""
+    count("prompt_tokens", estimate_tokens(context), part="retrieved")
+    count("prompt_tokens", estimate_tokens(schema), part="schema")
+    question = with_history(user_question, history) if history else f"Question: {user_question}"
 
     # 2. Build the prompt
     full_input = f"""
@@ -54,15 +98,17 @@ def run_rag_query(user_question, retriever, sql_agent_executor):
     ---
     {context}
     ---
+    {schema}
 
-    Question: {user_question}
+    {question}
     """
 
     # 3. Invoke the agent
-    result = sql_agent_executor.invoke(
-        {"input": full_input},
-        {"handle_parsing_errors": True}
-    )
+    with span("agent_query", mode="rag"):
+        result = sql_agent_executor.invoke(
+            {"input": full_input},
+            {"handle_parsing_errors": True, "callbacks": [langchain_callbacks()]}
+        )
     
     return result["output"]
 
@@ -0,0 +1,159 @@
+# rag_corpus.py
+#
+# Builds the RAG context corpus from the ingested database: one summary per
+# float, statistics per column and a set of example queries. Documents carry
+# a content hash, so a rebuild only embeds documents whose text changed;
+# everything else reuses the vectors already stored in the index.
+
+import numpy as np
+from sqlalchemy import text
+
+from spatial_index import REGIONS, points_in_region
+from vector_index import (VectorIndex, INDEX_DIR, EMBEDDING_MODEL, content_hash,
+                          load_embedding_function, embed_in_batches)
+
+EXAMPLE_QUERIES = [
+    ("What is the average temperature recorded by float 2902273?",
+     "SELECT wmo_id, avg_temperature FROM float_summary WHERE wmo_id = '2902273'"),
+    ("Which float has the most profiles?",
+     "SELECT wmo_id, n_profiles FROM float_summary ORDER BY n_profiles DESC LIMIT 1"),
+    ("What is the maximum salinity in the database?",
+     "SELECT max(max_salinity) FROM float_summary"),
+    ("How many profiles were recorded in 2023?",
+     "SELECT count(*) FROM profiles WHERE profile_date >= '2023-01-01' AND profile_date < '2024-01-01'"),
+    ("What was the average temperature between 0 and 100 dbar in March 2023?",
+     "SELECT sum(avg_temperature * n_temperature) / sum(n_temperature) FROM depth_climatology "
+     "WHERE depth_bin = '0-100' AND month = '2023-03-01'"),
+    ("Show the temperature profile of float 2902273 on its latest cycle.",
+     "SELECT m.pressure, m.temperature FROM measurements m JOIN profiles p ON p.profile_id = m.profile_id "
+     "JOIN floats f ON f.float_id = p.float_id WHERE f.wmo_id = '2902273' "
+     "AND p.direction = 'A' AND p.cycle_number = (SELECT max(cycle_number) FROM profiles WHERE float_id = f.float_id) "
+     "ORDER BY m.pressure"),
+]
+
+def _fmt(value, digits=2):
+    return "unknown" if value is None else f"{value:.{digits}f}"
+
+def _day(value):
+    return "unknown" if value is None else value.strftime("%Y-%m-%d")
+
+def _regions_of(lat, lon):
+    """Names of the configured regions that contain the given point."""
+    if lat is None or lon is None:
+        return []
+    return [name for name in REGIONS
+            if points_in_region(np.array([lat]), np.array([lon]), name)[0]]
+
+def float_documents(conn):
+    """One document per float, read from float_summary."""
+    rows = conn.execute(text("""
+    SELECT wmo_id, n_profiles, first_profile_date, last_profile_date,
+           min_latitude, max_latitude, min_longitude, max_longitude, n_measurements,
+           min_temperature, max_temperature, avg_temperature,
+           min_salinity, max_salinity, avg_salinity
+    FROM float_summary ORDER BY wmo_id
+    """)).mappings()
+    documents = []
+    for r in rows:
+        centre_lat = None if r['min_latitude'] is None else (r['min_latitude'] + r['max_latitude']) / 2
+        centre_lon = None if r['min_longitude'] is None else (r['min_longitude'] + r['max_longitude']) / 2
+        regions = _regions_of(centre_lat, centre_lon)
+        where = f" in the {' / '.join(regions)}" if regions else ""
+        documents.append({
+            "id": f"float:{r['wmo_id']}",
+            "text": (
+                f"Float {r['wmo_id']} has {r['n_profiles']} profiles from {_day(r['first_profile_date'])} "
+                f"to {_day(r['last_profile_date'])}{where} "
+                f"(latitude {_fmt(r['min_latitude'])} to {_fmt(r['max_latitude'])}, "
+                f"longitude {_fmt(r['min_longitude'])} to {_fmt(r['max_longitude'])}), "
+                f"with {r['n_measurements']} measurements. "
+                f"Temperature ranged from {_fmt(r['min_temperature'])} to {_fmt(r['max_temperature'])} °C "
+                f"(mean {_fmt(r['avg_temperature'])}); salinity ranged from {_fmt(r['min_salinity'])} "
+                f"to {_fmt(r['max_salinity'])} psu (mean {_fmt(r['avg_salinity'])})."
+            ),
+            "metadata": {"source": "float", "wmo_id": r['wmo_id']},
+        })
+    return documents
+
+def column_documents(conn):
+    """Value ranges of the main columns, taken from the summary tables."""
+    s = conn.execute(text("""
+    SELECT count(*) AS n_floats, sum(n_profiles) AS n_profiles, sum(n_measurements) AS n_measurements,
+           min(first_profile_date) AS first_date, max(last_profile_date) AS last_date,
+           min(min_latitude) AS min_lat, max(max_latitude) AS max_lat,
+           min(min_longitude) AS min_lon, max(max_longitude) AS max_lon,
+           min(min_temperature) AS min_t, max(max_temperature) AS max_t,
+           min(min_salinity) AS min_s, max(max_salinity) AS max_s
+    FROM float_summary
+    """)).mappings().one()
+    # Means over all values, from per-profile sums and counts: measurements rows
+    # count levels, which are not the number of temperature or salinity values.
+    p = conn.execute(text("""
+    SELECT max(max_pressure) AS max_pressure,
+           sum(avg_temperature * n_temperature) / NULLIF(sum(n_temperature), 0) AS avg_t,
+           sum(avg_salinity * n_salinity) / NULLIF(sum(n_salinity), 0) AS avg_s
+    FROM profile_summary
+    """)).mappings().one()
+    max_pressure = p['max_pressure']
+    texts = {
+        "column:overview": f"The database holds {s['n_floats']} floats, {s['n_profiles'] or 0} profiles "
+                           f"and {s['n_measurements'] or 0} measurements.",
+        "column:profiles.profile_date": f"profiles.profile_date ranges from {_day(s['first_date'])} to {_day(s['last_date'])}.",
+        "column:profiles.latitude": f"profiles.latitude ranges from {_fmt(s['min_lat'])} to {_fmt(s['max_lat'])} degrees north.",
+        "column:profiles.longitude": f"profiles.longitude ranges from {_fmt(s['min_lon'])} to {_fmt(s['max_lon'])} degrees east.",
+        "column:measurements.pressure": f"measurements.pressure goes down to {_fmt(max_pressure, 1)} dbar.",
+        "column:measurements.temperature": f"measurements.temperature ranges from {_fmt(s['min_t'])} to "
+                                           f"{_fmt(s['max_t'])} °C with a mean of {_fmt(p['avg_t'])} °C.",
+        "column:measurements.salinity": f"measurements.salinity ranges from {_fmt(s['min_s'])} to "
+                                        f"{_fmt(s['max_s'])} psu with a mean of {_fmt(p['avg_s'])} psu.",
+    }
+    return [{"id": doc_id, "text": body, "metadata": {"source": "column"}} for doc_id, body in texts.items()]
+
+def example_query_documents():
+    return [{"id": f"example:{i}", "text": f"Example question: {question}\nSQL: {sql}",
+             "metadata": {"source": "example"}}
+            for i, (question, sql) in enumerate(EXAMPLE_QUERIES)]
+
+def build_corpus(engine, static_texts=()):
+    """All context documents, each with a content hash of its text. engine=None skips the database."""
+    documents = [{"id": f"static:{i}", "text": t, "metadata": {"source": "static"}}
+                 for i, t in enumerate(static_texts)]
+    if engine is not None:
+        with engine.connect() as conn:
+            documents += float_documents(conn) + column_documents(conn)
+    documents += example_query_documents()
+    for doc in documents:
+        doc["hash"] = content_hash(doc["text"])
+    return documents
+
+def _reusable_vectors(directory, model_name):
+    """hash -> embedding from the previous build, if it used the same model."""
+    try:
+        previous = VectorIndex.load(directory)
+    except FileNotFoundError:
+        return {}
+    if previous.model_name != model_name:
+        return {}
+    # Copy out of the memory map: the files are overwritten by the new build.
+    return {doc["hash"]: np.array(previous.embeddings[i], dtype=np.float32)
+            for i, doc in enumerate(previous.documents)}
+
+def update_index(engine, static_texts=(), directory=INDEX_DIR, embed_documents=None, model_name=EMBEDDING_MODEL):
+    """
+    Rebuilds the vector index from the current database, embedding only the
+    documents whose content hash is not already in the index.
+    Returns (total documents, newly embedded documents).
+    """
+    documents = build_corpus(engine, static_texts)
+    vectors = _reusable_vectors(directory, model_name)
+
+    missing = list({doc["hash"]: doc["text"] for doc in documents if doc["hash"] not in vectors}.items())
+    if missing:
+        if embed_documents is None:
+            embed_documents, _ = load_embedding_function(model_name)
+        embedded = embed_in_batches([body for _, body in missing], embed_documents)
+        vectors.update((h, vec) for (h, _), vec in zip(missing, embedded))
+
+    embeddings = np.stack([vectors[doc["hash"]] for doc in documents])
+    VectorIndex.build(documents, embeddings, model_name=model_name).save(directory)
+    return len(documents), len(missing)
@@ -0,0 +1,66 @@
+# schema_cache.py
+#
+# SQLDatabase that caches each table's description (CREATE TABLE plus sample
+# rows) on disk, keyed by a fingerprint of the schema. A warm start reads the
+# cache instead of reflecting every table; a schema change produces a new
+# fingerprint and the descriptions are rebuilt lazily, table by table.
+
+import json
+import hashlib
+import threading
+from pathlib import Path
+from sqlalchemy import text
+from langchain_community.utilities import SQLDatabase
+
+SCHEMA_CACHE_DIR = Path(__file__).with_name(".schema_cache")
+
+def schema_fingerprint(conn):
+    """Hashes every table, column and type in the current schema."""
+    rows = conn.execute(text("""
+    SELECT table_name, column_name, data_type
+    FROM information_schema.columns
+    WHERE table_schema = current_schema()
+    ORDER BY table_name, ordinal_position
+    """)).fetchall()
+    return hashlib.sha1(repr(rows).encode()).hexdigest()[:16]
+
+class CachedSQLDatabase(SQLDatabase):
+    """SQLDatabase with lazy reflection and an on-disk table info cache."""
+
+    def __init__(self, engine, cache_dir=SCHEMA_CACHE_DIR, **kwargs):
+        with engine.connect() as conn:
+            self.fingerprint = schema_fingerprint(conn)
+        self._cache_path = Path(cache_dir) / f"schema_{self.fingerprint}.json"
+        cached = json.loads(self._cache_path.read_text()) if self._cache_path.exists() else {}
+        # Views too: with the packed storage layout, levels are read through measurement_levels.
+        kwargs.setdefault("view_support", True)
+        super().__init__(engine, custom_table_info=cached, lazy_table_reflection=True, **kwargs)
+        self._custom_table_info = self._custom_table_info or {}
+        # Reflection swaps out the shared table info below; agent threads share this object.
+        self._lock = threading.Lock()
+
+    def get_table_info(self, table_names=None, get_col_comments=False):
+        with self._lock:
+            if get_col_comments:
+                return super().get_table_info(table_names, get_col_comments)
+            names = list(table_names) if table_names is not None else sorted(self.get_usable_table_names())
+            missing = [name for name in names if name not in self._custom_table_info]
+            if missing:
+                # Reflect only what is missing, then persist it for the next start.
+                custom, self._custom_table_info = self._custom_table_info, None
+                try:
+                    for name in missing:
+                        custom[name] = super().get_table_info([name])
+                finally:
+                    self._custom_table_info = custom
+                self._save()
+            return "\n\n".join(self._custom_table_info[name] for name in names)
+
+    def _save(self):
+        try:
+            self._cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._cache_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(self._custom_table_info))
+            tmp_path.replace(self._cache_path)
+        except OSError:
+            pass
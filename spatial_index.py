@@ -0,0 +1,161 @@
+# spatial_index.py
+#
+# Named regions and their geometry, and a lat/lon tile index for selecting
+# ingested profiles by region: an expression index on `profiles` over the tile
+# id and the profile date, so a region and date range is an index lookup.
+# The global index file is filtered by load_index's bbox pushdown instead.
+
+import numpy as np
+
+TILE_DEG = 1.0
+
+# Named regions. A bbox is (min_lat, max_lat, min_lon, max_lon); min_lon > max_lon
+# means the box crosses the dateline. A polygon is a list of (lat, lon) vertices.
+REGIONS = {
+    'Indian Ocean': {'bbox': (-30, 30, 30, 110)},
+    'Arabian Sea': {'polygon': [(25, 56), (25, 67), (22, 72), (8, 78), (0, 75), (0, 50), (12, 51), (15, 53)]},
+    'Bay of Bengal': {'bbox': (5, 23, 79, 100)},
+    'Equatorial Pacific': {'bbox': (-10, 10, 160, -80)},
+}
+
+# --- Tile ids ---
+
+def _grid_shape(tile_deg):
+    return int(round(180 / tile_deg)), int(round(360 / tile_deg))
+
+def bbox_tiles(bbox, tile_deg=TILE_DEG):
+    """
+    Returns every tile id overlapping a bbox, splitting boxes that cross the
+    dateline. Boxes spanning 360 degrees of longitude cover every column.
+    """
+    min_lat, max_lat, min_lon, max_lon = bbox
+    n_rows, n_cols = _grid_shape(tile_deg)
+    row_lo, row_hi = (int(np.clip(np.floor((v + 90) / tile_deg), 0, n_rows - 1)) for v in (min_lat, max_lat))
+    col_lo = int(np.floor((min_lon + 180) / tile_deg)) % n_cols
+    col_hi = int(np.floor((max_lon + 180) / tile_deg)) % n_cols
+    if min_lon <= max_lon and max_lon - min_lon >= 360 - tile_deg:
+        cols = np.arange(n_cols)
+    elif min_lon <= max_lon and col_lo <= col_hi:
+        cols = np.arange(col_lo, col_hi + 1)
+    else:
+        cols = np.concatenate([np.arange(col_lo, n_cols), np.arange(0, col_hi + 1)])
+    rows = np.arange(row_lo, row_hi + 1)
+    return (rows[:, None] * n_cols + cols[None, :]).ravel()
+
+# --- Region geometry ---
+
+def resolve_region(region):
+    """Accepts a region name, a bbox tuple or a {'bbox'|'polygon': ...} dict."""
+    if isinstance(region, str):
+        if region not in REGIONS:
+            raise ValueError(f"Unknown region '{region}'. Known regions: {', '.join(REGIONS)}")
+        return REGIONS[region]
+    if isinstance(region, dict):
+        return region
+    return {'bbox': tuple(region)}
+
+def region_bbox(region):
+    """Returns the bounding box of a region. Polygons are assumed not to cross the dateline."""
+    region = resolve_region(region)
+    if 'bbox' in region:
+        return tuple(region['bbox'])
+    lats, lons = np.asarray(region['polygon'], dtype=np.float64).T
+    return (lats.min(), lats.max(), lons.min(), lons.max())
+
+def points_in_polygon(lat, lon, polygon):
+    """Vectorized even-odd ray casting test of points against a (lat, lon) polygon."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    poly = np.asarray(polygon, dtype=np.float64)
+    inside = np.zeros(lat.shape, dtype=bool)
+    y0, x0 = poly[-1]
+    for y1, x1 in poly:
+        crosses = (y1 > lat) != (y0 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = (x0 - x1) * (lat - y1) / (y0 - y1) + x1
+        inside ^= crosses & (lon < x_cross)
+        y0, x0 = y1, x1
+    return inside
+
+def points_in_region(lat, lon, region):
+    """Returns a boolean mask of the points that fall inside a region."""
+    region = resolve_region(region)
+    if 'polygon' in region:
+        return points_in_polygon(lat, lon, region['polygon'])
+    min_lat, max_lat, min_lon, max_lon = region['bbox']
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    in_lat = (lat >= min_lat) & (lat <= max_lat)
+    if min_lon <= max_lon:
+        return in_lat & (lon >= min_lon) & (lon <= max_lon)
+    return in_lat & ((lon >= min_lon) | (lon <= max_lon))
+
+# --- Ingested profiles table ---
+
+def tile_sql(alias='profiles', tile_deg=TILE_DEG):
+    """SQL expression for the tile id of a profile's position; matches profiles_tile_date_idx."""
+    n_rows, n_cols = _grid_shape(tile_deg)
+    return (f"(LEAST(GREATEST(floor(({alias}.latitude + 90) / {tile_deg})::int, 0), {n_rows - 1}) * {n_cols}"
+            f" + mod(floor(({alias}.longitude + 180) / {tile_deg})::int, {n_cols}))")
+
+# Applied by db_schema.migrate().
+TILE_INDEX_DDL = [
+    f"CREATE INDEX IF NOT EXISTS profiles_tile_date_idx ON profiles ({tile_sql()}, profile_date)",
+]
+
+def _num(value):
+    return repr(float(value))
+
+def _polygon_sql(alias, polygon):
+    """Even-odd ray casting test against a (lat, lon) polygon, as a SQL expression."""
+    lat, lon = f"{alias}.latitude", f"{alias}.longitude"
+    edges = []
+    (y0, x0) = polygon[-1]
+    for y1, x1 in polygon:
+        if y0 != y1:
+            x_cross = f"({_num(x0 - x1)} * ({lat} - {_num(y1)}) / {_num(y0 - y1)} + {_num(x1)})"
+            edges.append(f"(({lat} < {_num(y1)}) <> ({lat} < {_num(y0)}) AND {lon} < {x_cross})::int")
+        y0, x0 = y1, x1
+    return f"({' + '.join(edges)}) % 2 = 1"
+
+def region_sql(alias, region):
+    """
+    Exact SQL condition for the rows of `alias` (with latitude and longitude)
+    inside a region, with the bounds inlined: bbox bounds, handling the dateline,
+    and for polygons the same ray casting test as points_in_polygon.
+    """
+    min_lat, max_lat, min_lon, max_lon = region_bbox(region)
+    lon = (f"{alias}.longitude BETWEEN {_num(min_lon)} AND {_num(max_lon)}" if min_lon <= max_lon
+           else f"({alias}.longitude >= {_num(min_lon)} OR {alias}.longitude <= {_num(max_lon)})")
+    clause = f"{alias}.latitude BETWEEN {_num(min_lat)} AND {_num(max_lat)} AND {lon}"
+    region = resolve_region(region)
+    if 'polygon' in region:
+        clause += f" AND {_polygon_sql(alias, region['polygon'])}"
+    return clause
+
+def profiles_in_region(region, start=None, end=None, tile_deg=TILE_DEG):
+    """
+    SQL and parameters selecting the profiles inside a region (a name, a bbox or a
+    {'bbox'|'polygon': ...} dict) dated in [start, end): the tiles of its bbox and
+    the date range are looked up in profiles_tile_date_idx, then refined by region_sql.
+    """
+    clauses = [f"{tile_sql('p', tile_deg)} = ANY(:region_tiles)", region_sql('p', region)]
+    params = {'region_tiles': [int(t) for t in bbox_tiles(region_bbox(region), tile_deg)]}
+    if start is not None:
+        clauses.append("p.profile_date >= :region_start")
+        params['region_start'] = start
+    if end is not None:
+        clauses.append("p.profile_date < :region_end")
+        params['region_end'] = end
+    sql = f"""
+    SELECT p.profile_id, p.float_id, p.cycle_number, p.direction, p.profile_date, p.latitude, p.longitude
+    FROM profiles p
+    WHERE {' AND '.join(clauses)}
+    """
+    return sql, params
+
+# Short description handed to the SQL agent; appended to aggregates.AGENT_HINT.
+AGENT_HINT = "\nNamed ocean regions (longitudes are -180..180). Filter `profiles p` with the condition, " \
+    "add a date range on p.profile_date (e.g. p.profile_date >= now() - interval '90 days'), and reach " \
+    "profile_summary or the levels through p.profile_id:\n" + "".join(
+        f"- {name}: {region_sql('p', name)}\n" for name in REGIONS)
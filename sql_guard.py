@@ -0,0 +1,124 @@
+# sql_guard.py
+#
+# Execution layer for SQL written by the agent. Queries run on a sized,
+# read-only connection pool shared by every Streamlit session, with a
+# server-side statement_timeout. Each query's plan is costed with EXPLAIN
+# first: expensive row-returning queries are auto-limited and anything still
+# too expensive is rejected. Results stream through a server-side cursor
+# with a hard row cap, and every query's latency and row count is logged.
+
+import os
+import re
+import time
+import logging
+import threading
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from schema_cache import CachedSQLDatabase
+from tracing import span
+
+POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("AGENT_POOL_OVERFLOW", "5"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("AGENT_STATEMENT_TIMEOUT_MS", "15000"))
+MAX_PLAN_COST = float(os.getenv("AGENT_MAX_PLAN_COST", "1000000"))
+ROW_CAP = int(os.getenv("AGENT_ROW_CAP", "1000"))
+FETCH_BATCH = 500
+
+logger = logging.getLogger("floatchat.sql")
+
+class QueryRejected(SQLAlchemyError):
+    """Raised when a query's estimated cost exceeds the limit.
+
+    Subclasses SQLAlchemyError so the SQL agent's tools report it back to the
+    model as an error it can fix, instead of aborting the run.
+    """
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_readonly_engine(database_url):
+    """Returns the process-wide read-only engine for a database URL."""
+    with _engines_lock:
+        if database_url not in _engines:
+            options = (f"-c statement_timeout={STATEMENT_TIMEOUT_MS} "
+                       f"-c default_transaction_read_only=on "
+                       f"-c idle_in_transaction_session_timeout={STATEMENT_TIMEOUT_MS * 2}")
+            _engines[database_url] = create_engine(
+                database_url, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                pool_pre_ping=True, pool_recycle=1800, pool_timeout=10,
+                connect_args={"options": options},
+            )
+        return _engines[database_url]
+
+_LIMIT_RE = re.compile(r"\blimit\s+\d+\s*(offset\s+\d+\s*)?$", re.IGNORECASE)
+
+def explain_cost(conn, sql, parameters=None):
+    """Returns the planner's total cost estimate for a statement."""
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), parameters or {}).scalar()
+    return float(plan[0]["Plan"]["Total Cost"])
+
+def _checked_statement(conn, sql, parameters, row_cap, max_cost):
+    """Returns (sql to run, cost), auto-limiting or rejecting expensive plans."""
+    cost = explain_cost(conn, sql, parameters)
+    if cost <= max_cost:
+        return sql, cost
+    if not _LIMIT_RE.search(sql):
+        limited = f"SELECT * FROM ({sql}) AS guarded LIMIT {row_cap + 1}"
+        limited_cost = explain_cost(conn, limited, parameters)
+        if limited_cost <= max_cost:
+            return limited, limited_cost
+    raise QueryRejected(
+        f"Query rejected: estimated cost {cost:,.0f} exceeds the limit of {max_cost:,.0f}. "
+        "Add filters (float, date range, region), aggregate in SQL, or use the summary tables "
+        "(profile_summary, float_summary, depth_climatology) instead of scanning measurements."
+    )
+
+def run_guarded(engine, sql, parameters=None, row_cap=ROW_CAP, max_cost=MAX_PLAN_COST):
+    """
+    Runs one statement under the guardrails and returns (columns, rows, truncated).
+    At most `row_cap` rows are fetched; `truncated` tells whether more existed.
+    """
+    sql = sql.strip().rstrip(";")
+    started = time.perf_counter()
+    cost = None
+    try:
+        with span("sql") as attrs, engine.connect() as conn:
+            sql_to_run, cost = _checked_statement(conn, sql, parameters, row_cap, max_cost)
+            result = conn.execution_options(stream_results=True, max_row_buffer=FETCH_BATCH).execute(
+                text(sql_to_run), parameters or {}
+            )
+            columns = list(result.keys()) if result.returns_rows else []
+            rows = []
+            while result.returns_rows and len(rows) <= row_cap:
+                batch = result.fetchmany(min(FETCH_BATCH, row_cap + 1 - len(rows)))
+                if not batch:
+                    break
+                rows.extend(batch)
+            result.close()
+            attrs.update(cost=cost, rows=len(rows))
+    except SQLAlchemyError as exc:
+        logger.warning("sql failed after %.1f ms (cost %s): %s", (time.perf_counter() - started) * 1000, cost, exc)
+        raise
+    truncated = len(rows) > row_cap
+    rows = rows[:row_cap]
+    logger.info("sql ok in %.1f ms, %d rows%s, cost %.0f: %s", (time.perf_counter() - started) * 1000,
+                len(rows), " (truncated)" if truncated else "", cost, " ".join(sql.split())[:200])
+    return columns, rows, truncated
+
+class GuardedSQLDatabase(CachedSQLDatabase):
+    """CachedSQLDatabase whose queries go through run_guarded."""
+
+    def __init__(self, engine, row_cap=ROW_CAP, max_cost=MAX_PLAN_COST, **kwargs):
+        super().__init__(engine, **kwargs)
+        self.row_cap = row_cap
+        self.max_cost = max_cost
+
+    def _execute(self, command, fetch="all", *, parameters=None, execution_options=None):
+        if fetch == "cursor" or not isinstance(command, str):
+            return super()._execute(command, fetch, parameters=parameters, execution_options=execution_options)
+        row_cap = 1 if fetch == "one" else self.row_cap
+        columns, rows, truncated = run_guarded(self._engine, command, parameters, row_cap, self.max_cost)
+        records = [dict(zip(columns, row)) for row in rows]
+        if truncated:
+            records.append({columns[0]: f"... results truncated at {row_cap} rows; aggregate or filter further"})
+        return records
@@ -0,0 +1,154 @@
+# sql_template_cache.py
+#
+# Parameterized SQL template cache for the SQL agent. After the agent answers
+# a question, the last successful query it ran is stored with the question's
+# literals (WMO ids, dates, numbers, quoted names) replaced by bind parameters.
+# A later question with the same shape but different literals runs the
+# template directly against Postgres and skips the agent loop.
+
+import re
+import threading
+from collections import OrderedDict
+from sql_guard import run_guarded
+from tracing import count
+
+MAX_TEMPLATES = 256
+MAX_ANSWER_ROWS = 20
+
+# Order matters: dates before plain numbers so "2023-01-05" is one literal.
+_LITERAL_RE = re.compile(
+    r"""(?P<date>\b\d{4}-\d{2}-\d{2}\b)"""
+    r"""|(?P<str>'[^']+'|"[^"]+")"""
+    r"""|(?P<num>(?<![\w.])-?\d+(?:\.\d+)?\b)"""
+)
+
+def extract_literals(question):
+    """Returns (shape, literals) where shape is the question with literals replaced by placeholders."""
+    literals = []
+
+    def placeholder(match):
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'str':
+            value = value[1:-1]
+        literals.append((kind, value))
+        return f"<{kind}>"
+
+    shape = _LITERAL_RE.sub(placeholder, question.lower().strip())
+    shape = re.sub(r"\s+", " ", re.sub(r"[?!.,;:]+", " ", shape)).strip()
+    return shape, literals
+
+def parameterize(sql, literals):
+    """
+    Replaces each question literal in the SQL with :p<i>. Returns (template, param_kinds)
+    or None if the query cannot be templated safely.
+    """
+    values = [value for _, value in literals]
+    if len(set(values)) != len(values):
+        return None  # ambiguous which literal maps where
+
+    template, kinds = sql, {}
+    for i, (kind, value) in enumerate(literals):
+        quoted = re.compile(r"'" + re.escape(value) + r"'", re.IGNORECASE)
+        if quoted.search(template):
+            template = quoted.sub(f":p{i}", template)
+            kinds[f"p{i}"] = 'str'
+            continue
+        if kind == 'num':
+            bare = re.compile(r"(?<![\w.:'])" + re.escape(value) + r"(?![\w.'])")
+            if bare.search(template):
+                template = bare.sub(f":p{i}", template)
+                kinds[f"p{i}"] = 'num'
+    if len(kinds) != len(literals):
+        return None  # an unmapped literal would silently keep its old value
+    return template, kinds
+
+def _bind(kinds, literals):
+    params = {}
+    for name, kind in kinds.items():
+        value = literals[int(name[1:])][1]
+        if kind == 'num':
+            value = float(value) if '.' in value else int(value)
+        params[name] = value
+    return params
+
+def last_successful_query(intermediate_steps):
+    """Returns the last SQL the agent ran through sql_db_query without an error."""
+    for action, observation in reversed(intermediate_steps or []):
+        if getattr(action, 'tool', None) != 'sql_db_query':
+            continue
+        if isinstance(observation, str) and observation.startswith('Error'):
+            continue
+        tool_input = action.tool_input
+        query = tool_input.get('query') if isinstance(tool_input, dict) else tool_input
+        if query and query.lstrip().lower().startswith(('select', 'with')):
+            return query.strip().rstrip(';')
+    return None
+
+def format_rows(columns, rows):
+    """Renders query results as a short markdown answer."""
+    if not rows:
+        return "No matching data was found."
+    if len(rows) == 1 and len(columns) == 1:
+        return f"**{columns[0]}**: {rows[0][0]}"
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    lines += ["| " + " | ".join(str(v) for v in row) + " |" for row in rows[:MAX_ANSWER_ROWS]]
+    if len(rows) > MAX_ANSWER_ROWS:
+        lines.append(f"\n_{len(rows) - MAX_ANSWER_ROWS} more rows not shown._")
+    return "\n".join(lines)
+
+class SQLTemplateCache:
+    """Maps question shapes to parameterized SQL learned from the agent's own queries."""
+
+    def __init__(self, engine, max_templates=MAX_TEMPLATES):
+        self.engine = engine
+        self.max_templates = max_templates
+        self._templates = OrderedDict()  # shape -> (template, param_kinds)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def run(self, question):
+        """Answers a question from a cached template, or returns None on a miss or error."""
+        shape, literals = extract_literals(question)
+        with self._lock:
+            cached = self._templates.get(shape)
+            if cached is None:
+                self.misses += 1
+                count("cache_misses", cache="sql_template")
+                return None
+            self._templates.move_to_end(shape)
+        template, kinds = cached
+        try:
+            columns, rows, _ = run_guarded(self.engine, template, _bind(kinds, literals), row_cap=MAX_ANSWER_ROWS + 1)
+        except Exception:
+            # Drop the template and let the agent handle this question.
+            with self._lock:
+                self._templates.pop(shape, None)
+                self.errors += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            count("cache_hits", cache="sql_template")
+        return format_rows(columns, rows)
+
+    def learn(self, question, intermediate_steps):
+        """Stores a template from the agent's intermediate steps if one can be derived."""
+        sql = last_successful_query(intermediate_steps)
+        if sql is None:
+            return False
+        shape, literals = extract_literals(question)
+        parameterized = parameterize(sql, literals)
+        if parameterized is None:
+            return False
+        with self._lock:
+            self._templates[shape] = parameterized
+            self._templates.move_to_end(shape)
+            while len(self._templates) > self.max_templates:
+                self._templates.popitem(last=False)
+        return True
+
+    def stats(self):
+        return {'templates': len(self._templates), 'hits': self.hits,
+                'misses': self.misses, 'errors': self.errors}
@@ -0,0 +1,61 @@
+# startup.py
+#
+# Cold-start helpers for the Streamlit app: a phase timer that reports where
+# startup time goes, and background warm-up of slow resources (connection
+# pool, embedding model) so the first question does not pay for them.
+
+import time
+import threading
+from contextlib import contextmanager
+
+class StartupTimer:
+    """Records how long each named startup phase took."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def report(self):
+        """Returns a list of (phase, seconds) in the order they were recorded."""
+        with self._lock:
+            return list(self.phases.items())
+
+    def format_report(self):
+        lines = [f"{name:<28} {seconds * 1000:8.0f} ms" for name, seconds in self.report()]
+        return "\n".join(lines)
+
+# One timer per process, shared by every module that wants to report a phase.
+STARTUP_TIMER = StartupTimer()
+
+def warm_up_in_background(tasks, timer=STARTUP_TIMER):
+    """
+    Runs (name, callable) warm-up tasks on a daemon thread, timing each one.
+    Failures are ignored: warm-up only moves work earlier, it never adds any.
+    """
+    def run():
+        for name, task in tasks:
+            try:
+                with timer.phase(f"warm-up: {name}"):
+                    task()
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=run, name="floatchat-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def warm_pool(engine, connections=2):
+    """Opens pooled connections up front so the first queries skip the connect handshake."""
+    conns = [engine.connect() for _ in range(connections)]
+    for conn in conns:
+        conn.close()
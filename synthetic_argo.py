@@ -0,0 +1,130 @@
+# synthetic_argo.py
+#
+# Generates synthetic ARGO data for benchmarks: multi-profile `<wmo>_prof.nc`
+# files laid out like the GDAC (N_PROF x N_LEVELS, 99999 fill values, JULD in
+# days since 1950-01-01, char QC flags, fill-padded trailing levels) and a
+# matching `ar_index_global_prof.txt`.
+
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+FILL_VALUE = 99999.0
+INSTITUTIONS = ['AO', 'IN', 'CS', 'IF', 'JA']
+OCEANS = {'AO': 'A', 'IN': 'I', 'CS': 'I', 'IF': 'A', 'JA': 'P'}
+DAC = {'AO': 'aoml', 'IN': 'incois', 'CS': 'csiro', 'IF': 'coriolis', 'JA': 'jma'}
+
+def _profile_values(pressure, rng):
+    """Temperature and salinity with a plausible thermocline and halocline."""
+    temperature = 2.0 + 26.0 * np.exp(-pressure / 400.0) + rng.normal(0, 0.1, pressure.shape)
+    salinity = 34.7 + 0.8 * np.exp(-pressure / 300.0) + rng.normal(0, 0.02, pressure.shape)
+    return temperature, salinity
+
+def make_float_dataset(wmo_id, n_prof, n_levels, start='2020-01-01', bbox=(-30, 30, 30, 110), seed=0,
+                       direction='A'):
+    """Builds an ARGO-style multi-profile dataset for one float; `direction` is 'A' (ascending) or 'D'."""
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = bbox
+
+    # Each profile uses a different number of levels; the rest is fill padding.
+    depth = np.full((n_prof, n_levels), np.nan)
+    used = rng.integers(max(1, n_levels // 2), n_levels + 1, n_prof)
+    for i, n in enumerate(used):
+        depth[i, :n] = np.sort(rng.uniform(0, 2000, n))
+    temperature, salinity = _profile_values(depth, rng)
+
+    juld = np.datetime64(start, 's') + np.arange(n_prof) * np.timedelta64(10 * 86400, 's')
+    lat = np.clip(rng.uniform(min_lat, max_lat) + np.cumsum(rng.normal(0, 0.3, n_prof)), min_lat, max_lat)
+    lon = np.clip(rng.uniform(min_lon, max_lon) + np.cumsum(rng.normal(0, 0.3, n_prof)), min_lon, max_lon)
+    # A few profiles without a position fix, as in real files.
+    missing_fix = rng.random(n_prof) < 0.01
+    lat[missing_fix] = np.nan
+    lon[missing_fix] = np.nan
+
+    def levels(values):
+        # NaNs are written as the 99999 fill value by the encoding.
+        return (('N_PROF', 'N_LEVELS'), values.astype('float32'))
+
+    qc = np.where(np.isnan(depth), b' ', b'1').astype('S1')
+    ds = xr.Dataset(
+        {
+            'PLATFORM_NUMBER': (('N_PROF',), np.array([wmo_id.ljust(8).encode()] * n_prof, dtype='S8')),
+            'CYCLE_NUMBER': (('N_PROF',), np.arange(1, n_prof + 1, dtype='int32')),
+            'DIRECTION': (('N_PROF',), np.full(n_prof, direction.encode(), dtype='S1')),
+            'JULD': (('N_PROF',), juld),
+            'LATITUDE': (('N_PROF',), lat),
+            'LONGITUDE': (('N_PROF',), lon),
+            'POSITION_QC': (('N_PROF',), np.where(missing_fix, b'9', b'1').astype('S1')),
+            'PRES': levels(depth),
+            'TEMP': levels(temperature),
+            'PSAL': levels(salinity),
+            'PRES_ADJUSTED': levels(depth),
+            'TEMP_ADJUSTED': levels(temperature),
+            'PSAL_ADJUSTED': levels(salinity),
+            'PRES_QC': (('N_PROF', 'N_LEVELS'), qc),
+            'TEMP_QC': (('N_PROF', 'N_LEVELS'), qc),
+            'PSAL_QC': (('N_PROF', 'N_LEVELS'), qc),
+        },
+        attrs={'title': 'Argo float vertical profile', 'data_type': 'Argo profile', 'format_version': '3.1'},
+    )
+    return ds
+
+def _encoding(ds):
+    encoding = {'JULD': {'units': 'days since 1950-01-01 00:00:00 UTC', '_FillValue': 999999.0, 'dtype': 'float64'}}
+    for name in ('LATITUDE', 'LONGITUDE'):
+        encoding[name] = {'_FillValue': FILL_VALUE}
+    for name in ('PRES', 'TEMP', 'PSAL', 'PRES_ADJUSTED', 'TEMP_ADJUSTED', 'PSAL_ADJUSTED'):
+        encoding[name] = {'_FillValue': np.float32(FILL_VALUE)}
+    encoding['CYCLE_NUMBER'] = {'_FillValue': np.int32(99999)}
+    return encoding
+
+def write_float_file(path, wmo_id, n_prof, n_levels, **kwargs):
+    """Writes one synthetic `<wmo>_prof.nc` file (NetCDF-3 classic, like the GDAC)."""
+    ds = make_float_dataset(wmo_id, n_prof, n_levels, **kwargs)
+    ds.to_netcdf(path, format='NETCDF3_CLASSIC', encoding=_encoding(ds))
+    return ds
+
+def generate(root, n_floats=20, n_prof=50, n_levels=500, bbox=(-30, 30, 30, 110), seed=0):
+    """
+    Writes n_floats files under root/dac/<dac>/<wmo>/ and the global index at
+    root/ar_index_global_prof.txt (file paths relative to dac/, as on the
+    GDAC). Returns the index as a DataFrame.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_floats):
+        wmo_id = str(2900000 + i)
+        institution = INSTITUTIONS[i % len(INSTITUTIONS)]
+        rel_path = f"{DAC[institution]}/{wmo_id}/{wmo_id}_prof.nc"
+        local_path = os.path.join(root, 'dac', rel_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        start = pd.Timestamp('2015-01-01') + pd.Timedelta(days=int(rng.integers(0, 3000)))
+        ds = write_float_file(local_path, wmo_id, n_prof, n_levels, start=start.strftime('%Y-%m-%d'),
+                              bbox=bbox, seed=seed + i)
+        dates = pd.to_datetime(ds['JULD'].values)
+        lat, lon = ds['LATITUDE'].values, ds['LONGITUDE'].values
+        valid = ~np.isnan(lat)
+        rows.append({
+            'file': rel_path,
+            'date': dates[-1].strftime('%Y%m%d%H%M%S'),
+            'latitude': round(float(lat[valid][-1]), 3) if valid.any() else '',
+            'longitude': round(float(lon[valid][-1]), 3) if valid.any() else '',
+            'ocean': OCEANS[institution],
+            'profiler_type': 846,
+            'institution': institution,
+            'date_update': (dates[-1] + pd.Timedelta(days=1)).strftime('%Y%m%d%H%M%S'),
+        })
+
+    index = pd.DataFrame(rows)
+    with open(os.path.join(root, 'ar_index_global_prof.txt'), 'w') as f:
+        f.write("# Title : Profile directory file of the Argo Global Data Assembly Center\n"
+                "# Description : The directory file describes all individual profile files of the argo GDAC ftp site.\n"
+                "# Project : ARGO\n"
+                "# Format version : 2.0\n"
+                f"# Date of update : {pd.Timestamp.now(tz='UTC').strftime('%Y%m%d%H%M%S')}\n"
+                "# FTP root number 1 : ftp://ftp.ifremer.fr/ifremer/argo/dac\n"
+                "# FTP root number 2 : ftp://usgodae.org/pub/outgoing/argo/dac\n"
+                "# GDAC node : SYNTHETIC\n")
+        index.to_csv(f, index=False)
+    return index
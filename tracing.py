@@ -0,0 +1,301 @@
+# tracing.py
+#
+# Lightweight tracing and metrics for the hot paths (downloads, NetCDF decode,
+# database writes, LLM/tool/SQL calls). Spans aggregate into per-name timing
+# statistics and are logged to the "floatchat.trace" logger; counters track
+# rows, skipped/failed files and cache hits. Metrics render as Prometheus text
+# (optionally served over HTTP). With PROFILE_SLOWEST=N a sampling profiler
+# keeps folded stacks for the N slowest spans, ready for flamegraph.pl or
+# speedscope.
+
+import os
+import sys
+import json
+import time
+import heapq
+import logging
+import threading
+import itertools
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+PROFILE_SLOWEST = int(os.getenv("PROFILE_SLOWEST", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+logger = logging.getLogger("floatchat.trace")
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including span fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "trace", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level=logging.INFO, stream=None):
+    """Sends every floatchat.* logger to `stream` (stderr) as JSON lines."""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger("floatchat")
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    root.propagate = False
+
+class _SpanStats:
+    __slots__ = ("count", "errors", "total", "max")
+
+    def __init__(self):
+        self.count = self.errors = 0
+        self.total = self.max = 0.0
+
+class _Sampler:
+    """Samples the stacks of threads that are inside a span, attributing them to every open span."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = defaultdict(list)  # thread id -> open span samples (Counters)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enter(self):
+        samples = Counter()
+        with self._lock:
+            self.active[threading.get_ident()].append(samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="floatchat-sampler", daemon=True)
+                self._thread.start()
+        return samples
+
+    def exit(self, samples):
+        with self._lock:
+            stack = self.active[threading.get_ident()]
+            # By identity: Counters with equal contents compare equal.
+            stack[:] = [s for s in stack if s is not samples]
+            if not stack:
+                del self.active[threading.get_ident()]
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for tid, spans in self.active.items():
+                    if tid in frames:
+                        stack = self._fold(frames[tid])
+                        for samples in spans:
+                            samples[stack] += 1
+
+class Tracer:
+    """Process-wide span statistics, counters and (optional) slowest-span profiles."""
+
+    def __init__(self, profile_slowest=PROFILE_SLOWEST, profile_interval=PROFILE_INTERVAL):
+        self.spans = defaultdict(_SpanStats)
+        self.counters = Counter()
+        self.gauges = {}  # name -> callable returning the current value
+        self.profile_slowest = profile_slowest
+        self.slowest = []  # min-heap of (seconds, seq, name, attrs, folded stacks)
+        self._sampler = _Sampler(profile_interval) if profile_slowest else None
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Times the enclosed block. Yields a dict; keys added to it are logged with the span."""
+        samples = self._sampler.enter() if self._sampler else None
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            if samples is not None:
+                self._sampler.exit(samples)
+            self.record(name, time.perf_counter() - started, error=error, samples=samples, **attrs)
+
+    def record(self, name, seconds, error=None, samples=None, **attrs):
+        """Records a span that was timed elsewhere (e.g. in a worker process)."""
+        with self._lock:
+            stats = self.spans[name]
+            stats.count += 1
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            if error is not None:
+                stats.errors += 1
+            if samples:
+                entry = (seconds, next(self._seq), name, attrs, samples)
+                if len(self.slowest) < self.profile_slowest:
+                    heapq.heappush(self.slowest, entry)
+                elif seconds > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, entry)
+        fields = {"span": name, "duration_ms": round(seconds * 1000, 2), **attrs}
+        if error is not None:
+            fields["error"] = f"{type(error).__name__}: {error}"
+            logger.warning("%s failed: %s", name, fields["error"], extra={"trace": fields})
+        else:
+            logger.debug("%s took %.1f ms", name, seconds * 1000, extra={"trace": fields})
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def gauge(self, name, fn):
+        """Registers a gauge whose value is read from `fn()` at render time (e.g. a queue depth)."""
+        with self._lock:
+            self.gauges[name] = fn
+
+    def render_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            spans = sorted(self.spans.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+        families = [
+            ("floatchat_span_seconds", "summary", lambda s: [("_count", s.count), ("_sum", f"{s.total:.6f}")]),
+            ("floatchat_span_seconds_max", "gauge", lambda s: [("", f"{s.max:.6f}")]),
+            ("floatchat_span_errors_total", "counter", lambda s: [("", s.errors)]),
+        ]
+        lines = []
+        for family, kind, values in families:
+            lines.append(f"# TYPE {family} {kind}")
+            for name, stats in spans:
+                lines += [f'{family}{suffix}{{span="{name}"}} {value}' for suffix, value in values(stats)]
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE floatchat_{name}_total counter")
+            for (counter, labels), value in counters:
+                if counter == name:
+                    label = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"floatchat_{name}_total{{{label}}} {value}" if label else f"floatchat_{name}_total {value}")
+        for name, fn in gauges:
+            lines += [f"# TYPE floatchat_{name} gauge", f"floatchat_{name} {fn()}"]
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top=10):
+        """Returns (name, count, total s, mean ms, max ms, errors) for the spans with the most total time."""
+        with self._lock:
+            rows = [(name, s.count, s.total, s.total / s.count * 1000, s.max * 1000, s.errors)
+                    for name, s in self.spans.items()]
+        return sorted(rows, key=lambda row: -row[2])[:top]
+
+    def dump_profiles(self, directory=PROFILE_DIR):
+        """Writes one folded-stack file per profiled slow span; returns the paths written."""
+        with self._lock:
+            slowest = sorted(self.slowest, reverse=True)
+        if not slowest:
+            return []
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for rank, (seconds, _, name, attrs, samples) in enumerate(slowest, 1):
+            path = os.path.join(directory, f"{rank:02d}_{name.replace(' ', '_')}_{seconds * 1000:.0f}ms.folded")
+            with open(path, "w") as f:
+                f.write(f"# {name} {json.dumps(attrs, default=str)}\n")
+                for stack, n in samples.most_common():
+                    f.write(f"{stack} {n}\n")
+            paths.append(path)
+        return paths
+
+def serve_metrics(port=METRICS_PORT, tracer=None):
+    """Serves /metrics in Prometheus text format on a daemon thread."""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    tracer = tracer or TRACER
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = tracer.render_prometheus().encode()
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="floatchat-metrics", daemon=True).start()
+    return server
+
+def langchain_callbacks(tracer=None):
+    """
+    Returns a LangChain callback handler that records LLM and tool calls as
+    spans. Its `usage` dict totals the LLM calls and tokens it has seen, so one
+    handler per query gives that query's usage.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+    tracer = tracer or TRACER
+
+    class TracingCallbackHandler(BaseCallbackHandler):
+        def __init__(self):
+            self._started = {}
+            self.usage = {"llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+
+        def _start(self, run_id, name, **attrs):
+            self._started[run_id] = (time.perf_counter(), name, attrs)
+
+        def _end(self, run_id, error=None, **extra):
+            started, name, attrs = self._started.pop(run_id, (None, None, None))
+            if started is not None:
+                tracer.record(name, time.perf_counter() - started, error=error, **attrs, **extra)
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self.usage["llm_calls"] += 1
+            self._start(run_id, "llm", model=(serialized or {}).get("name"))
+
+        def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+            self.usage["llm_calls"] += 1
+            self._start(run_id, "llm", model=(serialized or {}).get("name"))
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            tokens = usage.get("total_tokens")
+            input_tokens, output_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+            if tokens is None:
+                message = getattr(response.generations[0][0], "message", None) if response.generations else None
+                metadata = getattr(message, "usage_metadata", None) or {}
+                tokens = metadata.get("total_tokens")
+                input_tokens, output_tokens = metadata.get("input_tokens"), metadata.get("output_tokens")
+            if tokens:
+                tracer.count("llm_tokens", tokens)
+                self.usage["total_tokens"] += tokens
+                self.usage["input_tokens"] += input_tokens or 0
+                self.usage["output_tokens"] += output_tokens or 0
+            self._end(run_id, tokens=tokens)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error=error)
+
+        def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+            self._start(run_id, "tool", tool=(serialized or {}).get("name"))
+
+        def on_tool_end(self, output, *, run_id, **kwargs):
+            self._end(run_id)
+
+        def on_tool_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error=error)
+
+    return TracingCallbackHandler()
+
+# One tracer per process.
+TRACER = Tracer()
+span = TRACER.span
+count = TRACER.count
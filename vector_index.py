@@ -0,0 +1,173 @@
+# vector_index.py
+#
+# Compact in-process retrieval engine for the RAG context documents.
+# Embeddings live in a memory-mapped NumPy matrix (float32 or float16) next to
+# a small JSON metadata sidecar. Small corpora are searched with one batched
+# dot product; large ones use an IVF index (k-means lists, probing the
+# nearest few). Query embeddings are kept in an LRU cache.
+
+import json
+import hashlib
+from pathlib import Path
+from functools import lru_cache
+import numpy as np
+
+INDEX_DIR = Path(__file__).with_name("vector_index")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBED_BATCH = 256
+IVF_MIN_DOCS = 4096
+IVF_PROBES = 8
+QUERY_CACHE_SIZE = 1024
+
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def load_embedding_function(model_name=EMBEDDING_MODEL):
+    """Returns (embed_documents, embed_query) backed by the project's sentence transformer."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+    model = HuggingFaceEmbeddings(model_name=model_name)
+    return model.embed_documents, model.embed_query
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def embed_in_batches(texts, embed_documents, batch_size=EMBED_BATCH):
+    """Embeds texts in batches and returns a normalized float32 matrix."""
+    batches = [embed_documents(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    return _normalize(np.concatenate([np.asarray(b, dtype=np.float32) for b in batches])) if batches else None
+
+def _kmeans(vectors, n_lists, iterations=10, seed=0):
+    """Spherical k-means on normalized vectors; returns (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = vectors[assignment == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+class VectorIndex:
+    """Normalized document embeddings plus their texts and metadata."""
+
+    def __init__(self, embeddings, documents, embed_query=None, model_name=EMBEDDING_MODEL,
+                 ivf_centroids=None, ivf_offsets=None):
+        self.embeddings = embeddings
+        self.documents = documents  # [{"text", "metadata", "hash"}]
+        self.model_name = model_name
+        self._embed_query_fn = embed_query
+        self.ivf_centroids = ivf_centroids
+        self.ivf_offsets = ivf_offsets
+        # Brute-force search converts to float32 once; only worth keeping for small corpora.
+        self._dense = np.asarray(embeddings, dtype=np.float32) if ivf_centroids is None else None
+        self._cached_query = lru_cache(maxsize=QUERY_CACHE_SIZE)(self._embed_query_uncached)
+
+    # --- Building and persistence ---
+
+    @classmethod
+    def build(cls, documents, embeddings, model_name=EMBEDDING_MODEL, dtype=np.float32, embed_query=None):
+        """Creates an index from documents and their (already normalized) embeddings.
+
+        float16 halves the file size but NumPy scores it several times slower.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        index = {}
+        if len(documents) >= IVF_MIN_DOCS:
+            n_lists = int(np.sqrt(len(documents)))
+            centroids, assignment = _kmeans(embeddings, n_lists)
+            # Store rows grouped by list so every probe reads one contiguous slice.
+            order = np.argsort(assignment, kind="stable")
+            embeddings, documents = embeddings[order], [documents[i] for i in order]
+            offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+            index = {"ivf_centroids": centroids, "ivf_offsets": offsets}
+        return cls(embeddings.astype(dtype), documents, embed_query, model_name, **index)
+
+    def save(self, directory=INDEX_DIR):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / "embeddings.npy", np.asarray(self.embeddings))
+        if self.ivf_centroids is not None:
+            np.savez(directory / "ivf.npz", centroids=self.ivf_centroids, offsets=self.ivf_offsets)
+        elif (directory / "ivf.npz").exists():
+            (directory / "ivf.npz").unlink()
+        meta = {"model": self.model_name, "dim": int(self.embeddings.shape[1]),
+                "dtype": str(self.embeddings.dtype), "documents": self.documents}
+        (directory / "metadata.json").write_text(json.dumps(meta))
+
+    @classmethod
+    def load(cls, directory=INDEX_DIR, embed_query=None):
+        """Memory-maps a saved index; the embedding model is only loaded on the first query."""
+        directory = Path(directory)
+        meta = json.loads((directory / "metadata.json").read_text())
+        embeddings = np.load(directory / "embeddings.npy", mmap_mode="r")
+        index = {}
+        if (directory / "ivf.npz").exists():
+            with np.load(directory / "ivf.npz") as ivf:
+                index = {"ivf_centroids": ivf["centroids"], "ivf_offsets": ivf["offsets"]}
+        return cls(embeddings, meta["documents"], embed_query, meta["model"], **index)
+
+    # --- Search ---
+
+    def _embed_query_uncached(self, query):
+        if self._embed_query_fn is None:
+            _, self._embed_query_fn = load_embedding_function(self.model_name)
+        vector = _normalize(self._embed_query_fn(query))
+        vector.setflags(write=False)
+        return vector
+
+    def embed_query(self, query):
+        return self._cached_query(" ".join(query.split()))
+
+    def search_vectors(self, queries, k=4):
+        """Returns (indices, scores), each shaped (n_queries, k), for a batch of query vectors."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self.documents))
+        if self.ivf_centroids is None:
+            scores = queries @ self._dense.T
+            candidates = np.broadcast_to(np.arange(len(self.documents)), scores.shape)
+        else:
+            # Probe the nearest lists and score only their (contiguous) members.
+            probes = np.argsort(-(queries @ self.ivf_centroids.T), axis=1)[:, :IVF_PROBES]
+            results = []
+            for query, lists in zip(queries, probes):
+                bounds = [(self.ivf_offsets[c], self.ivf_offsets[c + 1]) for c in lists]
+                members = np.concatenate([np.arange(lo, hi) for lo, hi in bounds])
+                member_scores = [self.embeddings[lo:hi].astype(np.float32, copy=False) @ query for lo, hi in bounds]
+                results.append((members, np.concatenate(member_scores)))
+            width = max(len(m) for m, _ in results)
+            candidates = np.full((len(queries), width), -1)
+            scores = np.full((len(queries), width), -np.inf, dtype=np.float32)
+            for row, (members, member_scores) in enumerate(results):
+                candidates[row, :len(members)] = members
+                scores[row, :len(members)] = member_scores
+            k = min(k, width)
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        return np.take_along_axis(candidates, top, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def search(self, query, k=4):
+        """Returns the k most similar documents as (document, score) pairs."""
+        indices, scores = self.search_vectors(self.embed_query(query), k)
+        return [(self.documents[i], float(s)) for i, s in zip(indices[0], scores[0]) if i >= 0]
+
+    def as_retriever(self, k=4):
+        return VectorRetriever(self, k)
+
+class VectorRetriever:
+    """Minimal retriever with the `.invoke(question)` interface the RAG agent uses."""
+
+    def __init__(self, index, k=4):
+        self.index = index
+        self.k = k
+
+    def invoke(self, question):
+        from langchain_core.documents import Document
+        return [Document(page_content=doc["text"], metadata=dict(doc.get("metadata") or {}, score=score))
+                for doc, score in self.index.search(question, self.k)]